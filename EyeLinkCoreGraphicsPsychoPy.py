@@ -31,21 +31,43 @@
 # 1. Misplacement of calibration targets on Macs
 # 2. Misalignment of crosshairs/squares and camera image
 
+# Rev. (ANM1)
+# 1. Vectorized camera image: scanlines are mapped through a NumPy palette lookup
+#    table into a preallocated frame, which is uploaded to one persistent ImageStim
+#    (vectorizedImage=False keeps the pixel-by-pixel version for comparison)
+# 2. The camera image is uploaded at its native size and enlarged by the texture
+#    sampler (non-interpolated quad), instead of being resized on the CPU
+#    (gpuScaling=False enlarges it with NumPy before the upload)
+# 3. Persistent calibration target and lozenge stimuli (lozenge vertices are
+#    scaled and translated from cached unit arcs); one flip per target or
+#    camera update
+# 4. Setup counters (camera frame rate, last image line to flip latency, key polling
+#    rate, time per calibration target, setup duration), summarized in
+#    exit_cal_display and appended to statsFile
+
 
 from __future__ import print_function
 from psychopy import visual, event, core, sound
 from numpy import linspace
-from math import sin, cos, pi
+import numpy as np
+from math import pi
 from PIL import Image
+from collections import OrderedDict
+import pandas as pd
 import array, string, pylink, os
 
 class EyeLinkCoreGraphicsPsychoPy(pylink.EyeLinkCustomDisplay):
-    def __init__(self, tracker, win):
+    def __init__(self, tracker, win, vectorizedImage=True, gpuScaling=True, statsFile=None):
         
         '''Initialize a Custom EyeLinkCoreGraphics  
         
         tracker: an eye-tracker instance
-        win: the Psychopy display we plan to use for stimulus presentation  '''
+        win: the Psychopy display we plan to use for stimulus presentation
+        vectorizedImage: build the camera image with NumPy into one persistent texture
+                         (False: pixel by pixel with a new ImageStim every frame)
+        gpuScaling: enlarge the vectorized camera image by img_scaling_factor when it is drawn
+                    (False: enlarge it on the CPU and upload the enlarged image)
+        statsFile: csv file that the summary of each setup is appended to (see setupStats)  '''
         
         pylink.EyeLinkCustomDisplay.__init__(self)
                 
@@ -72,7 +94,17 @@ class EyeLinkCoreGraphicsPsychoPy(pylink.EyeLinkCustomDisplay):
         self.imagebuffer = array.array(self.imgBuffInitType)
         self.resizeImagebuffer = array.array(self.imgBuffInitType)
         self.pal = None
+        self.vectorizedImage = vectorizedImage
+        self.gpuScaling = gpuScaling
+        self.lut = np.zeros((256, 3), dtype=np.float32)  # palette index -> PsychoPy rgb (-1 to 1)
+        self.frame = None      # camera image (rows bottom to top, as PsychoPy draws arrays)
+        self.scaledFrame = None  # camera image enlarged by img_scaling_factor (gpuScaling=False)
+        self.imageStim = None  # persistent texture of the camera image
         self.bg_color = win.color
+        self.statsFile = statsFile
+        self.setupLabel = ''    # label of the next setup in statsFile (e.g., the run it precedes)
+        self.setupStats = None  # summary of the last setup (see exit_cal_display)
+        self.reset_setup_counters()
         self.img_scaling_factor = 3
         self.size = (192*self.img_scaling_factor, 160*self.img_scaling_factor)
         
@@ -100,6 +132,22 @@ class EyeLinkCoreGraphicsPsychoPy(pylink.EyeLinkCustomDisplay):
         # lines for drawing cross hair etc.
         self.line = visual.Line(self.display, start=(0, 0), end=(0,0),
                                 lineWidth=2.0, lineColor=[0,0,0], units='pix')
+
+        # calibration target (moved to each target position)
+        self.cal_target_out = visual.GratingStim(self.display, tex='none', mask='circle',
+                                                 size=2.0/100*self.w, color=[1.0,1.0,1.0], units='pix')
+        self.cal_target_in  = visual.GratingStim(self.display, tex='none', mask='circle',
+                                                 size=2.0/300*self.w, color=[-1.0,-1.0,-1.0], units='pix')
+
+        # lozenge: unit half circles at both ends (72 points each), for wide and for tall search limits;
+        # lozengeEnd is 0 for the points of the first half circle and 1 for the second
+        wide = np.concatenate([linspace(pi/2, pi/2+pi, 72), linspace(pi/2+pi, pi/2+2*pi, 72)])
+        tall = np.concatenate([linspace(0, pi, 72), linspace(pi, 2*pi, 72)])
+        self.lozengeArcs = {True: np.column_stack([np.cos(wide), np.sin(wide)]),
+                            False: np.column_stack([np.cos(tall), np.sin(tall)])}
+        self.lozengeEnd = np.repeat([[0.0], [1.0]], 72, axis=0)
+        self.lozenge = visual.ShapeStim(self.display, vertices=self.lozengeArcs[True],
+                                        lineWidth=2.0, lineColor=[0,0,0], closeShape=True, units='pix')
         
         # set a few tracker parameters
         self.tracker=tracker
@@ -114,28 +162,85 @@ class EyeLinkCoreGraphicsPsychoPy(pylink.EyeLinkCustomDisplay):
         # let the tracker know the correct screen resolution being used
         self.tracker.sendCommand("screen_pixel_coords = 0 0 %d %d" % (self.w-1, self.h-1))
  
+    def reset_setup_counters(self):
+        '''Start new counters for a setup'''
+
+        self.setupStart = None
+        self.imageStart = None     # start of the camera image being shown
+        self.imageTime = 0.0       # time the camera image was shown
+        self.imageFrames = 0       # camera frames assembled and flipped
+        self.lastLineTime = None   # time the last line of the current camera frame arrived
+        self.lineToFlip = []       # time from the last line of each camera frame to its flip
+        self.keyPolls = 0          # get_input_key calls
+        self.targetStart = None    # time the current calibration target was shown
+        self.targetTimes = []      # time each calibration/validation target was shown
+
+    def end_cal_target(self):
+        '''Record the time the current calibration target was shown'''
+
+        if self.targetStart is not None:
+            self.targetTimes.append(core.getTime() - self.targetStart)
+            self.targetStart = None
+
+    def setup_summary(self):
+        '''Summary of the setup counters since setup_cal_display'''
+
+        setupTime = core.getTime() - self.setupStart if self.setupStart is not None else float('nan')
+        lineToFlip = np.array(self.lineToFlip) * 1000.0
+        targetTimes = np.array(self.targetTimes)
+        stats = OrderedDict()
+        stats['label'] = self.setupLabel
+        stats['setup_s'] = setupTime
+        stats['cameraFrames'] = self.imageFrames
+        stats['cameraFps'] = self.imageFrames / self.imageTime if self.imageTime > 0 else float('nan')
+        stats['lineToFlipMedian_ms'] = np.median(lineToFlip) if lineToFlip.size else float('nan')
+        stats['lineToFlipMax_ms'] = lineToFlip.max() if lineToFlip.size else float('nan')
+        stats['keyPollHz'] = self.keyPolls / setupTime if setupTime > 0 else float('nan')
+        stats['targets'] = targetTimes.size
+        stats['targetMedian_s'] = np.median(targetTimes) if targetTimes.size else float('nan')
+        stats['targetMax_s'] = targetTimes.max() if targetTimes.size else float('nan')
+        return stats
+
     def setup_cal_display(self):
         '''Set up the calibration display before entering the calibration/validation routine'''
 
+        if self.setupStart is None:
+            self.setupStart = core.getTime()
         self.display.clearBuffer()
         self.calibInst.autoDraw = True
 
-    def clear_cal_display(self):
-        '''Clear the calibration display'''
+    def clear_cal_buffer(self):
+        '''Clear the calibration display in the back buffer (shown on the next flip)'''
         
         self.calibInst.autoDraw = False
         self.title.autoDraw = False
         self.display.clearBuffer()
         self.display.color = self.bg_color
+
+    def clear_cal_display(self):
+        '''Clear the calibration display'''
+        
+        self.clear_cal_buffer()
         self.display.flip()
         
     def exit_cal_display(self):
         '''Exit the calibration/validation routine, set the screen units to
-        the original one used by the user'''
+        the original one used by the user. The setup counters are summarized in
+        setupStats and appended to statsFile'''
         
         self.display.setUnits(self.units)
         self.clear_cal_display()
 
+        self.end_cal_target()
+        if self.imageStart is not None:
+            self.imageTime += core.getTime() - self.imageStart
+            self.imageStart = None
+        self.setupStats = self.setup_summary()
+        if self.statsFile is not None:
+            writeHeader = not os.path.isfile(self.statsFile)
+            pd.DataFrame([self.setupStats]).to_csv(self.statsFile, header = writeHeader, mode = 'a', index = False)
+        self.reset_setup_counters()
+
 
     def record_abort_hide(self):
         '''This function is called if aborted'''
@@ -145,24 +250,22 @@ class EyeLinkCoreGraphicsPsychoPy(pylink.EyeLinkCustomDisplay):
     def erase_cal_target(self):
         '''Erase the calibration/validation & drift-check target'''
 
+        self.end_cal_target()
         self.clear_cal_display()
-        self.display.flip()
 
     def draw_cal_target(self, x, y):
         '''Draw the calibration/validation & drift-check  target'''
         
-        self.clear_cal_display()
+        self.clear_cal_buffer()
         xVis = (x -  self.w/2)
         yVis = (self.h/2 - y)
-        cal_target_out = visual.GratingStim(self.display, tex='none', mask='circle',
-                                            size=2.0/100*self.w, color=[1.0,1.0,1.0], units='pix')
-        cal_target_in  = visual.GratingStim(self.display, tex='none', mask='circle',
-                                            size=2.0/300*self.w, color=[-1.0,-1.0,-1.0], units='pix')
-        cal_target_out.setPos((xVis, yVis))
-        cal_target_in.setPos((xVis, yVis))
-        cal_target_out.draw()
-        cal_target_in.draw()
+        self.cal_target_out.pos = (xVis, yVis)
+        self.cal_target_in.pos = (xVis, yVis)
+        self.cal_target_out.draw()
+        self.cal_target_in.draw()
         self.display.flip()
+        self.end_cal_target()
+        self.targetStart = core.getTime()
 
     def play_beep(self, beepid):
         ''' Play a sound during calibration/drift correct.'''
@@ -212,24 +315,19 @@ class EyeLinkCoreGraphicsPsychoPy(pylink.EyeLinkCustomDisplay):
         x = (+x - self.size[0]/2)* self.img_scaling_factor       
         color = self.getColorFromIndex(colorindex)
         
-        if width > height:
+        wide = width > height
+        if wide:
             rad = height / 2
             if rad == 0: return #cannot draw the circle with 0 radius
-            Xs1 = [rad*cos(t) + x + rad for t in linspace(pi/2, pi/2+pi, 72)]
-            Ys1 = [rad*sin(t) + y - rad for t in linspace(pi/2, pi/2+pi, 72)]
-            Xs2 = [rad*cos(t) + x - rad + width for t in linspace(pi/2+pi, pi/2+2*pi, 72)]
-            Ys2 = [rad*sin(t) + y - rad for t in linspace(pi/2+pi, pi/2+2*pi, 72)]
+            shift = (width - 2*rad, 0)  # second half circle at the right end
         else:
             rad = width / 2
             if rad == 0: return #cannot draw sthe circle with 0 radius
-            Xs1 = [rad*cos(t) + x + rad for t in linspace(0, pi, 72)]
-            Ys1 = [rad*sin(t) + y - rad for t in linspace(0, pi, 72)]
-            Xs2 = [rad*cos(t) + x + rad for t in linspace(pi, 2*pi, 72)]
-            Ys2 = [rad*sin(t) + y + rad - height for t in linspace(pi, 2*pi, 72)]
+            shift = (0, -(height - 2*rad))  # second half circle at the bottom end
 
-        lozenge = visual.ShapeStim(self.display, vertices = list(zip(Xs1+Xs2, Ys1+Ys2)),
-                                    lineWidth=2.0, lineColor=color, closeShape=True, units='pix')    
-        lozenge.draw()
+        self.lozenge.vertices = rad*self.lozengeArcs[wide] + (x + rad, y - rad) + self.lozengeEnd*shift
+        self.lozenge.lineColor = color
+        self.lozenge.draw()
 
     def get_mouse_state(self):
         '''Get the current mouse position and status'''
@@ -256,6 +354,7 @@ class EyeLinkCoreGraphicsPsychoPy(pylink.EyeLinkCustomDisplay):
         ''' this function will be constantly pools, update the stimuli here is you need
         dynamic calibration target '''
         
+        self.keyPolls += 1
         ky=[]
         for keycode, modifier in event.getKeys(modifiers=True):
             k= pylink.JUNK_KEY
@@ -297,7 +396,10 @@ class EyeLinkCoreGraphicsPsychoPy(pylink.EyeLinkCustomDisplay):
     def exit_image_display(self):
         '''Clcear the camera image'''
         
-        self.clear_cal_display()
+        if self.imageStart is not None:
+            self.imageTime += core.getTime() - self.imageStart
+            self.imageStart = None
+        self.clear_cal_buffer()
         self.calibInst.autoDraw=True
         self.display.flip()
 
@@ -311,6 +413,8 @@ class EyeLinkCoreGraphicsPsychoPy(pylink.EyeLinkCustomDisplay):
         
         self.last_mouse_state = -1
         self.size = (width, height)
+        if self.imageStart is None:
+            self.imageStart = core.getTime()
         self.title.autoDraw = True
         self.calibInst.autoDraw=True
         
@@ -320,6 +424,52 @@ class EyeLinkCoreGraphicsPsychoPy(pylink.EyeLinkCustomDisplay):
         self.title.text = text
         
     def draw_image_line(self, width, line, totlines, buff):
+        '''Display image line by line'''
+
+        if line == totlines:
+            self.lastLineTime = core.getTime()
+        if not self.vectorizedImage:
+            return self.draw_image_line_pixels(width, line, totlines, buff)
+
+        self.size = (width, totlines)
+        if self.frame is None or self.frame.shape[:2] != (totlines, width):
+            # (re)allocate the frame and the texture when the camera image size changes
+            scale = self.img_scaling_factor
+            self.frame = np.zeros((totlines, width, 3), dtype=np.float32)
+            if self.gpuScaling:
+                # native-size texture drawn on a quad img_scaling_factor times larger, without interpolation
+                self.imageStim = visual.ImageStim(self.display, image=self.frame, units='pix',
+                                                  size=(width*scale, totlines*scale), interpolate=False)
+            else:
+                self.scaledFrame = np.zeros((totlines*scale, width*scale, 3), dtype=np.float32)
+                self.imageStim = visual.ImageStim(self.display, image=self.scaledFrame, units='pix',
+                                                  size=(width*scale, totlines*scale))
+
+        # map the scanline through the palette (indices outside the palette are clipped)
+        indices = np.frombuffer(buff, dtype=np.uint8, count=width) if isinstance(buff, (bytes, bytearray)) \
+            else np.asarray(buff[:width], dtype=np.intp)
+        self.lut.take(indices, axis=0, mode='clip', out=self.frame[totlines - line])
+
+        if line == totlines:
+            if self.gpuScaling:
+                self.imageStim.image = self.frame  # update the texture of the persistent stimulus
+            else:
+                scale = self.img_scaling_factor
+                self.scaledFrame.reshape(totlines, scale, width, scale, 3)[...] = self.frame[:, None, :, None, :]
+                self.imageStim.image = self.scaledFrame
+            self.imageStim.draw()
+            self.draw_cross_hair()
+            self.image_flip()
+
+    def image_flip(self):
+        '''Show an assembled camera frame and count it'''
+
+        self.display.flip()
+        self.imageFrames += 1
+        if self.lastLineTime is not None:
+            self.lineToFlip.append(core.getTime() - self.lastLineTime)
+
+    def draw_image_line_pixels(self, width, line, totlines, buff):
         '''Display image pixel by pixel, line by line'''
 
         self.size = (width, totlines)        
@@ -336,7 +486,7 @@ class EyeLinkCoreGraphicsPsychoPy(pylink.EyeLinkCustomDisplay):
             imgResizeVisual = visual.ImageStim(self.display, image=imgResize, units='pix')
             imgResizeVisual.draw()
             self.draw_cross_hair()
-            self.display.flip()
+            self.image_flip()
             self.imagebuffer = array.array(self.imgBuffInitType)
             
     def set_image_palette(self, r,g,b):
@@ -355,3 +505,8 @@ class EyeLinkCoreGraphicsPsychoPy(pylink.EyeLinkCustomDisplay):
             bf = int(r[i])
             self.pal.append((rf<<16) | (gf<<8) | (bf))
             i = i+1
+
+        # lookup table of the palette for the vectorized camera image
+        n = min(sz, len(self.lut))
+        self.lut[:] = 0
+        self.lut[:n] = np.column_stack([r[:n], g[:n], b[:n]]) / 127.5 - 1.0
@@ -19,6 +19,7 @@ import itertools
 # load experiment functions
 import generalFunctions as gf
 import questionnaires as qs
+import scheduleFunctions as sc
 
 # general experiment settings
 expName = 'ANM1_postScanner'  # experiment name
@@ -61,6 +62,12 @@ random.seed(1928)
 random.shuffle(partnerCombos)
 partnerCounterbalance = expInfo['subject'] % len(partnerCombos)
 
+# look up the subject in the cohort schedule if one was generated (see scheduleFunctions)
+cohortSchedule = sc.subject_schedule(os.path.join(os.getcwd(), sc.cohortFile), expInfo['subject'])
+if cohortSchedule is not None:
+    expInfo['counterbalance'] = int(cohortSchedule['counterbalance'])
+    partnerCounterbalance = int(cohortSchedule['partnerCounterbalance'])
+
 
 win = visual.Window(size=(1200, 700), fullscr=fullscreen, units='pix', monitor=monitor, colorSpace='rgb', color=(-1,-1,-1))
 runTimeTest = info.RunTimeInfo(win=win, refreshTest=True)
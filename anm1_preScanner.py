@@ -20,6 +20,8 @@ import smtplib
 # load experiment functions
 import generalFunctions as gf
 import questionnaires as qs
+import dataFunctions as df
+import scheduleFunctions as sc
 
 # general experiment settings
 expName = 'ANM1_preScanner'  # experiment name
@@ -62,6 +64,12 @@ random.seed(1928)
 random.shuffle(partnerCombos)
 partnerCounterbalance = expInfo['subject'] % len(partnerCombos)
 
+# look up the subject in the cohort schedule if one was generated (see scheduleFunctions)
+cohortSchedule = sc.subject_schedule(os.path.join(os.getcwd(), sc.cohortFile), expInfo['subject'])
+if cohortSchedule is not None:
+    expInfo['counterbalance'] = int(cohortSchedule['counterbalance'])
+    partnerCounterbalance = int(cohortSchedule['partnerCounterbalance'])
+
 
 win = visual.Window(size=(1200, 700), fullscr=fullscreen, units='pix', monitor=monitor, colorSpace='rgb', color=(-1,-1,-1))
 runTimeTest = info.RunTimeInfo(win=win, refreshTest=True)
@@ -184,19 +192,19 @@ waitingForScannerText = visual.TextStim(win=win, text='Waiting for scanner...',
 initialScansText = visual.TextStim(win=win, text='Taking initial scans...', pos=(0,0), color=(1,1,1), font=textFont, height=0.1, units="norm")
 
 fixation = visual.TextStim(win=win, text='+', pos=(0,0), color=(1,1,1), font=textFont, units="pix", height=70)
-probText = visual.TextStim(win=win, text='', pos=(0,0), color=(1,1,1), font=textFont, height=120, units="pix")
+probText = gf.NumericText(win=win, values=gf.probValues, pos=(0,0), color=(1,1,1), font=textFont, height=120, units="pix")
 
 # counterbalance self other sides
 if subjectConds[2] == 'left':
     selfLabel = visual.TextStim(win=win, text='You', pos=(-300,70), color=(1,1,1), font=textFont, height=60, units="pix")
     otherLabel = visual.TextStim(win=win, text='Partner', pos=(300,70), color=(1,1,1), font=textFont, height=60, units="pix")
-    selfAmount = visual.TextStim(win=win, text='00', pos=(-300, -70), color=(1,1,1), font=textFont, height=120, units="pix")
-    otherAmount = visual.TextStim(win=win, text='00', pos=(300, -70), color=(1,1,1), font=textFont, height=120, units="pix")
+    selfAmount = gf.NumericText(win=win, values=gf.amountValues, pos=(-300, -70), color=(1,1,1), font=textFont, height=120, units="pix")
+    otherAmount = gf.NumericText(win=win, values=gf.amountValues, pos=(300, -70), color=(1,1,1), font=textFont, height=120, units="pix")
 elif subjectConds[2] == 'right':
     selfLabel = visual.TextStim(win=win, text='You', pos=(300,70), color=(1,1,1), font=textFont, height=60, units="pix")
     otherLabel = visual.TextStim(win=win, text='Partner', pos=(-300,70), color=(1,1,1), font=textFont, height=60, units="pix")
-    selfAmount = visual.TextStim(win=win, text='00', pos=(300, -70), color=(1,1,1), font=textFont, height=120, units="pix")
-    otherAmount = visual.TextStim(win=win, text='00', pos=(-300, -70), color=(1,1,1), font=textFont, height=120, units="pix")
+    selfAmount = gf.NumericText(win=win, values=gf.amountValues, pos=(300, -70), color=(1,1,1), font=textFont, height=120, units="pix")
+    otherAmount = gf.NumericText(win=win, values=gf.amountValues, pos=(-300, -70), color=(1,1,1), font=textFont, height=120, units="pix")
 
 # create response keys
 respKeys = ['m', 'comma', 'period', 'slash']  # list of response keys that subjects can use
@@ -230,6 +238,12 @@ elif neuColor == (1,-1,-1):
 
 mouse = event.Mouse(visible=False, win=win)  # create mouse
 
+# data recorded on each trial of a run (see dataFunctions.TrialRecords)
+trialFields = [('overallTrialNumber', 'i4'), ('blockTrialNum', 'i4'), ('globalTime', 'f8'),
+               ('resp', 'O'), ('respNum', 'O'), ('rt', 'f8'), ('accept', 'f8'),
+               ('instructs_onset', 'f8'), ('instructsJitter_onset', 'f8'), ('need_onset', 'f8'),
+               ('jitter_onset', 'f8'), ('prop_onset', 'f8'), ('iti_onset', 'f8'), ('resp_onset', 'f8')]
+
 # ============================================================================ #
 # CUSTOM FUNCTIONS FOR TASKS
 
@@ -1029,6 +1043,7 @@ def run_decision_run(trialsDf=None, saveFile=None):
     trialsDf['prop_onset'] = np.nan
     trialsDf['iti_onset'] = np.nan
     trialsDf['resp_onset'] = np.nan
+    trialsDf['blockTrialNum'] = np.nan
     # trialsDf['implementPain'] = np.nan
 
 
@@ -1081,6 +1096,9 @@ def run_decision_run(trialsDf=None, saveFile=None):
         runNumber = 1
         trialsDf['runNumber'] = runNumber
 
+    # buffer for the data recorded on each trial (copied into trialsDf after the run)
+    trialData = df.TrialRecords(nTrials=trialsDf.shape[0], fields=trialFields)
+
     blockClock.reset()
 
     # initialize variable for storing partner on previous trial
@@ -1089,50 +1107,53 @@ def run_decision_run(trialsDf=None, saveFile=None):
     # run block trials
     for i, thisTrial in trialsDf.iterrows():
 
+        partner = thisTrial['partner']
+        blockType = thisTrial['blockType']
+
         # if new partner on this trial, give task instructions
-        if trialsDf.loc[i, 'partner'] != prevPartner:
+        if partner != prevPartner:
 
             # change partner rect cue and shape
-            if trialsDf.loc[i, 'partner'] == 'pos':
+            if partner == 'pos':
                 partnerCue = posRect
                 partnerShape = posShape
-            elif trialsDf.loc[i, 'partner'] == 'neu':
+            elif partner == 'neu':
                 partnerCue = neuRect
                 partnerShape = neuShape
-            elif trialsDf.loc[i, 'partner'] == 'neg':
+            elif partner == 'neg':
                 partnerCue = negRect
                 partnerShape = negShape
-            elif trialsDf.loc[i, 'partner'] == 'practice':
+            elif partner == 'practice':
                 partnerCue = pracRect
 
             # set pos and size
-            if trialsDf.loc[i, 'partner'] != 'practice':
+            if partner != 'practice':
                 partnerShape.pos = (0,0)
                 partnerShape.radius = 100
                 partnerCue.setAutoDraw(True)
                 partnerShape.setAutoDraw(True)
-            elif trialsDf.loc[i, 'partner'] == 'practice':
+            elif partner == 'practice':
                 partnerCue.setAutoDraw(True)
                 otherLabel.pos = (0,0)
                 otherLabel.setAutoDraw(True)
 
             # DISPLAY INSTRUCTIONS
             partnerBlockText.setAutoDraw(True)
-            trialsDf.loc[i, 'instructs_onset'] = blockClock.getTime()
+            trialData['instructs_onset'][i] = blockClock.getTime()
             timer = core.CountdownTimer(10.0)  # display for 10 secs
             while timer.getTime() > 0:
                 win.flip()
             partnerBlockText.setAutoDraw(False)
 
             # set for trials
-            if trialsDf.loc[i, 'partner'] != 'practice':
+            if partner != 'practice':
                 partnerShape.setAutoDraw(False)
                 if subjectConds[2] == 'left':
                     partnerShape.pos = (300,70)
                 elif subjectConds[2] == 'right':
                     partnerShape.pos = (-300,70)
                 partnerShape.radius = 80
-            elif trialsDf.loc[i, 'partner'] == 'practice':
+            elif partner == 'practice':
                 otherLabel.setAutoDraw(False)
                 if subjectConds[2] == 'left':
                     otherLabel.pos = (300,70)
@@ -1141,18 +1162,18 @@ def run_decision_run(trialsDf=None, saveFile=None):
 
             # INSTRUCTIONS JITTER
             fixation.setAutoDraw(True)
-            trialsDf.loc[i, 'instructsJitter_onset'] = blockClock.getTime()
-            timer = core.CountdownTimer(trialsDf.loc[i, 'instructsJitterDur'])
+            trialData['instructsJitter_onset'][i] = blockClock.getTime()
+            timer = core.CountdownTimer(thisTrial['instructsJitterDur'])
             while timer.getTime() > 0:
                 win.flip()
             fixation.setAutoDraw(False)
 
 
         global overallTrialNum
-        trialsDf.loc[i, 'overallTrialNumber'] = overallTrialNum + 1
+        trialData['overallTrialNumber'][i] = overallTrialNum + 1
         overallTrialNum += 1
 
-        trialsDf.loc[i, 'blockTrialNum'] = i + 1
+        trialData['blockTrialNum'][i] = i + 1
 
         keysPressed = []  # initialize list of keys pressed
         keyResp = None  # initialize key response as None
@@ -1160,26 +1181,26 @@ def run_decision_run(trialsDf=None, saveFile=None):
         # RTfromClock = None
 
         # set trial values
-        selfAmount.setText(str(trialsDf.loc[i, 'selfProp']))
-        otherAmount.setText(str(trialsDf.loc[i, 'otherProp']))
-        probText.setText(str(trialsDf.loc[i, 'prob']) + '%')
+        selfAmount.setText(str(thisTrial['selfProp']))
+        otherAmount.setText(str(thisTrial['otherProp']))
+        probText.setText(str(thisTrial['prob']) + '%')
 
         # get times at beginning of trial
-        trialsDf.loc[i, 'globalTime'] = globalClock.getTime()
+        trialData['globalTime'][i] = globalClock.getTime()
         # trialsDf.loc[i, 'blockTime'] = blockClock.getTime()
 
         # NEED
         probText.setAutoDraw(True)
-        trialsDf.loc[i, 'need_onset'] = blockClock.getTime()
-        timer = core.CountdownTimer(trialsDf.loc[i, 'needDur'])
+        trialData['need_onset'][i] = blockClock.getTime()
+        timer = core.CountdownTimer(thisTrial['needDur'])
         while timer.getTime() > 0:
             win.flip()
         probText.setAutoDraw(False)
 
         # JITTER
         fixation.setAutoDraw(True)
-        trialsDf.loc[i, 'jitter_onset'] = blockClock.getTime()
-        timer = core.CountdownTimer(trialsDf.loc[i, 'jitterDur'])
+        trialData['jitter_onset'][i] = blockClock.getTime()
+        timer = core.CountdownTimer(thisTrial['jitterDur'])
         while timer.getTime() > 0:
             win.flip()
         fixation.setAutoDraw(False)
@@ -1189,12 +1210,12 @@ def run_decision_run(trialsDf=None, saveFile=None):
         selfAmount.setAutoDraw(True)
         otherAmount.setAutoDraw(True)
 
-        if trialsDf.loc[i, 'partner'] != 'practice':
+        if partner != 'practice':
             partnerShape.setAutoDraw(True)
-        elif trialsDf.loc[i, 'partner'] == 'practice':
+        elif partner == 'practice':
             otherLabel.setAutoDraw(True)
 
-        if trialsDf.loc[i, 'blockType'] == 'practice':
+        if blockType == 'practice':
             for j in respKeys:
                 respOptions[j].setAutoDraw(True)
 
@@ -1202,19 +1223,19 @@ def run_decision_run(trialsDf=None, saveFile=None):
         event.clearEvents()  # clear events
 
         # display proposal and collect response
-        trialsDf.loc[i, 'prop_onset'] = blockClock.getTime()
-        timer = core.CountdownTimer(trialsDf.loc[i, 'propDur'])
+        trialData['prop_onset'][i] = blockClock.getTime()
+        timer = core.CountdownTimer(thisTrial['propDur'])
         while timer.getTime() > 0:
             keysPressed = event.getKeys(keyList=respKeys, timeStamped=rtClock)  # load keys that have been pressed
 
             if len(keysPressed) > 0:  # check if a key has been pressed yet
                 if keyResp is None:  # check if another key response has already been recorded
-                    trialsDf.loc[i, 'resp_onset'] = blockClock.getTime()
+                    trialData['resp_onset'][i] = blockClock.getTime()
                     keyResp, RT = keysPressed[0]  # access first key response and corresponding RT
                     # RTfromClock = rtClock.getTime()  # record RT from rtClock
 
                     respRect.setAutoDraw(True)
-                    if trialsDf.loc[i, 'blockType'] == 'practice':
+                    if blockType == 'practice':
                         # change color of option selected
                         selectedOption = respOptions[keyResp]
                         selectedOption.color = (-1, 1, -1)
@@ -1227,12 +1248,12 @@ def run_decision_run(trialsDf=None, saveFile=None):
         otherAmount.setAutoDraw(False)
         respRect.setAutoDraw(False)
 
-        if trialsDf.loc[i, 'partner'] != 'practice':
+        if partner != 'practice':
             partnerShape.setAutoDraw(False)
-        elif trialsDf.loc[i, 'partner'] == 'practice':
+        elif partner == 'practice':
             otherLabel.setAutoDraw(False)
 
-        if trialsDf.loc[i, 'blockType'] == 'practice':
+        if blockType == 'practice':
             for j in respKeys:
                 respOptions[j].setAutoDraw(False)
             # change back color of selected option
@@ -1240,28 +1261,26 @@ def run_decision_run(trialsDf=None, saveFile=None):
                 selectedOption.color = (1,1,1)
 
         # set current partner as previous partner
-        prevPartner = trialsDf.loc[i, 'partner']
+        prevPartner = partner
 
 
         # RECORD DATA
         # code response as accept or reject
         if keyResp in acceptKeys:
-            trialsDf.loc[i, 'accept'] = 1
+            trialData['accept'][i] = 1
         elif keyResp in rejectKeys:
-            trialsDf.loc[i, 'accept'] = 0
-        else:
-            trialsDf.loc[i, 'accept'] = np.nan
+            trialData['accept'][i] = 0
 
-        # append data to data frame
-        trialsDf.loc[i, 'resp'] = keyResp
+        # append data to trial buffer
+        trialData['resp'][i] = keyResp
         if keyResp is not None:
-            trialsDf.loc[i, 'respNum'] = respDecode[keyResp]
-        trialsDf.loc[i, 'rt'] = RT
+            trialData['respNum'][i] = respDecode[keyResp]
+            trialData['rt'][i] = RT
 
         # ITI
         fixation.setAutoDraw(True)
-        trialsDf.loc[i, 'iti_onset'] = blockClock.getTime()
-        timer = core.CountdownTimer(trialsDf.loc[i, 'itiDur'])
+        trialData['iti_onset'][i] = blockClock.getTime()
+        timer = core.CountdownTimer(thisTrial['itiDur'])
         while timer.getTime() > 0:
             win.flip()
         fixation.setAutoDraw(False)
@@ -1271,6 +1290,9 @@ def run_decision_run(trialsDf=None, saveFile=None):
     negRect.setAutoDraw(False)
     pracRect.setAutoDraw(False)
 
+    # copy the trial buffer into the data frame
+    trialData.store(trialsDf)
+
     trialsDf['endTime'] = str(time.strftime('%Y-%m-%d-%H-%M-%S', time.localtime()))
 
     # append block data to save file
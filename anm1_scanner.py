@@ -17,10 +17,16 @@ from psychopy.preferences import prefs
 prefs.general['shutdownKey'] = 'escape' # set experiment escape key
 from psychopy import visual, core, event, data, gui, logging, info, monitors
 import itertools
+from collections import OrderedDict
 
 # load experiment functions
 import generalFunctions as gf
 import questionnaires as qs
+import timingFunctions as tf
+import dataFunctions as df
+import scheduleFunctions as sc
+import eyeTrackerFunctions as ef
+import monitorFunctions as mf
 from EyeLinkCoreGraphicsPsychoPy import EyeLinkCoreGraphicsPsychoPy
 
 
@@ -30,7 +36,7 @@ class EyeLinkNoOutput(pylink.EyeLink):
         pylink.EyeLink.__init__(self, ipaddr)
 
     def progressUpdate(self, arg1, arg2):
-        pass
+        self.transferProgress = (arg1, arg2)  # size and received bytes of the data file transfer (shown by ef.EdfRotation)
 
 
 # general experiment settings
@@ -44,6 +50,13 @@ screenToUse = 1
 overallTrialNum = 0  # initialize overall trial number to be 0
 textFont = 'Arial'
 scannerTrigger = '5'
+scannerTR = None  # TR in seconds (None: estimate from the recorded triggers)
+precompositeChoice = True  # draw the static parts of the choice screen as one cached texture
+realTimeMode = True  # disable GC, raise priority, pin CPUs and defer log flushes while the scanner is running
+realTimeCPUs = None  # cores for the experiment during runs (None: all but the first core)
+clockSyncInterval = 1.0  # time (s) between samples of the tracker clock during runs
+liveMonitor = True  # show responses, missed trials, frame drops and tracker status on a dashboard in a separate process
+rotateEdf = True  # one EDF file per run, received in the background while the participant rests
 
 
 # set up counterbalances
@@ -68,10 +81,13 @@ elif not DEBUG:
 
 
 # present dialogue box for subject info
-expInfo = gf.subject_info(entries=['subject', 'fileNumber', 'runNumber', 'saveFile'], debug=DEBUG,
-                          debugValues=[999, 1, 0, ''], expName=expName, expVersion=expVersion,
+expInfo = gf.subject_info(entries=['subject', 'fileNumber', 'runNumber', 'saveFile', 'resume'], debug=DEBUG,
+                          debugValues=[999, 1, 0, '', 0], expName=expName, expVersion=expVersion,
                           counterbalance=nCondCombos)
 
+# resume the first run from its journal (continue from the next unfinished trial)
+expInfo['resume'] = str(expInfo['resume']).strip().lower() in ['1', 'y', 'yes', 'true']
+
 if expInfo['fileNumber'] is None or expInfo['fileNumber'] == '':
     expInfo['fileNumber'] = 1
 
@@ -110,6 +126,11 @@ else:
     # prevData = pd.read_csv(saveFilename)
     # lastRunNumber = max(prevData['runNumber'])
 
+# live experimenter dashboard (monitorFunctions.py), fed with a record of every trial through shared memory
+monitor = mf.MonitorWriter(os.path.join(saveDir, "%04d_%s_%s_monitor.bin") %(int(expInfo['subject']), expInfo['startTime'], expInfo['expName']))
+if liveMonitor:
+    mf.launch_dashboard(monitor.fileName)
+
 
 ###### SETUP EYELINK ######
 
@@ -139,6 +160,12 @@ neu_resps = [121,122,123,124]
 neg_resps = [111,112,113,114]
 no_resp = 99
 
+# data recorded on each trial of a run (see dataFunctions.TrialRecords)
+trialFields = [('overallTrialNumber', 'i4'), ('blockTrialNum', 'i4'), ('globalTime', 'f8'),
+               ('resp', 'O'), ('respNum', 'O'), ('rt', 'f8'), ('accept', 'f8'), ('resp_onset', 'f8'),
+               ('instructsTTL', 'f8'), ('fixTTL', 'f8'), ('needTTL', 'f8'), ('propTTL', 'f8'), ('respTTL', 'f8'),
+               ('lateResp', 'O'), ('lateRespNum', 'O'), ('lateRT', 'f8'), ('lateResp_onset', 'f8'), ('nLateResps', 'i4')]
+
 
 if not dummyMode:
     tk = EyeLinkNoOutput('100.1.1.1')
@@ -153,9 +180,11 @@ if not os.path.exists(edfFolder):
     os.makedirs(edfFolder)
 
 edfFileName = edfName + str(expInfo['subject']) + '_' + str(expInfo['fileNumber']) + '.EDF'
-tk.openDataFile(edfFileName)
 # add personalized data file header (preamble text)
-tk.sendCommand("add_file_preamble_text '%s'" %(expName + " v" + str(expVersion) + " file_" + str(expInfo['fileNumber'])))
+edfFiles = ef.EdfRotation(tk, folder=edfFolder, fileName=edfFileName, rotate=rotateEdf,
+                          subject=int(expInfo['subject']), fileNumber=int(expInfo['fileNumber']),
+                          preamble=expName + " v" + str(expVersion) + " file_" + str(expInfo['fileNumber']))
+edfFiles.open()
 
 if DEBUG:
     scnWidth, scnHeight = (1200, 700)
@@ -167,7 +196,7 @@ win = visual.Window(size=(scnWidth, scnHeight), fullscr=fullscreen, units='pix',
 
 # call the custom calibration routine "EyeLinkCoreGraphicsPsychopy.py", instead of the default
 # routines that were implemented in SDL
-genv = EyeLinkCoreGraphicsPsychoPy(tk, win)
+genv = EyeLinkCoreGraphicsPsychoPy(tk, win, statsFile=os.path.join(edfFolder, os.path.splitext(edfFileName)[0] + '_setup.csv'))
 pylink.openGraphicsEx(genv)
 
 # STEP V: Set up the tracker
@@ -183,7 +212,7 @@ tk.sendCommand("screen_pixel_coords = 0 0 %d %d" % (scnWidth-1, scnHeight-1))
 
 # save display resolution in EDF data file for Data Viewer integration purposes
 # [see Data Viewer User Manual, Section 7: Protocol for EyeLink Data to Viewer Integration]
-tk.sendMessage("DISPLAY_COORDS = 0 0 %d %d" % (scnWidth-1, scnHeight-1))
+edfFiles.send_header("DISPLAY_COORDS = 0 0 %d %d" % (scnWidth-1, scnHeight-1))  # repeated in every rotated data file
 
 # specify the calibration type, H3, HV3, HV5, HV13 (HV = horiztonal/vertical),
 tk.sendCommand("calibration_type = HV5") # tk.setCalibrationType('HV9') also works, see the Pylink manual
@@ -229,6 +258,12 @@ random.seed(1928)
 random.shuffle(partnerCombos)
 partnerCounterbalance = expInfo['subject'] % len(partnerCombos)
 
+# look up the subject in the cohort schedule if one was generated (see scheduleFunctions)
+cohortSchedule = sc.subject_schedule(os.path.join(os.getcwd(), sc.cohortFile), expInfo['subject'])
+if cohortSchedule is not None:
+    expInfo['counterbalance'] = int(cohortSchedule['counterbalance'])
+    partnerCounterbalance = int(cohortSchedule['partnerCounterbalance'])
+
 runTimeTest = info.RunTimeInfo(win=win, refreshTest=True)
 currRefreshRate = runTimeTest['windowRefreshTimeAvg_ms'] / 1000
 print currRefreshRate
@@ -244,6 +279,17 @@ payInfo = os.path.join(saveDir, "%04d_payInfo.txt") %(int(expInfo['subject']))
 logFilename = os.path.join(saveDir, "%04d_%s_%s.log") %(int(expInfo['subject']), expInfo['startTime'], expInfo['expName'])
 logfile = logging.LogFile(logFilename, filemode = 'w', level = logging.EXP) #set logging information (core.quit() is required at the end of experiment to store logging info!!!)
 
+# load the subject's schedule (counterbalancing, practice block and runs) if an earlier session generated it
+scheduleFile = os.path.join(saveDir, "%04d_%s_schedule.npz") %(int(expInfo['subject']), expInfo['expName'])
+scheduleSources = [os.path.join(os.getcwd(), 'stim', f) for f in ['anm1_partner1_trials.csv', 'anm1_partner2_trials.csv', 'anm1_partner3_trials.csv', 'anm1_practice2_trials.csv']]
+savedSchedule, savedScheduleInfo = df.load_schedule(scheduleFile)
+if savedSchedule is not None:
+    if savedScheduleInfo['sourceHash'] != df.hash_files(scheduleSources):
+        logging.warning('Stimulus files changed since the schedule was generated; using the saved schedule: %s' %(scheduleFile))
+    expInfo['counterbalance'] = savedScheduleInfo['counterbalance']
+    partnerCounterbalance = savedScheduleInfo['partnerCounterbalance']
+    logging.exp('Loaded schedule: %s' %(scheduleFile))
+
 # create clocks for timing
 globalClock = core.Clock()
 blockClock = core.Clock()
@@ -303,23 +349,24 @@ neuBlocks['blockSet'] = blockSets[subjectConds[1][1]]
 negBlocks['blockSet'] = blockSets[subjectConds[1][2]]
 
 
-# load practice block
-pracBlock = pd.read_csv(os.path.join(os.getcwd(), 'stim', 'anm1_practice2_trials.csv'))
-pracBlock = pracBlock.loc[range(18),:]  # trim to just 18 trials (even 3-way split)
-pracPartnerOrder = ['pos', 'neu', 'neg']
-random.shuffle(pracPartnerOrder)  # randomly order partners
-pracBlock.loc[range(0,6), 'partner'] = pracPartnerOrder[0]  # label partners
-pracBlock.loc[range(6,12), 'partner'] = pracPartnerOrder[1]
-pracBlock.loc[range(12,18), 'partner'] = pracPartnerOrder[2]
-pracBlock['blockSet'] = 'anm1_practice2_trials.csv'
-pracBlock['instructsDur'] = 0
-pracBlock['instructsJitterDur'] = 0
-pracBlock.loc[[0,6,12], 'instructsDur'] = 10.0
-pracBlock.loc[[0,6,12], 'instructsJitterDur'] = random.sample([1.5, 2.5, 3.5], 3)
-pracBlock['partnerBlockTrialNum'] = [1,2,3,4,5,6] * 3
-pracBlock['partnerBlockNum'] = 0
-pracBlock['overallPartnerTrialNum'] = 0
-pracBlock = pracBlock.reindex_axis(sorted(pracBlock.columns), axis=1)  # sort columns alphabetically
+# load practice block (generated once per subject, see scheduleFile)
+if savedSchedule is None:
+    pracBlock = pd.read_csv(os.path.join(os.getcwd(), 'stim', 'anm1_practice2_trials.csv'))
+    pracBlock = pracBlock.loc[range(18),:]  # trim to just 18 trials (even 3-way split)
+    pracPartnerOrder = ['pos', 'neu', 'neg']
+    random.shuffle(pracPartnerOrder)  # randomly order partners
+    pracBlock.loc[range(0,6), 'partner'] = pracPartnerOrder[0]  # label partners
+    pracBlock.loc[range(6,12), 'partner'] = pracPartnerOrder[1]
+    pracBlock.loc[range(12,18), 'partner'] = pracPartnerOrder[2]
+    pracBlock['blockSet'] = 'anm1_practice2_trials.csv'
+    pracBlock['instructsDur'] = 0
+    pracBlock['instructsJitterDur'] = 0
+    pracBlock.loc[[0,6,12], 'instructsDur'] = 10.0
+    pracBlock.loc[[0,6,12], 'instructsJitterDur'] = random.sample([1.5, 2.5, 3.5], 3)
+    pracBlock['partnerBlockTrialNum'] = [1,2,3,4,5,6] * 3
+    pracBlock['partnerBlockNum'] = 0
+    pracBlock['overallPartnerTrialNum'] = 0
+    pracBlock = pracBlock.reindex_axis(sorted(pracBlock.columns), axis=1)  # sort columns alphabetically
 
 ## settings for dictator game
 dflt = 20  # default outcome amount
@@ -333,23 +380,24 @@ respRect = visual.Rect(win=win, pos=(0,20), width=850, height=350, lineWidth=10,
 partnerBlockText = visual.TextStim(win=win, text='For the following trials, your partner will be:', pos=(0,250), color=(1,1,1), font=textFont, height=50, units="pix", wrapWidth=1000)
 pauseText = visual.TextStim(win=win, text='Please take a moment to rest', pos=(0,0), color=(1,1,1), font=textFont, height=50, units="pix", wrapWidth=1200)
 preparingScannerText = visual.TextStim(win=win, text='Preparing scanner...', pos=(0,0), color=(1,1,1), font=textFont, height=50, units="pix")
+edfTransferText = visual.TextStim(win=win, text='', pos=(0,-300), color=(0,0,0), font=textFont, height=30, units="pix")
 waitingForScannerText = visual.TextStim(win=win, text='Waiting for scanner...', pos=(0,0), color=(1,1,1), font=textFont, height=50, units="pix")
 initialScansText = visual.TextStim(win=win, text='Taking initial scans...', pos=(0,0), color=(1,1,1), font=textFont, height=50, units="pix")
 
 fixation = visual.TextStim(win=win, text='+', pos=(0,0), color=(1,1,1), font=textFont, units="pix", height=70)
-probText = visual.TextStim(win=win, text='', pos=(0,0), color=(1,1,1), font=textFont, height=120, units="pix")
+probText = gf.NumericText(win=win, values=gf.probValues, pos=(0,0), color=(1,1,1), font=textFont, height=120, units="pix")
 
 # counterbalance self other sides
 if subjectConds[2] == 'left':
     selfLabel = visual.TextStim(win=win, text='You', pos=(-300,70), color=(1,1,1), font=textFont, height=60, units="pix")
     otherLabel = visual.TextStim(win=win, text='Partner', pos=(300,70), color=(1,1,1), font=textFont, height=60, units="pix")
-    selfAmount = visual.TextStim(win=win, text='00', pos=(-300, -70), color=(1,1,1), font=textFont, height=120, units="pix")
-    otherAmount = visual.TextStim(win=win, text='00', pos=(300, -70), color=(1,1,1), font=textFont, height=120, units="pix")
+    selfAmount = gf.NumericText(win=win, values=gf.amountValues, pos=(-300, -70), color=(1,1,1), font=textFont, height=120, units="pix")
+    otherAmount = gf.NumericText(win=win, values=gf.amountValues, pos=(300, -70), color=(1,1,1), font=textFont, height=120, units="pix")
 elif subjectConds[2] == 'right':
     selfLabel = visual.TextStim(win=win, text='You', pos=(300,70), color=(1,1,1), font=textFont, height=60, units="pix")
     otherLabel = visual.TextStim(win=win, text='Partner', pos=(-300,70), color=(1,1,1), font=textFont, height=60, units="pix")
-    selfAmount = visual.TextStim(win=win, text='00', pos=(300, -70), color=(1,1,1), font=textFont, height=120, units="pix")
-    otherAmount = visual.TextStim(win=win, text='00', pos=(-300, -70), color=(1,1,1), font=textFont, height=120, units="pix")
+    selfAmount = gf.NumericText(win=win, values=gf.amountValues, pos=(300, -70), color=(1,1,1), font=textFont, height=120, units="pix")
+    otherAmount = gf.NumericText(win=win, values=gf.amountValues, pos=(-300, -70), color=(1,1,1), font=textFont, height=120, units="pix")
 
 
 # create response keys
@@ -394,6 +442,12 @@ respHandImage = visual.ImageStim(win=win, pos=(0,-270), image=respHandImageFile,
 
 mouse = event.Mouse(visible=False, win=win)  # create mouse
 
+# cached choice screens (static layers for each partner block)
+choiceScreen = gf.ScreenCompositor(win=win, precomposite=precompositeChoice)
+
+# protections for the time-critical part of each run
+realTime = tf.RealTimeMode(enabled=realTimeMode, cpus=realTimeCPUs)
+
 # ============================================================================ #
 # CUSTOM FUNCTIONS FOR TASKS
 
@@ -410,13 +464,14 @@ def initial_scans():
     event.clearEvents()
 
 
-def generate_runs(posBlocks=None, neuBlocks=None, negBlocks=None):
+def generate_runs(posBlocks=None, neuBlocks=None, negBlocks=None, cohortSchedule=None):
     ''' Function to generate runs for presentation
 
     Args:
         posBlocks (data frame): pandas data frame of positive partner blocks
         neuBlocks (data frame): pandas data frame of neutral partner blocks
         negBlocks (data frame): pandas data frame of negative partner blocks
+        cohortSchedule (dict): subject's schedule from the cohort file (block, jitter and partner orders). If None, the orders are drawn here.
     '''
 
     posBlocks = posBlocks.copy()
@@ -428,9 +483,12 @@ def generate_runs(posBlocks=None, neuBlocks=None, negBlocks=None):
     negBlockOrder = [1, 2, 3, 4, 5]
 
     random.seed(expInfo['subject'])
-    random.shuffle(posBlockOrder)
-    random.shuffle(neuBlockOrder)
-    random.shuffle(negBlockOrder)
+    if cohortSchedule is None:
+        random.shuffle(posBlockOrder)
+        random.shuffle(neuBlockOrder)
+        random.shuffle(negBlockOrder)
+    else:
+        posBlockOrder, neuBlockOrder, negBlockOrder = [list(order) for order in cohortSchedule['blockOrder']]
 
     runs = {}
 
@@ -452,7 +510,10 @@ def generate_runs(posBlocks=None, neuBlocks=None, negBlocks=None):
         negBlock['instructsJitterDur'] = 0
 
         instructsJitters = [1.5, 2.5, 3.5]
-        random.shuffle(instructsJitters)
+        if cohortSchedule is None:
+            random.shuffle(instructsJitters)
+        else:
+            instructsJitters = list(cohortSchedule['instructsJitters'][run])
         posBlock.loc[0, 'instructsDur'] = 10.0
         neuBlock.loc[0, 'instructsDur'] = 10.0
         negBlock.loc[0, 'instructsDur'] = 10.0
@@ -462,7 +523,10 @@ def generate_runs(posBlocks=None, neuBlocks=None, negBlocks=None):
         negBlock.loc[0, 'instructsJitterDur'] = instructsJitters[2]
 
         blocks = [posBlock, neuBlock, negBlock]
-        random.shuffle(blocks)
+        if cohortSchedule is None:
+            random.shuffle(blocks)
+        else:
+            blocks = [blocks[p] for p in cohortSchedule['partnerOrder'][run]]
 
         runs[run] = pd.concat(blocks, ignore_index=True)
 
@@ -472,14 +536,111 @@ def generate_runs(posBlocks=None, neuBlocks=None, negBlocks=None):
     return runs
 
 
-def run_decision_run(trialsDf=None, saveFile=None):
+def save_run_triggers(trigListener=None, trialsDf=None, runNumber=0, runLabel='run', firstTrial=0):
+    ''' Write the TR table of a run and add the volume acquired at each onset to the trial data
+
+    Args:
+        trigListener (TriggerListener): listener that recorded the triggers of the run
+        trialsDf (data frame): pandas data frame of the run's trials
+        runNumber (int): run number from the dialog
+        runLabel (str): label of the run used in the file name (e.g., 'practice', 'run1')
+        firstTrial (int): first trial presented after the triggers started (earlier trials were restored from the journal)
+    '''
+    trTable = trigListener.tr_table()
+    trTable['subject'] = expInfo['subject']
+    trTable['runNumber'] = runNumber
+    trTable['runLabel'] = runLabel
+
+    # a version suffix is added only if the run's file already exists (e.g., the run was restarted)
+    trFile = os.path.join(saveDir, "%04d_%s_%s_TRs_%s.csv") %(int(expInfo['subject']), expInfo['startTime'], expInfo['expName'], runLabel)
+    v = 1
+    while os.path.isfile(trFile):
+        v += 1
+        trFile = os.path.join(saveDir, "%04d_%s_%s_TRs_%s_%d.csv") %(int(expInfo['subject']), expInfo['startTime'], expInfo['expName'], runLabel, v)
+    trTable.to_csv(trFile, header = True, mode = 'w', index = False)
+
+    # volume acquired at each event onset
+    rows = trialsDf.index[firstTrial:]
+    for phase in tf.schedulePhases + ['resp']:
+        trialsDf.loc[rows, phase + '_volumeIndex'] = trigListener.volume_index(trialsDf.loc[rows, phase + '_onset'].values)
+
+    trigSummary = trigListener.summary()
+    trialsDf['nTriggers'] = trigSummary['nTriggers']
+    trialsDf['missedTriggers'] = trigSummary['missedTriggers']
+    trialsDf['extraTriggers'] = trigSummary['extraTriggers']
+    trialsDf['TR'] = trigSummary['TR']
+
+
+def clock_sync_columns(clockSync=None, runZero=0.0):
+    ''' Stop sampling the tracker clock and fit its offset and drift for the run
+
+    Tracker time (ms) of an onset (s, relative to the scanner trigger) is
+    clockSync_trackerAtZero_ms + clockSync_rate * onset, and of a globalTime is
+    clockSync_trackerAtGlobalZero_ms + clockSync_rate * globalTime (see ef.tracker_time).
+
+    Args:
+        clockSync (ef.ClockSync): clock samples of the run
+        runZero (float): core.getTime at the scanner trigger
+    '''
+    clockSync.stop()
+    model = clockSync.fit(zero=runZero)
+    globalZero = core.getTime() - globalClock.getTime()  # core.getTime when globalClock was reset
+    columns = OrderedDict(('clockSync_' + col, value) for col, value in model.items())
+    columns['clockSync_trackerAtGlobalZero_ms'] = model['trackerAtZero_ms'] + model['rate'] * (globalZero - runZero)
+    return columns
+
+
+def choice_screen_stims(partner=None, blockType=None):
+    ''' Static stimuli of the choice screen for a partner block, positioned for the trials
+
+    Args:
+        partner (str): partner of the block ('pos', 'neu', 'neg' or 'practice')
+        blockType (str): block type (response options are shown in 'practice' blocks)
+    '''
+    partnerCue = {'pos': posRect, 'neu': neuRect, 'neg': negRect, 'practice': pracRect}[partner]
+    stims = [partnerCue, selfLabel]
+
+    if partner != 'practice':
+        partnerShape = {'pos': posShape, 'neu': neuShape, 'neg': negShape}[partner]
+        if subjectConds[2] == 'left':
+            partnerShape.pos = (300,70)
+        elif subjectConds[2] == 'right':
+            partnerShape.pos = (-300,70)
+        partnerShape.radius = 80
+        stims.append(partnerShape)
+    elif partner == 'practice':
+        if subjectConds[2] == 'left':
+            otherLabel.pos = (300,70)
+        elif subjectConds[2] == 'right':
+            otherLabel.pos = (-300,70)
+        stims.append(otherLabel)
+
+    if blockType == 'practice':
+        for j in respKeys:
+            stims.append(respOptions[j])
+
+    return stims
 
-    # write header to csv or not? Default is not to write header. Try to read csv file from working directory. If fail to read csv (it hasn't been created yet), then the csv has to be created for the study and the header has to be written.
-    writeHeader = False
-    try:  # try reading csv file dimensions (rows = no. of trials)
-        pd.read_csv(saveFile)
-    except:  # if fail to read csv, then it's trial 1
-        writeHeader = True
+
+def prepare_run(trialsDf=None, saveFile=None, completedTrials=None, journal=None, prepared=None):
+    ''' Build everything a run needs before the scanner starts, one step at a time (see gf.Prefetcher)
+
+    The steps are run between the flips of the rest and scanner preparation screens, so the data frame, schedule,
+    record buffers, choice screens and stimuli of the run are ready when the scanner trigger arrives.
+
+    Args:
+        trialsDf (DataFrame): trials of the run
+        saveFile (str): file the data of the run is appended to
+        completedTrials (dict): trials restored from the journal (row: data)
+        journal (TrialJournal): journal of the run
+        prepared (dict): filled with writeHeader, runNumber, firstTrial, schedule and trialData of the run
+    '''
+
+    global overallTrialNum
+
+    # write header to csv or not? The header has to be written if the csv hasn't been created yet (or is empty). Only the file size is checked, so the data of earlier runs is not read.
+    prepared['writeHeader'] = not (os.path.isfile(saveFile) and os.path.getsize(saveFile) > 0)
+    yield 'header'
 
     # store additional info in data frame
     trialsDf['accept'] = np.nan
@@ -512,8 +673,116 @@ def run_decision_run(trialsDf=None, saveFile=None):
     trialsDf['needTTL'] = np.nan
     trialsDf['propTTL'] = np.nan
     trialsDf['respTTL'] = np.nan
+    trialsDf['lateResp'] = None
+    trialsDf['lateRespNum'] = None
+    trialsDf['lateRT'] = np.nan
+    trialsDf['lateResp_onset'] = np.nan
+    trialsDf['nLateResps'] = 0
+    trialsDf['resumed'] = 0
+    trialsDf['blockTrialNum'] = np.nan
+    for col in tf.timing_column_names():  # keep a fixed column order for appending runs
+        if col not in trialsDf.columns:
+            trialsDf[col] = np.nan
     # trialsDf['implementPain'] = np.nan
+    yield 'columns'
 
+    # Assign runNumber based on existing csv file. Read the csv file and find the largest block number and add 1 to it to reflect this block's number.
+    # try:
+    #     runNumber = max(pd.read_csv(saveFile)['runNumber']) + 1
+    #     trialsDf['runNumber'] = runNumber
+    # except:  # if fail to read csv, then it's block 1
+    #     runNumber = 1
+    #     trialsDf['runNumber'] = runNumber
+
+    # Assign runNumber
+    runNumber = expInfo['runNumber']
+    trialsDf['runNumber'] = runNumber
+    prepared['runNumber'] = runNumber
+
+    # restore trials completed before the crash and continue from the next unfinished trial
+    firstTrial = 0
+    if len(completedTrials) > 0:
+        restored = pd.DataFrame.from_dict(completedTrials, orient='index')
+        for col in trialsDf.columns.intersection(restored.columns):
+            trialsDf.loc[restored.index, col] = restored[col].values
+        firstTrial = max(completedTrials.keys()) + 1
+        overallTrialNum += firstTrial
+        if firstTrial < trialsDf.shape[0]:
+            # reintroduce the partner before the first resumed trial
+            trialsDf.loc[firstTrial, 'instructsDur'] = 10.0
+            if trialsDf.loc[firstTrial, 'instructsJitterDur'] == 0:
+                trialsDf.loc[firstTrial, 'instructsJitterDur'] = 2.5
+            trialsDf.loc[firstTrial:, 'resumed'] = 1
+        journal.write_resume(firstTrial)
+    prepared['firstTrial'] = firstTrial
+    yield 'resume'
+
+    # compile phase durations into absolute onsets (relative to the scanner trigger) at the measured refresh rate
+    prepared['schedule'] = tf.RunScheduler(win=win, trialsDf=trialsDf, frameDur=currRefreshRate, clock=blockClock, endFixDur=10.0, firstTrial=firstTrial)
+    yield 'schedule'
+
+    # buffer for the data recorded on each trial (copied into trialsDf after the run)
+    prepared['trialData'] = df.TrialRecords(nTrials=trialsDf.shape[0], fields=trialFields)
+    yield 'records'
+
+    # build the choice screen of every partner block (the capture is cleared from the back buffer)
+    choiceScreen.reset_stats()
+    for partner, blockType in trialsDf[['partner', 'blockType']].drop_duplicates().values:
+        choiceScreen.compose((partner, subjectConds[2], respOrder, blockType), choice_screen_stims(partner, blockType))
+        yield 'choiceScreens'
+
+    # draw the stimuli of the run once into the back buffer (cleared before the next flip), so none is drawn for the first time during a trial
+    for partner in trialsDf['partner'].unique():
+        {'pos': posRect, 'neu': neuRect, 'neg': negRect, 'practice': pracRect}[partner].draw()
+        if partner != 'practice':
+            partnerShape = {'pos': posShape, 'neu': neuShape, 'neg': negShape}[partner]
+            partnerShape.pos = (0,0)
+            partnerShape.radius = 100
+            partnerShape.draw()
+        win.clearBuffer()
+        yield 'stimuli'
+    for stim in [partnerBlockText, fixation, selfLabel, otherLabel, respRect, waitingForScannerText, respHandImage]:
+        stim.draw()
+    for prob in trialsDf['prob'].unique():
+        probText.setText(str(prob) + '%')
+        probText.draw()
+    for amount in trialsDf['selfProp'].unique():
+        selfAmount.setText(str(amount))
+        selfAmount.draw()
+    for amount in trialsDf['otherProp'].unique():
+        otherAmount.setText(str(amount))
+        otherAmount.draw()
+    win.clearBuffer()
+    yield 'stimuli'
+
+
+def run_decision_run(trialsDf=None, saveFile=None, runLabel='run'):
+
+    global overallTrialNum
+
+    # per-run journal of completed trials (allows resuming the run after a crash)
+    journalFile = os.path.join(saveDir, "%04d_%s_%s_journal.jsonl") %(int(expInfo['subject']), expInfo['expName'], runLabel)
+    completedTrials = {}
+    if expInfo['resume'] and os.path.isfile(journalFile):
+        journalSchedule, completedTrials, journalComplete = df.load_journal(journalFile)
+        if journalComplete or journalSchedule is None:  # nothing to resume; run from the start
+            completedTrials = {}
+        else:
+            trialsDf = journalSchedule  # continue the schedule that was generated for this run
+    resumeRun = len(completedTrials) > 0
+    if not resumeRun:
+        # keep the journal of an earlier attempt at this run (it may be the only record of its completed trials)
+        rotatedJournal = df.rotate_journal(journalFile, expInfo['startTime'])
+        if rotatedJournal is not None:
+            logging.warning('Run journal %s was not resumed; moved it to %s' %(journalFile, rotatedJournal))
+    journal = df.TrialJournal(journalFile, resume=resumeRun)
+    if not resumeRun:
+        journal.write_schedule(trialsDf, runLabel=runLabel)
+
+    # build the run while the participant rests (spending up to half of each frame of the waiting screens)
+    prepared = {}
+    prefetch = gf.Prefetcher(prepare_run(trialsDf=trialsDf, saveFile=saveFile, completedTrials=completedTrials, journal=journal, prepared=prepared),
+                             budget=currRefreshRate / 2.0)
 
     # DISPLAY PAUSE SCREEN
     pauseText.setAutoDraw(True)
@@ -527,13 +796,32 @@ def run_decision_run(trialsDf=None, saveFile=None):
                 noPauseResp = False
         else:
             event.clearEvents()
+        if edfFiles.transferring():
+            edfTransferText.text = 'Saving eye data... %d%%' %(100 * edfFiles.progress())
+            edfTransferText.draw()
+        prefetch.step()
+        win.flip()
+
+    # the next data file is opened (and calibrated) once the previous run's file has been received
+    while edfFiles.transferring():
+        edfTransferText.text = 'Saving eye data... %d%%' %(100 * edfFiles.progress())
+        edfTransferText.draw()
+        prefetch.step()
         win.flip()
+    edfFiles.wait()
+    if edfFiles.transfers:
+        logging.exp('EDF transfer: %s' %(', '.join('%s=%s' %(col, value) for col, value in edfFiles.transfers[-1].items())))
+    edfFiles.open()
     event.clearEvents()
     pauseText.setAutoDraw(False)
     win.flip()
 
     # RUN CALIBRATION
+    genv.setupLabel = runLabel
+    genv.setupStats = None
     tk.doTrackerSetup()
+    if genv.setupStats is not None:
+        logging.exp('EyeLink setup %s: %s' %(runLabel, ', '.join('%s=%s' %(col, value) for col, value in genv.setupStats.items())))
 
     # BUTTON REMINDER
     # gf.show_instructs(win=win,
@@ -554,13 +842,8 @@ def run_decision_run(trialsDf=None, saveFile=None):
             elif keysPressed[0] == 'q':
                 # QUIT PROGRAM
 
-                # close the EDF data file
-                tk.setOfflineMode()
-                tk.closeDataFile()
-                pylink.pumpDelay(50)
-
-                # Get the EDF data and say goodbye
-                tk.receiveDataFile(edfFileName, os.path.join(edfFolder, edfFileName))
+                # close the EDF data file, get the EDF data and say goodbye
+                edfFiles.close(runLabel)
 
                 # close the link to the tracker
                 tk.close()
@@ -568,40 +851,65 @@ def run_decision_run(trialsDf=None, saveFile=None):
                 # close the graphics
                 pylink.closeGraphics()
 
+                journal.close()
+
                 win.close()
                 core.quit()
 
+        prefetch.step()
         win.flip()
     event.clearEvents()
     preparingScannerText.setAutoDraw(False)
 
-    # Assign runNumber based on existing csv file. Read the csv file and find the largest block number and add 1 to it to reflect this block's number.
-    # try:
-    #     runNumber = max(pd.read_csv(saveFile)['runNumber']) + 1
-    #     trialsDf['runNumber'] = runNumber
-    # except:  # if fail to read csv, then it's block 1
-    #     runNumber = 1
-    #     trialsDf['runNumber'] = runNumber
+    # finish anything the waiting screens left unprepared
+    prefetch.finish()
+    writeHeader = prepared['writeHeader']
+    runNumber = prepared['runNumber']
+    firstTrial = prepared['firstTrial']
+    schedule = prepared['schedule']
+    trialData = prepared['trialData']
+    win.frameIntervals = []  # drop the frames of the waiting screens from the run's frame timing
+    prefetchStats = prefetch.stats()
+    logging.exp('Run prefetch %s: %s' %(runLabel, ', '.join('%s=%s' %(col, value) for col, value in prefetchStats.items())))
 
-    # Assign runNumber
-    runNumber = expInfo['runNumber']
-    trialsDf['runNumber'] = runNumber
 
     # start eye tracker recording
     error = tk.startRecording(1,1,1,1)
     pylink.pumpDelay(100) # wait for 100 ms to make sure data of interest is recorded
 
+    # send trial messages from a worker thread, timestamped with the flip they belong to
+    elMessages = ef.MessageDispatcher(tk=tk, win=win)
+
+    # sample the tracker clock against core.getTime for the whole run (offset and drift model)
+    clockSync = ef.ClockSync(tk=tk, interval=clockSyncInterval, lock=elMessages.lock)
+    clockSync.start()
+
+    # timestamp every scanner trigger and button press for the whole run (triggers are passed on by respCapture)
+    trigListener = tf.TriggerListener(triggerKey=scannerTrigger, TR=scannerTR)
+    respCapture = tf.ResponseCapture(win=win, keyList=respKeys + ['q'], triggerListener=trigListener)
+    trigListener.start()
+    respCapture.start()
+
+    # enter real-time mode until the end of the run (data files are written after)
+    monitorRun = int(runLabel[3:]) if runLabel[3:].isdigit() else 0  # run shown by the dashboard (0: practice)
+    monitor.set_status('waiting', run=monitorRun, nTrials=trialsDf.shape[0])
+    monitor.reset_stats()
+    realTime.enter()
+
     # WAIT FOR SCANNER START
     respHandImage.setAutoDraw(True)
     waitingForScannerText.setAutoDraw(True)
     event.clearEvents()
-    while not event.getKeys(keyList = ['5']):
+    while not event.getKeys(keyList = [scannerTrigger]):
         win.flip()
     event.clearEvents()
     respHandImage.setAutoDraw(False)
     waitingForScannerText.setAutoDraw(False)
 
     blockClock.reset()
+    runZero = core.getTime()  # core.getTime at the scanner trigger
+    trigListener.set_zero(runZero)
+    monitor.set_status('running')
 
     # initialize variable for storing partner on previous trial
     prevPartner = []
@@ -609,16 +917,24 @@ def run_decision_run(trialsDf=None, saveFile=None):
     # run block trials
     for i, thisTrial in trialsDf.iterrows():
 
+        # skip trials restored from the journal
+        if i < firstTrial:
+            continue
+
+        partner = thisTrial['partner']
+        blockType = thisTrial['blockType']
+        prob = thisTrial['prob']
+
         # send the standard "TRIALID" message to mark the start of a trial
         # [see Data Viewer User Manual, Section 7: Protocol for EyeLink Data to Viewer Integration]
-        tk.sendMessage('TRIALID')
+        elMessages.send('TRIALID')
 
         # if new partner on this trial, give task instructions
-        if trialsDf.loc[i, 'partner'] != prevPartner:
+        if partner != prevPartner:
 
             # change partner rect cue and shape
             instructsTTL = 0
-            if trialsDf.loc[i, 'partner'] == 'pos':
+            if partner == 'pos':
                 partnerCue = posRect
                 partnerShape = posShape
                 instructsTTL = pos_instructs
@@ -627,7 +943,7 @@ def run_decision_run(trialsDf=None, saveFile=None):
                 hiNeedTTL = pos_hiNeed
                 propTTL = pos_prop
                 respTTLs = pos_resps
-            elif trialsDf.loc[i, 'partner'] == 'neu':
+            elif partner == 'neu':
                 partnerCue = neuRect
                 partnerShape = neuShape
                 instructsTTL = neu_instructs
@@ -636,7 +952,7 @@ def run_decision_run(trialsDf=None, saveFile=None):
                 hiNeedTTL = neu_hiNeed
                 propTTL = neu_prop
                 respTTLs = neu_resps
-            elif trialsDf.loc[i, 'partner'] == 'neg':
+            elif partner == 'neg':
                 partnerCue = negRect
                 partnerShape = negShape
                 instructsTTL = neg_instructs
@@ -645,38 +961,37 @@ def run_decision_run(trialsDf=None, saveFile=None):
                 hiNeedTTL = neg_hiNeed
                 propTTL = neg_prop
                 respTTLs = neg_resps
-            elif trialsDf.loc[i, 'partner'] == 'practice':
+            elif partner == 'practice':
                 partnerCue = pracRect
 
             # set pos and size
-            if trialsDf.loc[i, 'partner'] != 'practice':
+            if partner != 'practice':
                 partnerShape.pos = (0,0)
                 partnerShape.radius = 100
                 partnerCue.setAutoDraw(True)
                 partnerShape.setAutoDraw(True)
-            elif trialsDf.loc[i, 'partner'] == 'practice':
+            elif partner == 'practice':
                 partnerCue.setAutoDraw(True)
                 otherLabel.pos = (0,0)
                 otherLabel.setAutoDraw(True)
 
             # DISPLAY INSTRUCTIONS
-            tk.sendMessage('instructs_onset %d' %(instructsTTL))  # send fixation onset to EyeLink
             partnerBlockText.setAutoDraw(True)
-            trialsDf.loc[i, 'instructs_onset'] = blockClock.getTime()
-            timer = core.CountdownTimer(10.0)  # display for 10 secs
-            while timer.getTime() > 0:
-                win.flip()
+            schedule.start_phase(i, 'instructs')  # display for instructsDur (10 secs)
+            elMessages.send_on_flip('instructs_onset %d' %(instructsTTL))  # send instructions onset to EyeLink
+            while not schedule.phase_done():
+                schedule.flip()
             partnerBlockText.setAutoDraw(False)
 
             # set for trials
-            if trialsDf.loc[i, 'partner'] != 'practice':
+            if partner != 'practice':
                 partnerShape.setAutoDraw(False)
                 if subjectConds[2] == 'left':
                     partnerShape.pos = (300,70)
                 elif subjectConds[2] == 'right':
                     partnerShape.pos = (-300,70)
                 partnerShape.radius = 80
-            elif trialsDf.loc[i, 'partner'] == 'practice':
+            elif partner == 'practice':
                 otherLabel.setAutoDraw(False)
                 if subjectConds[2] == 'left':
                     otherLabel.pos = (300,70)
@@ -684,20 +999,17 @@ def run_decision_run(trialsDf=None, saveFile=None):
                     otherLabel.pos = (-300,70)
 
             # INSTRUCTIONS JITTER
-            tk.sendMessage('fixation_onset %d' %(fixTTL))  # send fixation onset to EyeLink
             fixation.setAutoDraw(True)
-            trialsDf.loc[i, 'instructsJitter_onset'] = blockClock.getTime()
-            timer = core.CountdownTimer(trialsDf.loc[i, 'instructsJitterDur'])
-            while timer.getTime() > 0:
-                win.flip()
+            schedule.start_phase(i, 'instructsJitter')
+            elMessages.send_on_flip('fixation_onset %d' %(fixTTL))  # send fixation onset to EyeLink
+            while not schedule.phase_done():
+                schedule.flip()
             fixation.setAutoDraw(False)
 
-
-        global overallTrialNum
-        trialsDf.loc[i, 'overallTrialNumber'] = overallTrialNum + 1
+        trialData['overallTrialNumber'][i] = overallTrialNum + 1
         overallTrialNum += 1
 
-        trialsDf.loc[i, 'blockTrialNum'] = i + 1
+        trialData['blockTrialNum'][i] = i + 1
 
         keysPressed = []  # initialize list of keys pressed
         keyResp = None  # initialize key response as None
@@ -705,75 +1017,70 @@ def run_decision_run(trialsDf=None, saveFile=None):
         # RTfromClock = None
 
         # set trial values
-        selfAmount.setText(str(trialsDf.loc[i, 'selfProp']))
-        otherAmount.setText(str(trialsDf.loc[i, 'otherProp']))
-        probText.setText(str(trialsDf.loc[i, 'prob']) + '%')
+        selfAmount.setText(str(thisTrial['selfProp']))
+        otherAmount.setText(str(thisTrial['otherProp']))
+        probText.setText(str(prob) + '%')
 
         # get times at beginning of trial
-        trialsDf.loc[i, 'globalTime'] = globalClock.getTime()
+        trialData['globalTime'][i] = globalClock.getTime()
         # trialsDf.loc[i, 'blockTime'] = blockClock.getTime()
 
         # NEED
-        if trialsDf.loc[i, 'prob'] > 50:
-            tk.sendMessage('hiNeed_onset %d' %(hiNeedTTL))  # send high need onset to EyeLink
-        else:
-            tk.sendMessage('loNeed_onset %d' %(loNeedTTL))  # send low need onset to EyeLink
         probText.setAutoDraw(True)
-        trialsDf.loc[i, 'need_onset'] = blockClock.getTime()
-        timer = core.CountdownTimer(trialsDf.loc[i, 'needDur'])
-        while timer.getTime() > 0:
-            win.flip()
+        schedule.start_phase(i, 'need')
+        if prob > 50:
+            elMessages.send_on_flip('hiNeed_onset %d' %(hiNeedTTL))  # send high need onset to EyeLink
+        else:
+            elMessages.send_on_flip('loNeed_onset %d' %(loNeedTTL))  # send low need onset to EyeLink
+        while not schedule.phase_done():
+            schedule.flip()
         probText.setAutoDraw(False)
 
         # JITTER
-        tk.sendMessage('fixation_onset %d' %(fixTTL))  # send fixation onset to EyeLink
         fixation.setAutoDraw(True)
-        trialsDf.loc[i, 'jitter_onset'] = blockClock.getTime()
-        timer = core.CountdownTimer(trialsDf.loc[i, 'jitterDur'])
-        while timer.getTime() > 0:
-            win.flip()
+        schedule.start_phase(i, 'jitter')
+        elMessages.send_on_flip('fixation_onset %d' %(fixTTL))  # send fixation onset to EyeLink
+        while not schedule.phase_done():
+            schedule.flip()
         fixation.setAutoDraw(False)
 
         # CHOICE
-        selfLabel.setAutoDraw(True)
-        selfAmount.setAutoDraw(True)
-        otherAmount.setAutoDraw(True)
-
-        if trialsDf.loc[i, 'partner'] != 'practice':
-            partnerShape.setAutoDraw(True)
-        elif trialsDf.loc[i, 'partner'] == 'practice':
-            otherLabel.setAutoDraw(True)
-
-        if trialsDf.loc[i, 'blockType'] == 'practice':
-            for j in respKeys:
-                respOptions[j].setAutoDraw(True)
+        # static layers (partner cue, shape, labels and practice options) are drawn as one texture
+        choiceScreen.compose((partner, subjectConds[2], respOrder, blockType), choice_screen_stims(partner, blockType))
+        choiceStims = [selfAmount, otherAmount]  # drawn on top of the static layers
+        partnerCue.setAutoDraw(False)
 
         win.callOnFlip(rtClock.reset)  # reset rtClock on next window flip
         event.clearEvents()  # clear events
+        respCapture.clear()  # discard presses made before the proposal
 
         # display proposal and collect response
-        tk.sendMessage('proposal_onset %d' %(propTTL))  # send proposal onset to EyeLink
-        trialsDf.loc[i, 'prop_onset'] = blockClock.getTime()
-        timer = core.CountdownTimer(trialsDf.loc[i, 'propDur'])
-        while timer.getTime() > 0:
-            keysPressed = event.getKeys(keyList=respKeys + ['q'], timeStamped=rtClock)  # load keys that have been pressed
+        schedule.start_phase(i, 'prop')
+        elMessages.send_on_flip('proposal_onset %d' %(propTTL))  # send proposal onset to EyeLink
+        while not schedule.phase_done():
+            if schedule.phaseFlips > 0:  # proposal is on screen
+                rtZero = core.getTime() - rtClock.getTime()  # core.getTime at the proposal onset
+                keysPressed = [(key, keyTime) for key, keyTime in respCapture.get() if keyTime >= rtZero]  # load keys that have been pressed
+            else:
+                keysPressed = []
 
             if len(keysPressed) > 0:  # check if a key has been pressed yet
                 if keyResp is None:  # check if another key response has already been recorded
-                    trialsDf.loc[i, 'resp_onset'] = blockClock.getTime()
-                    keyResp, RT = keysPressed[0]  # access first key response and corresponding RT
-                    # RTfromClock = rtClock.getTime()  # record RT from rtClock
+                    keyResp, keyTime = keysPressed[0]  # access first key response and its time
+                    RT = keyTime - rtZero
+                    trialData['resp_onset'][i] = keyTime - runZero
 
                     if keyResp == 'q':
                         # QUIT RUN AND PROGRAM
+                        realTime.exit()
 
-                        # close the EDF data file
-                        tk.setOfflineMode()
-                        tk.closeDataFile()
-                        pylink.pumpDelay(50)
+                        # send queued messages before closing the EDF data file
+                        elMessages.close()
+                        elStats = elMessages.stats()
+                        syncColumns = clock_sync_columns(clockSync=clockSync, runZero=runZero)
 
-                        # Get the EDF data and say goodbye
-                        tk.receiveDataFile(edfFileName, os.path.join(edfFolder, edfFileName))
+                        # close the EDF data file, get the EDF data and say goodbye
+                        edfFiles.close(runLabel)
 
                         # close the link to the tracker
                         tk.close()
@@ -787,99 +1094,184 @@ def run_decision_run(trialsDf=None, saveFile=None):
                             v += 1
                             abortFile = os.path.join(saveDir, "%04d_abortRun%d_%d.csv") %(int(expInfo['subject']), runNumber, v)
                         
+                        schedule.finish()
+                        trialData.store(trialsDf, firstTrial=firstTrial)
+                        schedule.store_timing(trialsDf)
+                        respCapture.stop()
+                        trigListener.stop()
+                        save_run_triggers(trigListener=trigListener, trialsDf=trialsDf, runNumber=runNumber, runLabel=runLabel, firstTrial=firstTrial)
+                        for col, value in elStats.items():
+                            trialsDf[col] = value
+                        for col, value in syncColumns.items():
+                            trialsDf[col] = value
+                        for col, value in choiceScreen.stats().items():
+                            trialsDf['choice_' + col] = value
+                        for col, value in prefetchStats.items():
+                            trialsDf['prefetch_' + col] = value
+                        for col, value in realTime.status().items():
+                            trialsDf[col] = value
                         trialsDf.to_csv(abortFile, header = True, mode = 'a', index = False)
+                        journal.close()
+                        monitor.set_status('aborted')
+                        monitor.close()
 
                         win.close()
                         core.quit()
 
-                    # send response onset to EyeLink
-                    tk.sendMessage('response_onset %d' %(respTTLs[respDecode[keyResp] - 1]))  # subtract 1 for indexing
+                    # send response onset to EyeLink, timestamped with the key press
+                    elMessages.send('response_onset %d' %(respTTLs[respDecode[keyResp] - 1]), t=keyTime)  # subtract 1 for indexing
 
-                    respRect.setAutoDraw(True)
-                    if trialsDf.loc[i, 'blockType'] == 'practice':
+                    choiceStims.append(respRect)
+                    if blockType == 'practice':
                         # change color of option selected
                         selectedOption = respOptions[keyResp]
                         selectedOption.color = (-1, 1, -1)
+                        choiceStims.append(selectedOption)
 
-            win.flip()
+            choiceScreen.draw(choiceStims)
+            schedule.flip()
+        rtZero = core.getTime() - rtClock.getTime()  # proposal onset (for late responses)
 
         # TRIAL CLEAN UP
-        selfLabel.setAutoDraw(False)
-        selfAmount.setAutoDraw(False)
-        otherAmount.setAutoDraw(False)
-        respRect.setAutoDraw(False)
-
-        if trialsDf.loc[i, 'partner'] != 'practice':
-            partnerShape.setAutoDraw(False)
-        elif trialsDf.loc[i, 'partner'] == 'practice':
-            otherLabel.setAutoDraw(False)
-
-        if trialsDf.loc[i, 'blockType'] == 'practice':
-            for j in respKeys:
-                respOptions[j].setAutoDraw(False)
+        partnerCue.setAutoDraw(True)
+
+        if blockType == 'practice':
             # change back color of selected option
             if keyResp is not None:
                 selectedOption.color = (1,1,1)
 
-        if trialsDf.loc[i, 'partner'] != prevPartner:
-            trialsDf.loc[i, 'instructsTTL'] = instructsTTL
+        if partner != prevPartner:
+            trialData['instructsTTL'][i] = instructsTTL
 
         # set current partner as previous partner
-        prevPartner = trialsDf.loc[i, 'partner']
+        prevPartner = partner
 
         # RECORD DATA
         # code response as accept or reject
         if keyResp in acceptKeys:
-            trialsDf.loc[i, 'accept'] = 1
+            trialData['accept'][i] = 1
         elif keyResp in rejectKeys:
-            trialsDf.loc[i, 'accept'] = 0
-        else:
-            trialsDf.loc[i, 'accept'] = np.nan
+            trialData['accept'][i] = 0
 
-        trialsDf.loc[i, 'fixTTL'] = fixTTL
-        trialsDf.loc[i, 'propTTL'] = propTTL
-        if trialsDf.loc[i, 'prob'] > 50:
-            trialsDf.loc[i, 'needTTL'] = hiNeedTTL  # send high need onset to EyeLink
+        trialData['fixTTL'][i] = fixTTL
+        trialData['propTTL'][i] = propTTL
+        if prob > 50:
+            trialData['needTTL'][i] = hiNeedTTL  # send high need onset to EyeLink
         else:
-            trialsDf.loc[i, 'needTTL'] = loNeedTTL  # send high need onset to EyeLink
+            trialData['needTTL'][i] = loNeedTTL  # send high need onset to EyeLink
 
-        # append data to data frame
-        trialsDf.loc[i, 'resp'] = keyResp
+        # append data to trial buffer
+        trialData['resp'][i] = keyResp
         if keyResp is not None:
-            trialsDf.loc[i, 'respNum'] = respDecode[keyResp]
-            trialsDf.loc[i, 'respTTL'] = respTTLs[respDecode[keyResp] - 1]
+            trialData['respNum'][i] = respDecode[keyResp]
+            trialData['respTTL'][i] = respTTLs[respDecode[keyResp] - 1]
         else:
-            trialsDf.loc[i, 'respTTL'] = no_resp
-            tk.sendMessage('response_onset %d' %(no_resp))  # send no response TTL
-        trialsDf.loc[i, 'rt'] = RT
+            trialData['respTTL'][i] = no_resp
+            elMessages.send('response_onset %d' %(no_resp))  # send no response TTL
+        if RT is not None:
+            trialData['rt'][i] = RT
 
         # ITI
-        tk.sendMessage('fixation_onset %d' %(fixTTL))  # send fixation onset to EyeLink
         fixation.setAutoDraw(True)
-        trialsDf.loc[i, 'iti_onset'] = blockClock.getTime()
-        timer = core.CountdownTimer(trialsDf.loc[i, 'itiDur'])
-        while timer.getTime() > 0:
-            win.flip()
+        schedule.start_phase(i, 'iti')
+        elMessages.send_on_flip('fixation_onset %d' %(fixTTL))  # send fixation onset to EyeLink
+        while not schedule.phase_done():
+            # keep responses made after the proposal closed
+            for key, keyTime in respCapture.get():
+                if key not in respKeys:
+                    continue
+                if trialData['nLateResps'][i] == 0:
+                    trialData['lateResp'][i] = key
+                    trialData['lateRespNum'][i] = respDecode[key]
+                    trialData['lateRT'][i] = keyTime - rtZero
+                    trialData['lateResp_onset'][i] = keyTime - runZero
+                trialData['nLateResps'][i] += 1
+            schedule.flip()
         fixation.setAutoDraw(False)
 
+        # append the completed trial to the journal
+        schedule.end_phase()
+        trialRecord = trialData.row(i)
+        trialRecord.update(schedule.trial_timing(i))
+        journal.append(i, trialRecord)
+
+        # publish the trial to the experimenter dashboard
+        monitor.publish((monitorRun, i + 1, partner, prob, respDecode[keyResp] if keyResp is not None else 0,
+                         trialData['accept'][i], trialData['rt'][i], trialData['nLateResps'][i],
+                         np.nansum(schedule.droppedFrames[i]), np.nanmax(schedule.maxFrameIntervals[i]),
+                         (schedule.phase_onset(i, 'prop') - schedule.onset(i, 'prop')) * 1000.0,
+                         clockSync.sample_age(), elMessages.messages.qsize(), time.time()))
+
     # ADD EXTRA FIXATION TIME AT END OF RUN
     fixation.setAutoDraw(True)
-    timer = core.CountdownTimer(10)
-    while timer.getTime() > 0:
-        win.flip()
+    schedule.start_end_fixation()
+    while not schedule.phase_done():
+        schedule.flip()
     fixation.setAutoDraw(False)
     trialsDf.loc[i, 'itiDur'] += 10  # add the extra 10 seconds to the last iti duration
 
+    realTime.exit()
+
+    # store flip-timestamped onsets, dropped frames and scheduled onsets for each phase
+    schedule.finish()
+    trialData.store(trialsDf, firstTrial=firstTrial)
+    schedule.store_timing(trialsDf)
+
+    # write TR table and align onsets with acquired volumes
+    respCapture.stop()
+    trigListener.stop()
+    save_run_triggers(trigListener=trigListener, trialsDf=trialsDf, runNumber=runNumber, runLabel=runLabel, firstTrial=firstTrial)
+
     posRect.setAutoDraw(False)
     neuRect.setAutoDraw(False)
     negRect.setAutoDraw(False)
     pracRect.setAutoDraw(False)
 
+    # send the remaining messages and store queue depth and send latency of the run
+    elMessages.close()
+    elStats = elMessages.stats()
+    for col, value in elStats.items():
+        trialsDf[col] = value
+    logging.exp('EyeLink messages %s: %s' %(runLabel, ', '.join('%s=%s' %(col, value) for col, value in elStats.items())))
+
+    # store the tracker clock model of the run
+    syncColumns = clock_sync_columns(clockSync=clockSync, runZero=runZero)
+    for col, value in syncColumns.items():
+        trialsDf[col] = value
+    logging.exp('Tracker clock %s: %s' %(runLabel, ', '.join('%s=%s' %(col, value) for col, value in syncColumns.items())))
+
+    # store the per-frame draw time of the choice screens
+    choiceStats = choiceScreen.stats()
+    for col, value in choiceStats.items():
+        trialsDf['choice_' + col] = value
+    logging.exp('Choice screen drawing %s: %s' %(runLabel, ', '.join('%s=%s' %(col, value) for col, value in choiceStats.items())))
+
+    # store how much of the run was prepared while waiting
+    for col, value in prefetchStats.items():
+        trialsDf['prefetch_' + col] = value
+
+    # store which real-time protections were active
+    for col, value in realTime.status().items():
+        trialsDf[col] = value
+
+    # store the cost of publishing trials to the dashboard
+    monitor.set_status('finished')
+    monitorStats = monitor.stats()
+    for col, value in monitorStats.items():
+        trialsDf['monitor_' + col] = value
+    logging.exp('Dashboard writes %s: %s' %(runLabel, ', '.join('%s=%s' %(col, value) for col, value in monitorStats.items())))
+
     trialsDf['endTime'] = str(time.strftime('%Y-%m-%d-%H-%M-%S', time.localtime()))
     tk.stopRecording() # stop recording
 
+    # close the EDF file of the run and receive it while the participant rests (if rotating)
+    edfFiles.end_run(runLabel)
+
     # append block data to save file
     trialsDf.to_csv(saveFile, header = writeHeader, mode = 'a', index = False)
+    journal.close(complete=True)
+
+    expInfo['resume'] = False  # only the first run of a session is resumed
 
     return trialsDf
 
@@ -933,8 +1325,18 @@ gf.show_instructs(win=win, text=["Welcome to the experiment!"],
 
 ### Dictator Game --------------------------------------------------------------
 
-# generate runs
-runs = generate_runs(posBlocks=posBlocks, neuBlocks=neuBlocks, negBlocks=negBlocks)
+# generate runs, or restore them from the subject's schedule file
+if savedSchedule is None:
+    runs = generate_runs(posBlocks=posBlocks, neuBlocks=neuBlocks, negBlocks=negBlocks, cohortSchedule=cohortSchedule)
+    scheduleTables = OrderedDict([('practice', pracBlock)] + [('run%d' %(run + 1), runs[run]) for run in range(5)])
+    df.save_schedule(scheduleFile, scheduleTables,
+                     info={'counterbalance': expInfo['counterbalance'], 'partnerCounterbalance': partnerCounterbalance,
+                           'sourceHash': df.hash_files(scheduleSources), 'randomState': random.getstate()})
+else:
+    pracBlock = savedSchedule['practice']
+    runs = dict((run, savedSchedule['run%d' %(run + 1)]) for run in range(5))
+    randomState = savedScheduleInfo['randomState']
+    random.setstate((randomState[0], tuple(randomState[1]), randomState[2]))  # continue as after generating the runs
 
 # pause for initial scans
 initial_scans()
@@ -971,7 +1373,7 @@ if expInfo['runNumber'] < 1:
 
     # run practice
     # pracBlock = pracBlock.loc[range(3),:]
-    run_decision_run(trialsDf=pracBlock, saveFile=saveFilename_practice)
+    run_decision_run(trialsDf=pracBlock, saveFile=saveFilename_practice, runLabel='practice')
 
     gf.show_instructs(win=win,
         text=["You have completed the practice trials. Let the experimenter know if you have any questions."],
@@ -984,23 +1386,23 @@ if expInfo['runNumber'] < 1:
 
 if expInfo['runNumber'] < 2:
     overallTrialNum = 0
-    run_decision_run(trialsDf=runs[0], saveFile=saveFilename)
+    run_decision_run(trialsDf=runs[0], saveFile=saveFilename, runLabel='run1')
 
 if expInfo['runNumber'] < 3:
     overallTrialNum = 60
-    run_decision_run(trialsDf=runs[1], saveFile=saveFilename)
+    run_decision_run(trialsDf=runs[1], saveFile=saveFilename, runLabel='run2')
 
 if expInfo['runNumber'] < 4:
     overallTrialNum = 120
-    run_decision_run(trialsDf=runs[2], saveFile=saveFilename)
+    run_decision_run(trialsDf=runs[2], saveFile=saveFilename, runLabel='run3')
 
 if expInfo['runNumber'] < 5:
     overallTrialNum = 180
-    run_decision_run(trialsDf=runs[3], saveFile=saveFilename)
+    run_decision_run(trialsDf=runs[3], saveFile=saveFilename, runLabel='run4')
 
 if expInfo['runNumber'] < 6:
     overallTrialNum = 240
-    run_decision_run(trialsDf=runs[4], saveFile=saveFilename)
+    run_decision_run(trialsDf=runs[4], saveFile=saveFilename, runLabel='run5')
 
 
 # randomly select one trial for outcome
@@ -1011,18 +1413,21 @@ f1.write("Ice water probability: %.2f\nDictator proposed: %d\nReceiver proposed:
 f1.close()
 
 
+# wait for the eye data of the last run
+while edfFiles.transferring():
+    edfTransferText.text = 'Saving eye data... %d%%' %(100 * edfFiles.progress())
+    edfTransferText.draw()
+    win.flip()
+
 # end
 gf.show_instructs(win=win,
     text=["You have completed the task."],
     timeAutoAdvance=0, timeRequired=0, advanceKey=['space'], saveFile=os.path.join(saveDir, "instructs26_.png"), units='pix')
 
-# close the EDF data file
-tk.setOfflineMode()
-tk.closeDataFile()
-pylink.pumpDelay(50)
-
-# Get the EDF data and say goodbye
-tk.receiveDataFile(edfFileName, os.path.join(edfFolder, edfFileName))
+# close the EDF data file, get the EDF data (after the transfer of the last run) and say goodbye
+edfFiles.close()
+for edfFailed in edfFiles.check():
+    logging.error('EDF transfer of %s failed the size or checksum check' %(edfFailed))
 
 # close the link to the tracker
 tk.close()
@@ -1031,5 +1436,6 @@ tk.close()
 pylink.closeGraphics()
 
 
+monitor.close()
 win.close()
 core.quit()
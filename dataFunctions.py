@@ -0,0 +1,285 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Data Functions for Saving and Restoring Runs
+authors: Ian Roberts
+"""
+
+import os, json, threading, hashlib
+import pandas as pd
+import numpy as np
+from collections import OrderedDict
+
+
+def _json_default(value):
+    """ Convert numpy scalars for json.dumps """
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError('%r is not JSON serializable' %(value,))
+
+
+class TrialRecords(object):
+    """ Preallocated buffer for the data recorded on each trial of a run
+
+        Values are written into typed NumPy columns while the run is presented (e.g., records['rt'][i] = RT), which
+        avoids label-indexed DataFrame writes between flips. The buffer is copied into the trial data frame in one
+        step after the run.
+
+        Args:
+            nTrials (int): Number of trials in the run.
+            fields (list): List of (column name, numpy dtype) tuples. Float columns start as NaN and object columns as None.
+    """
+
+    def __init__(self, nTrials, fields):
+        self.data = np.zeros(nTrials, dtype=fields)
+        self.fields = list(self.data.dtype.names)
+        for name in self.fields:
+            if self.data.dtype[name].kind == 'f':
+                self.data[name] = np.nan
+            elif self.data.dtype[name].kind == 'O':
+                self.data[name] = None
+
+    def __getitem__(self, name):
+        return self.data[name]
+
+    def row(self, trial):
+        """ Data of a single trial as an ordered dictionary of Python values """
+        record = OrderedDict()
+        for name in self.fields:
+            value = self.data[name][trial]
+            record[name] = value.item() if isinstance(value, np.generic) else value
+        return record
+
+    def store(self, trialsDf, firstTrial=0):
+        """ Copy the buffer into trialsDf for the presented trials (from firstTrial on) """
+        rows = trialsDf.index[firstTrial:]
+        for name in self.fields:
+            trialsDf.loc[rows, name] = self.data[name][firstTrial:]
+
+
+class TrialJournal(object):
+    """ Append-only journal of the completed trials of a run
+
+        Each entry is written as one line of JSON and flushed immediately, so a completed trial survives a crash of
+        the experiment. Flushed lines are committed to disk (fsync) in batches on a background thread so the trial
+        loop never waits on the disk.
+
+        Args:
+            journalFile (str): File path for the journal.
+            syncEvery (int): Number of entries to write between each fsync.
+            resume (True/False): If True, append to an existing journal. If False, start a new journal (an existing
+                                 journal is never overwritten: move it aside first, see rotate_journal).
+    """
+
+    def __init__(self, journalFile, syncEvery=5, resume=False):
+        if not resume and os.path.isfile(journalFile):
+            raise Exception('Journal %s already exists. Resume it or move it aside (see rotate_journal).' %(journalFile))
+        self.journalFile = journalFile
+        self.syncEvery = syncEvery
+        self.nPending = 0  # entries written since the last fsync request
+        self.journal = open(journalFile, 'a' if resume else 'w')
+        self.closing = False
+        self.syncRequest = threading.Event()
+        self.syncThread = threading.Thread(target=self._sync_loop)
+        self.syncThread.daemon = True
+        self.syncThread.start()
+
+    def _sync_loop(self):
+        while True:
+            self.syncRequest.wait()
+            self.syncRequest.clear()
+            try:
+                os.fsync(self.journal.fileno())
+            except (OSError, ValueError):  # file already closed
+                pass
+            if self.closing:
+                break
+
+    def _write(self, entry):
+        self.journal.write(json.dumps(entry, default=_json_default, separators=(',', ':')) + '\n')
+        self.journal.flush()
+        self.nPending += 1
+        if self.nPending >= self.syncEvery:
+            self.nPending = 0
+            self.syncRequest.set()
+
+    def write_schedule(self, trialsDf, runLabel=''):
+        """ Store the generated schedule of the run so it can be restored when resuming """
+        self._write({'type': 'schedule',
+                     'runLabel': runLabel,
+                     'columns': list(trialsDf.columns),
+                     'trials': trialsDf.values.tolist()})
+        self.syncRequest.set()  # commit the schedule before the run starts
+
+    def write_resume(self, firstTrial):
+        """ Mark that the run was resumed from firstTrial """
+        self._write({'type': 'resume', 'firstTrial': int(firstTrial)})
+
+    def append(self, trialNum, record):
+        """ Store the data of a completed trial
+
+            Args:
+                trialNum (int): Row of the trial in the run schedule.
+                record (dict): Trial data (column: value).
+        """
+        self._write({'type': 'trial', 'trial': int(trialNum), 'data': record})
+
+    def close(self, complete=False):
+        """ Commit all entries and close the journal
+
+            Args:
+                complete (True/False): Whether the run finished (a complete run is not resumed).
+        """
+        if complete:
+            self._write({'type': 'complete'})
+        self.closing = True
+        self.syncRequest.set()
+        self.syncThread.join()
+        self.journal.close()
+
+
+def rotate_journal(journalFile, label):
+    """ Move an existing journal aside (to <journal>.<label>.jsonl) so that a new journal can be started
+
+        Args:
+            journalFile (str): File path for the journal.
+            label (str): Label added to the file name (e.g., the start time of the session).
+
+        Returns the new file path of the journal, or None if there was no journal.
+    """
+    if not os.path.isfile(journalFile):
+        return None
+    name, ext = os.path.splitext(journalFile)
+    rotatedFile = '%s.%s%s' %(name, label, ext)
+    v = 1
+    while os.path.isfile(rotatedFile):
+        v += 1
+        rotatedFile = '%s.%s_%d%s' %(name, label, v, ext)
+    os.rename(journalFile, rotatedFile)
+    return rotatedFile
+
+
+def load_journal(journalFile):
+    """ Read a run journal
+
+        Args:
+            journalFile (str): File path for the journal.
+
+        Returns the run schedule (data frame), an ordered dictionary of completed trials (row: trial data), and whether the run was completed.
+    """
+    schedule = None
+    completedTrials = OrderedDict()
+    complete = False
+
+    with open(journalFile, 'r') as journal:
+        for line in journal:
+            try:
+                entry = json.loads(line)
+            except ValueError:  # incomplete last line from a crash
+                continue
+            if entry['type'] == 'schedule':
+                schedule = pd.DataFrame(entry['trials'], columns=entry['columns'])
+            elif entry['type'] == 'trial':
+                completedTrials[entry['trial']] = entry['data']
+            elif entry['type'] == 'complete':
+                complete = True
+
+    return schedule, completedTrials, complete
+
+
+def _schedule_columns(name, table):
+    """ Arrays for the columns of a schedule table (object columns as unicode with a missing-value mask) """
+    arrays = OrderedDict()
+    for col in table.columns:
+        values = table[col].values
+        if values.dtype.kind in 'fiub':
+            arrays['%s/%s' %(name, col)] = values
+        else:
+            missing = pd.isnull(table[col]).values
+            arrays['%s/%s' %(name, col)] = np.array([u'' if m else u'%s' %(v,) for v, m in zip(values, missing)], dtype='U')
+            arrays['%s/%s/missing' %(name, col)] = missing
+    return arrays
+
+
+def _schedule_hash(arrays):
+    sha = hashlib.sha1()
+    for key, values in arrays.items():
+        sha.update(key.encode('utf8'))
+        sha.update(str(values.dtype).encode('utf8'))
+        sha.update(np.ascontiguousarray(values).tobytes())
+    return sha.hexdigest()
+
+
+def hash_files(fileNames):
+    """ SHA-1 hash of the contents of a list of files (e.g., the stimulus files a schedule was generated from) """
+    sha = hashlib.sha1()
+    for fileName in fileNames:
+        with open(fileName, 'rb') as f:
+            sha.update(f.read())
+    return sha.hexdigest()
+
+
+def save_schedule(scheduleFile, tables, info=None):
+    """ Store the generated schedule of a subject (e.g., practice block and runs) in a compressed NumPy file
+
+        The file holds every column of every table, the column order and dtypes, and a content hash that is verified
+        by load_schedule. It is written to a temporary file first, so a crash never leaves a partial schedule.
+
+        Args:
+            scheduleFile (str): File path for the schedule (.npz).
+            tables (OrderedDict): Name: data frame for each table of the schedule.
+            info (dict): Values stored with the schedule (e.g., counterbalance assignment). Must be JSON serializable.
+    """
+    arrays = OrderedDict()
+    for name, table in tables.items():
+        arrays.update(_schedule_columns(name, table))
+    meta = {'tables': [[name, [str(col) for col in table.columns], [str(dtype) for dtype in table.dtypes]] for name, table in tables.items()],
+            'info': info or {},
+            'hash': _schedule_hash(arrays)}
+
+    tempFile = scheduleFile + '.tmp'
+    with open(tempFile, 'wb') as f:
+        np.savez_compressed(f, __meta__=np.array(json.dumps(meta, default=_json_default)), **arrays)
+        f.flush()
+        os.fsync(f.fileno())
+    if os.path.exists(scheduleFile):  # os.rename does not replace files on Windows
+        os.remove(scheduleFile)
+    os.rename(tempFile, scheduleFile)
+
+
+def load_schedule(scheduleFile):
+    """ Read a schedule stored by save_schedule and verify its content hash
+
+        Args:
+            scheduleFile (str): File path for the schedule (.npz).
+
+        Returns an ordered dictionary of tables (name: data frame) and the stored info, or None, None if there is no schedule file.
+    """
+    if not os.path.isfile(scheduleFile):
+        return None, None
+
+    with np.load(scheduleFile) as npz:
+        meta = json.loads(str(npz['__meta__']))
+        arrays = OrderedDict()
+        for name, columns, dtypes in meta['tables']:
+            for col, dtype in zip(columns, dtypes):
+                key = '%s/%s' %(name, col)
+                arrays[key] = npz[key]
+                if dtype == 'object':
+                    arrays[key + '/missing'] = npz[key + '/missing']
+
+    if _schedule_hash(arrays) != meta['hash']:
+        raise Exception('The schedule file does not match its content hash (the file is damaged): %s' %(scheduleFile))
+
+    tables = OrderedDict()
+    for name, columns, dtypes in meta['tables']:
+        table = pd.DataFrame(OrderedDict((col, arrays['%s/%s' %(name, col)]) for col in columns), columns=columns)
+        for col, dtype in zip(columns, dtypes):
+            if dtype == 'object':
+                values = table[col].values.astype(object)
+                values[arrays['%s/%s/missing' %(name, col)]] = np.nan
+                table[col] = values
+        tables[name] = table
+
+    return tables, meta['info']
@@ -0,0 +1,336 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Design Functions for fMRI Design Efficiency
+authors: Ian Roberts
+
+Searches trial orders and jitter/ITI permutations of the partner trial files for the most efficient estimation of the
+partner x need (prob > 50) x proposal (selfProp > otherProp) regressors. A run is built as in the scanner: three
+partner blocks of 20 trials, each starting with the partner instructions (10 s) and an instructions jitter, with
+need, jitter, proposal and ITI phases per trial and a fixation at the end of the run. Permuting jitters and ITIs
+within a block keeps every run's duration (and volume count) fixed. The scanner combines the blocks of the three
+files in independently shuffled orders, so the design of each block of each file is optimized on its own, scored on
+a fixed sample of runs that combine it with random blocks of the other two files.
+
+Candidate designs are scored in batches: event boxcars are built on a 0.5 s grid (every duration is a multiple of
+0.5 s), convolved with the canonical HRF by FFT, sampled at the TR and scored by A-optimality
+(regressors / trace((X'X)^-1) over the regressors of interest). Independent search chains run on separate cores.
+
+Run from the experiment directory, e.g.:
+    python designFunctions.py --TR 2.0 --workers 4 --out stim_optimized
+"""
+
+from __future__ import print_function
+import os, math, itertools, argparse, multiprocessing
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+
+partnerFiles = ['anm1_partner1_trials.csv', 'anm1_partner2_trials.csv', 'anm1_partner3_trials.csv']
+instructsDur = 10.0
+instructsJitters = [1.5, 2.5, 3.5]  # instructions jitter by block position in the run
+endFixDur = 10.0  # fixation after the last trial (see RunScheduler)
+partnerOrders = np.array(list(itertools.permutations(range(3))))  # the 6 block orders of a run
+
+# regressors: need phase (partner x need), proposal phase (partner x need x proposal), instructions (partner)
+nNeedRegs = 3 * 2
+nPropRegs = 3 * 2 * 2
+nInterest = nNeedRegs + nPropRegs
+nRegs = nInterest + 3
+
+
+def canonical_hrf(dt, duration=32.0):
+    """ Canonical double-gamma HRF (peak 6 s, undershoot 16 s, ratio 1/6) sampled every dt seconds, summing to 1 """
+    t = np.arange(0, duration, dt)
+    hrf = t ** 5 * np.exp(-t) / math.gamma(6) - t ** 15 * np.exp(-t) / math.gamma(16) / 6.0
+    return hrf / hrf.sum()
+
+
+def load_blocks(stimDir='stim', blockNum=1, files=partnerFiles):
+    """ Trial values of one block (partnerBlockNum) of each partner file as arrays of shape (3 files, 20 trials) """
+    columns = ['selfProp', 'otherProp', 'prob', 'needDur', 'propDur', 'jitterDur', 'itiDur']
+    blocks = dict((col, []) for col in columns)
+    for fileName in files:
+        trials = pd.read_csv(os.path.join(stimDir, fileName))
+        trials = trials[trials['partnerBlockNum'] == blockNum]
+        for col in columns:
+            blocks[col].append(trials[col].values.astype(float))
+    return dict((col, np.array(values)) for col, values in blocks.items())
+
+
+def identity_design(nFiles=3, nTrials=20):
+    """ Design of the trial files as they are: trial order, jitter and ITI permutations (3, files, trials) """
+    return np.tile(np.arange(nTrials), (3, nFiles, 1))
+
+
+def design_efficiency(blocks, designs, TR=2.0, dt=0.5):
+    """ Efficiency of a batch of designs, averaged over the 6 partner orders of a run
+
+        Args:
+            blocks (dict): Trial values of the block of each partner file (see load_blocks).
+            designs (array): Designs of shape (nDesigns, 3, 3 files, 20 trials): trial order, and the permutations of
+                the block's jitter and ITI values over the trial positions.
+            TR (float): Repetition time in seconds.
+            dt (float): Resolution of the event boxcars in seconds (durations must be multiples of dt).
+
+        Returns the efficiency of each design and the number of volumes in the run.
+    """
+    designs = np.asarray(designs)
+    nDesigns, nFiles, nTrials = designs.shape[0], designs.shape[2], designs.shape[3]
+    fileIdx = np.arange(nFiles)[None, :, None]
+    order, jitPerm, itiPerm = designs[:, 0], designs[:, 1], designs[:, 2]
+
+    # trial values in presented order (durations of jitter and ITI follow the position, not the trial)
+    needDur = blocks['needDur'][fileIdx, order]
+    propDur = blocks['propDur'][fileIdx, order]
+    jitterDur = blocks['jitterDur'][fileIdx, jitPerm]
+    itiDur = blocks['itiDur'][fileIdx, itiPerm]
+    needHigh = (blocks['prob'][fileIdx, order] > 50).astype(int)
+    selfAdv = (blocks['selfProp'][fileIdx, order] > blocks['otherProp'][fileIdx, order]).astype(int)
+
+    # phase durations of each block: instructions, instructions jitter, then need, jitter, proposal, ITI per trial
+    blockDurs = np.zeros((nDesigns, nFiles, 2 + 4 * nTrials))
+    blockDurs[:, :, 0] = instructsDur
+    blockDurs[:, :, 2:] = np.stack([needDur, jitterDur, propDur, itiDur], axis=-1).reshape(nDesigns, nFiles, 4 * nTrials)
+
+    # runs in every partner order: (designs, orders, block position, phase)
+    runDurs = blockDurs[:, partnerOrders]
+    runDurs[:, :, :, 1] = np.array(instructsJitters)[None, None, :]
+    onsets = (np.cumsum(runDurs.reshape(nDesigns, len(partnerOrders), -1), axis=-1)
+              .reshape(runDurs.shape) - runDurs)
+    runEnd = runDurs[0, 0].sum() + endFixDur
+    nVols = int(math.ceil(runEnd / TR))
+
+    partner = partnerOrders[None, :, :, None]  # file (partner) at each block position
+    needCond = partner * 2 + needHigh[:, partnerOrders]
+    propCond = nNeedRegs + partner * 4 + needHigh[:, partnerOrders] * 2 + selfAdv[:, partnerOrders]
+    needPhase = 2 + 4 * np.arange(nTrials)
+    events = [(onsets[..., 0], runDurs[..., 0], np.broadcast_to(nInterest + partnerOrders[None], onsets.shape[:3])),
+              (onsets[..., needPhase], runDurs[..., needPhase], needCond),
+              (onsets[..., needPhase + 2], runDurs[..., needPhase + 2], propCond)]
+    nRuns = nDesigns * len(partnerOrders)
+    eventOnsets = np.concatenate([on.reshape(nRuns, -1) for on, dur, cond in events], axis=1)
+    eventOffsets = eventOnsets + np.concatenate([dur.reshape(nRuns, -1) for on, dur, cond in events], axis=1)
+    eventConds = np.concatenate([np.broadcast_to(cond, on.shape).reshape(nRuns, -1) for on, dur, cond in events], axis=1)
+
+    # boxcars on the dt grid (+1 at each onset, -1 at each offset, then cumulative sum)
+    nT = int(math.ceil(runEnd / dt)) + 1
+    boxcars = np.zeros((nRuns, nT + 1, nRegs))
+    runIdx = np.repeat(np.arange(nRuns), eventOnsets.shape[1])
+    np.add.at(boxcars, (runIdx, np.round(eventOnsets / dt).astype(int).ravel(), eventConds.ravel()), 1)
+    np.add.at(boxcars, (runIdx, np.minimum(np.round(eventOffsets / dt).astype(int), nT).ravel(), eventConds.ravel()), -1)
+    boxcars = np.cumsum(boxcars, axis=1)[:, :nT]
+
+    # HRF convolution by FFT, sampled at each volume
+    hrf = canonical_hrf(dt)
+    nFFT = 2 ** int(math.ceil(math.log(nT + hrf.size, 2)))
+    convolved = np.fft.irfft(np.fft.rfft(boxcars, nFFT, axis=1) * np.fft.rfft(hrf, nFFT)[None, :, None], nFFT, axis=1)
+    volIdx = np.round(np.arange(nVols) * TR / dt).astype(int)
+    X = np.concatenate([convolved[:, volIdx],
+                        np.ones((nRuns, nVols, 1)),  # intercept
+                        np.broadcast_to(np.linspace(-1, 1, nVols)[None, :, None], (nRuns, nVols, 1))], axis=2)  # drift
+
+    XtX = np.einsum('rvk,rvl->rkl', X, X) + 1e-9 * np.eye(X.shape[2])[None]  # ridge keeps rank-deficient designs finite
+    traces = np.trace(np.linalg.inv(XtX)[:, :nInterest, :nInterest], axis1=1, axis2=2)
+    efficiency = (nInterest / traces).reshape(nDesigns, len(partnerOrders)).mean(axis=1)
+    return efficiency, nVols
+
+
+def _mutate(parent, rng, nDesigns, maxSwaps=3):
+    """ Designs made by swapping positions of the trial order, jitters or ITIs of the parent """
+    designs = np.repeat(parent[None], nDesigns, axis=0)
+    nFiles, nTrials = parent.shape[1], parent.shape[2]
+    for i in range(nDesigns):
+        for s in range(rng.randint(1, maxSwaps + 1)):
+            kind, f = rng.randint(3), rng.randint(nFiles)
+            a, b = rng.randint(nTrials, size=2)
+            designs[i, kind, f, a], designs[i, kind, f, b] = designs[i, kind, f, b], designs[i, kind, f, a]
+    return designs
+
+
+def _random_designs(rng, nDesigns, nFiles=3, nTrials=20):
+    return np.array([[[rng.permutation(nTrials) for f in range(nFiles)] for kind in range(3)] for i in range(nDesigns)])
+
+
+def file_blocks(stimDir='stim', files=partnerFiles, nBlocks=5):
+    """ Trial values of every block of every file: list (files) of lists (blocks) of load_blocks dictionaries """
+    return [[load_blocks(stimDir, blockNum, [fileName]) for blockNum in range(1, nBlocks + 1)] for fileName in files]
+
+
+def run_contexts(allBlocks, fileIdx, blockNum, nContexts=6, seed=0):
+    """ Runs combining a block of one file with random blocks of the other files (as generate_runs does)
+
+        Args:
+            allBlocks (list): Trial values of every block of every file (see file_blocks).
+            fileIdx (int): File of the block.
+            blockNum (int): Block (partnerBlockNum) of the file.
+            nContexts (int): Number of runs.
+            seed (int): Seed of the random blocks (use the same seed for every chain of a block so scores compare).
+
+        Returns a list of trial values of each run (see load_blocks).
+    """
+    rng = np.random.RandomState(seed)
+    contexts = []
+    for c in range(nContexts):
+        picks = [allBlocks[f][blockNum - 1] if f == fileIdx else allBlocks[f][rng.randint(len(allBlocks[f]))]
+                 for f in range(len(allBlocks))]
+        contexts.append(dict((col, np.concatenate([pick[col] for pick in picks])) for col in picks[0]))
+    return contexts
+
+
+def context_efficiency(contexts, fileIdx, designs, TR=2.0, dt=0.5):
+    """ Mean efficiency of designs of one file's block over runs with the other files' blocks as they are
+
+        Args:
+            contexts (list): Trial values of each run (see run_contexts).
+            fileIdx (int): File of the block.
+            designs (array): Designs of the block, shape (nDesigns, 3, 1, 20 trials) (see design_efficiency).
+            TR (float): Repetition time in seconds.
+            dt (float): Resolution of the event boxcars in seconds.
+
+        Returns the efficiency of each design and the number of volumes in the run.
+    """
+    nFiles, nTrials = contexts[0]['prob'].shape
+    runDesigns = np.repeat(identity_design(nFiles, nTrials)[None], len(designs), axis=0)
+    runDesigns[:, :, fileIdx] = designs[:, :, 0]
+    efficiency = []
+    for blocks in contexts:
+        eff, nVols = design_efficiency(blocks, runDesigns, TR=TR, dt=dt)
+        efficiency.append(eff)
+    return np.mean(efficiency, axis=0), nVols
+
+
+def search_design(contexts, fileIdx, nIter=200, batchSize=32, seed=None, TR=2.0, dt=0.5):
+    """ Stochastic search for the most efficient design of one file's block (random restarts, then local swaps)
+
+        Args:
+            contexts (list): Runs the block is scored in (see run_contexts).
+            fileIdx (int): File of the block.
+            nIter (int): Number of batches to score.
+            batchSize (int): Number of designs per batch.
+            seed (int): Seed of the search chain.
+            TR (float): Repetition time in seconds.
+            dt (float): Resolution of the event boxcars in seconds.
+
+        Returns the efficiency of the best design and the design (3, 1, trials; see design_efficiency).
+    """
+    rng = np.random.RandomState(seed)
+    nTrials = contexts[0]['prob'].shape[1]
+    best = identity_design(1, nTrials)
+    bestEff = context_efficiency(contexts, fileIdx, best[None], TR=TR, dt=dt)[0][0]
+    for it in range(nIter):
+        if it < nIter // 10:  # explore whole permutations first
+            designs = _random_designs(rng, batchSize, 1, nTrials)
+        else:
+            designs = _mutate(best, rng, batchSize)
+        efficiency = context_efficiency(contexts, fileIdx, designs, TR=TR, dt=dt)[0]
+        i = np.argmax(efficiency)
+        if efficiency[i] > bestEff:
+            bestEff, best = efficiency[i], designs[i]
+    return bestEff, best
+
+
+def _search_task(task):
+    fileIdx, blockNum, contextSeed, seed, stimDir, nContexts, nIter, batchSize, TR, dt = task
+    contexts = run_contexts(file_blocks(stimDir), fileIdx, blockNum, nContexts=nContexts, seed=contextSeed)
+    eff, design = search_design(contexts, fileIdx, nIter=nIter, batchSize=batchSize, seed=seed, TR=TR, dt=dt)
+    return fileIdx, blockNum, eff, design
+
+
+def write_trial_files(designs, stimDir='stim', outDir='stim_optimized', files=partnerFiles):
+    """ Write partner trial files with the trial order, jitters and ITIs of the optimized designs
+
+        Args:
+            designs (dict): Design of each block of each file ((file index, partnerBlockNum): design, see search_design).
+            stimDir (str): Directory of the original trial files.
+            outDir (str): Directory for the optimized trial files (same names and columns as the originals).
+    """
+    if not os.path.exists(outDir):
+        os.makedirs(outDir)
+    for f, fileName in enumerate(files):
+        trials = pd.read_csv(os.path.join(stimDir, fileName))
+        blocks = []
+        for blockNum in sorted(b for g, b in designs.keys() if g == f):
+            block = trials[trials['partnerBlockNum'] == blockNum].reset_index(drop=True)
+            order, jitPerm, itiPerm = designs[(f, blockNum)][:, 0]
+            newBlock = block.loc[order].reset_index(drop=True)
+            newBlock['jitterDur'] = block['jitterDur'].values[jitPerm]
+            newBlock['itiDur'] = block['itiDur'].values[itiPerm]
+            newBlock['partnerBlockTrialNum'] = np.arange(1, block.shape[0] + 1)
+            blocks.append(newBlock)
+        newTrials = pd.concat(blocks, ignore_index=True)
+        newTrials['overallPartnerTrialNum'] = np.arange(1, newTrials.shape[0] + 1)
+        newTrials[trials.columns].to_csv(os.path.join(outDir, fileName), header = True, mode = 'w', index = False)
+
+
+def combination_efficiency(stimDir, nCombos=50, seed=0, TR=2.0, dt=0.5):
+    """ Mean efficiency of runs combining random blocks of the three files (as the scanner does per subject) """
+    rng = np.random.RandomState(seed)
+    allBlocks = file_blocks(stimDir)
+    efficiency = np.zeros(nCombos)
+    for i in range(nCombos):
+        picks = [allBlocks[f][rng.randint(5)] for f in range(3)]
+        blocks = dict((col, np.concatenate([pick[col] for pick in picks])) for col in picks[0])
+        efficiency[i] = design_efficiency(blocks, identity_design()[None], TR=TR, dt=dt)[0][0]
+    return efficiency.mean()
+
+
+def optimize_design(stimDir='stim', outDir='stim_optimized', TR=2.0, dt=0.5, nChains=4, nIter=200, batchSize=32, nContexts=6,
+                    workers=None, seed=0):
+    """ Optimize the design of each block of each file on separate cores and write the trial files and a report
+
+        Returns the efficiency report (one row per block of each file, scored on the runs it was optimized in).
+    """
+    contextSeeds = dict(((f, blockNum), seed + 100 * f + blockNum) for f in range(len(partnerFiles)) for blockNum in range(1, 6))
+    tasks = [(f, blockNum, contextSeeds[(f, blockNum)], seed + 1000 * (10 * f + blockNum) + chain, stimDir, nContexts, nIter,
+              batchSize, TR, dt) for f in range(len(partnerFiles)) for blockNum in range(1, 6) for chain in range(nChains)]
+    pool = multiprocessing.Pool(processes=workers)
+    try:
+        results = pool.map(_search_task, tasks)
+    finally:
+        pool.close()
+        pool.join()
+
+    best = {}
+    for f, blockNum, eff, design in results:
+        if (f, blockNum) not in best or eff > best[(f, blockNum)][0]:
+            best[(f, blockNum)] = (eff, design)
+    designs = dict((key, design) for key, (eff, design) in best.items())
+    write_trial_files(designs, stimDir=stimDir, outDir=outDir)
+
+    rows = []
+    allBlocks = file_blocks(stimDir)
+    for f, blockNum in sorted(best.keys()):
+        contexts = run_contexts(allBlocks, f, blockNum, nContexts=nContexts, seed=contextSeeds[(f, blockNum)])
+        originalEff, nVols = context_efficiency(contexts, f, identity_design(1)[None], TR=TR, dt=dt)
+        rows.append(OrderedDict([('file', partnerFiles[f]),
+                                 ('partnerBlockNum', blockNum),
+                                 ('volumes', nVols),
+                                 ('runDur_s', nVols * TR),
+                                 ('efficiencyOriginal', originalEff[0]),
+                                 ('efficiencyOptimized', best[(f, blockNum)][0]),
+                                 ('improvement_pct', (best[(f, blockNum)][0] / originalEff[0] - 1) * 100)]))
+    report = pd.DataFrame(rows)
+    report['randomCombosOriginal'] = combination_efficiency(stimDir, TR=TR, dt=dt)
+    report['randomCombosOptimized'] = combination_efficiency(outDir, TR=TR, dt=dt)
+    report.to_csv(os.path.join(outDir, 'efficiencyReport.csv'), header = True, mode = 'w', index = False)
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Optimize the jitter, ITI and trial order of the partner trial files')
+    parser.add_argument('--stim', default='stim', help='directory of the trial files')
+    parser.add_argument('--out', default='stim_optimized', help='directory for the optimized trial files and report')
+    parser.add_argument('--TR', type=float, default=2.0, help='repetition time (s)')
+    parser.add_argument('--chains', type=int, default=4, help='search chains per block of each file')
+    parser.add_argument('--contexts', type=int, default=6, help='runs with random blocks of the other files to score each block in')
+    parser.add_argument('--iter', type=int, default=200, help='batches per chain')
+    parser.add_argument('--batch', type=int, default=32, help='designs per batch')
+    parser.add_argument('--workers', type=int, default=None, help='processes (default: all cores)')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the search')
+    args = parser.parse_args()
+
+    report = optimize_design(stimDir=args.stim, outDir=args.out, TR=args.TR, nChains=args.chains, nIter=args.iter,
+                             batchSize=args.batch, nContexts=args.contexts, workers=args.workers, seed=args.seed)
+    print(report.to_string(index=False))
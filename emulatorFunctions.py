@@ -0,0 +1,512 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Emulator Functions for Running the Tracker Code without an EyeLink
+authors: Ian Roberts
+
+An in-process emulator of the part of pylink the experiment uses, so the recording, message, transfer and calibration
+code paths can be benchmarked and regression-tested on a laptop. Unlike dummy mode, every call goes through the
+normal code path: link calls return after a configurable latency, recording produces synthetic gaze samples at the
+configured sample rate, data files hold the messages and samples and are sent with progress updates, and
+doTrackerSetup drives the custom calibration display (EyeLinkCoreGraphicsPsychoPy) with camera images, crosshairs,
+search limits and calibration targets. Unlike simulationFunctions, PsychoPy and the clock are real.
+
+Run a script with the emulator in place of pylink, or time the tracker code paths, from the experiment directory:
+    python emulatorFunctions.py anm1_scanner.py --latency 0.002 --sample-rate 1000
+    python emulatorFunctions.py --bench
+"""
+
+from __future__ import print_function
+import sys, os, re, types, time, timeit, runpy, argparse
+import numpy as np
+from collections import OrderedDict
+
+# emulated tracker (see configure)
+settings = {'latency': 0.001,        # time (s) of each link call
+            'sampleRate': 500,       # gaze samples per second while recording
+            'transferRate': 2e6,     # data file transfer (bytes/s)
+            'drift_ppm': 0.0,        # drift of the tracker clock against the local clock
+            'cameraSize': (384, 320),  # camera image (width, height)
+            'cameraRate': 30.0,      # camera images per second during setup
+            'cameraFrames': 60,      # camera images shown in each setup
+            'targets': 5,            # calibration targets in each setup (HV5)
+            'targetDur': 0.5,        # time (s) each calibration target is shown
+            'seed': 1}
+
+_graphics = None  # custom calibration display (see openGraphicsEx)
+
+
+def configure(**kwargs):
+    """ Change the emulated tracker settings (see settings), e.g. configure(latency=0.002, sampleRate=1000) """
+    for key, value in kwargs.items():
+        if key not in settings:
+            raise Exception('Unknown emulator setting: %s' %(key))
+        settings[key] = value
+
+
+class _EyeData(object):
+    def __init__(self, gaze, pupil):
+        self.gaze = gaze
+        self.pupil = pupil
+
+    def getGaze(self):
+        return self.gaze
+
+    def getPupilSize(self):
+        return self.pupil
+
+
+class _Sample(object):
+    """ Gaze sample (the parts of pylink.Sample used for online gaze) """
+
+    def __init__(self, t, gaze, pupil):
+        self.time = t
+        self.eye = _EyeData(gaze, pupil)
+
+    def getTime(self):
+        return self.time
+
+    def isRightSample(self):
+        return True
+
+    def isLeftSample(self):
+        return True
+
+    def getRightEye(self):
+        return self.eye
+
+    def getLeftEye(self):
+        return self.eye
+
+
+class EyeLink(object):
+    """ Emulated tracker with the pylink.EyeLink calls of the experiment
+
+        Args:
+            trackerAddress (str): Ignored (the emulator runs in the experiment process).
+    """
+
+    def __init__(self, trackerAddress=None):
+        self.trackerAddress = trackerAddress
+        self.start = timeit.default_timer()
+        self.rng = np.random.RandomState(settings['seed'])
+        self.screen = (1920, 1080)
+        self.commands = []
+        self.hostFiles = OrderedDict()  # host data files: name -> list of lines
+        self.dataFile = None
+        self.recordingStart = None
+        self.fixationEnds = np.zeros(0)  # synthetic gaze: end time (ms) and position of each fixation
+        self.fixationPos = np.zeros((0, 2))
+        self.linkTimes = []
+
+    # --- link ---------------------------------------------------------------
+
+    def _link(self):
+        """ Wait for the round trip of a link call """
+        start = timeit.default_timer()
+        if settings['latency'] > 0:
+            time.sleep(settings['latency'])
+        self.linkTimes.append(timeit.default_timer() - start)
+
+    def link_stats(self):
+        """ Number of link calls and their duration in milliseconds """
+        linkTimes = np.array(self.linkTimes) * 1000.0
+        stats = OrderedDict()
+        stats['linkCalls'] = linkTimes.size
+        stats['linkMedian_ms'] = np.median(linkTimes) if linkTimes.size else np.nan
+        stats['linkMax_ms'] = linkTimes.max() if linkTimes.size else np.nan
+        return stats
+
+    def _now(self):
+        """ Tracker clock (ms) """
+        return (timeit.default_timer() - self.start) * 1000.0 * (1.0 + settings['drift_ppm'] * 1e-6)
+
+    def _write(self, line):
+        if self.dataFile is not None:
+            self.hostFiles[self.dataFile].append(line)
+
+    # --- commands and messages ----------------------------------------------
+
+    def trackerTime(self):
+        self._link()
+        return self._now()
+
+    def sendCommand(self, command):
+        self._link()
+        self.commands.append(command)
+        match = re.match(r'\s*screen_pixel_coords\s*=\s*(\d+)\s+(\d+)\s+(\d+)\s+(\d+)', command)
+        if match:
+            self.screen = (int(match.group(3)) + 1, int(match.group(4)) + 1)
+        self._write('** COMMAND %s' %(command))
+        return 0
+
+    def sendMessage(self, message, *args):
+        self._link()
+        t = self._now()
+        words = message.split(' ', 1)
+        try:  # offset message: "<offset> <message>"
+            offset = int(words[0])
+            t, message = t - offset, words[1]
+        except (ValueError, IndexError):
+            pass
+        self._write('MSG\t%d %s' %(int(round(t)), message))
+        return 0
+
+    def setCalibrationType(self, calType):
+        return self.sendCommand('calibration_type = %s' %(calType))
+
+    def getTrackerVersion(self):
+        self._link()
+        return 3
+
+    def getTrackerVersionString(self):
+        self._link()
+        return 'EYELINK CL 5.12 (emulated)'
+
+    def isConnected(self):
+        return 1
+
+    def close(self):
+        self._link()
+
+    # --- data files ---------------------------------------------------------
+
+    def openDataFile(self, fileName):
+        self._link()
+        self.dataFile = fileName
+        self.hostFiles[fileName] = ['** EMULATED EDF %s' %(fileName), '** DATE: %s' %(time.strftime('%a %b %d %H:%M:%S %Y'))]
+        return 0
+
+    def closeDataFile(self):
+        self._link()
+        self.setOfflineMode()
+        self.dataFile = None
+        return 0
+
+    def receiveDataFile(self, src, dest):
+        """ Send a host data file in chunks at transferRate, reporting progress through progressUpdate """
+        self._link()
+        if src not in self.hostFiles:
+            return -1
+        data = ('\n'.join(self.hostFiles[src]) + '\n').encode('ascii')
+        size = len(data)
+        chunk = 65536
+        with open(dest, 'wb') as edf:
+            for received in range(0, size, chunk):
+                edf.write(data[received:received + chunk])
+                time.sleep(settings['latency'] + float(min(chunk, size - received)) / settings['transferRate'])
+                self.progressUpdate(size, min(received + chunk, size))
+        return size
+
+    def progressUpdate(self, size, received):
+        pass
+
+    # --- recording ----------------------------------------------------------
+
+    def _gaze(self, times):
+        """ Synthetic gaze (screen pixels) and pupil size at tracker times (ms): fixations of 150-400 ms with noise """
+        while not self.fixationEnds.size or self.fixationEnds[-1] < times[-1]:
+            lastEnd = self.fixationEnds[-1] if self.fixationEnds.size else times[0]
+            nNew = 100
+            self.fixationEnds = np.concatenate([self.fixationEnds, lastEnd + np.cumsum(self.rng.uniform(150, 400, nNew))])
+            centre = np.array(self.screen) / 2.0
+            self.fixationPos = np.concatenate([self.fixationPos, centre + self.rng.normal(0, 0.15, (nNew, 2)) * self.screen])
+        fixation = np.searchsorted(self.fixationEnds, times)
+        gaze = self.fixationPos[fixation] + self.rng.normal(0, 3.0, (len(times), 2))
+        pupil = 1000.0 + 50.0 * np.sin(times / 1000.0)
+        return gaze, pupil
+
+    def startRecording(self, fileSamples=1, fileEvents=1, linkSamples=1, linkEvents=1):
+        self._link()
+        self.recordingStart = self._now()
+        self._write('START\t%d' %(int(self.recordingStart)))
+        return 0
+
+    def stopRecording(self):
+        """ Stop recording and write the gaze samples of the recording to the data file """
+        self._link()
+        if self.recordingStart is None:
+            return
+        end = self._now()
+        times = np.arange(np.ceil(self.recordingStart), end, 1000.0 / settings['sampleRate'])
+        if times.size:
+            gaze, pupil = self._gaze(times)
+            for t, (x, y), p in zip(times, gaze, pupil):
+                self._write('%d\t%.1f\t%.1f\t%.1f' %(t, x, y, p))
+        self._write('END\t%d' %(int(end)))
+        self.recordingStart = None
+
+    def setOfflineMode(self):
+        self._link()
+        self.stopRecording()
+
+    def isRecording(self):
+        return 0 if self.recordingStart is not None else 1  # 0 (TRIAL_OK) while recording, as pylink
+
+    def getNewestSample(self):
+        """ Most recent gaze sample while recording (None otherwise) """
+        self._link()
+        if self.recordingStart is None:
+            return None
+        t = np.floor(self._now() * settings['sampleRate'] / 1000.0) * 1000.0 / settings['sampleRate']
+        gaze, pupil = self._gaze(np.array([t]))
+        return _Sample(t, tuple(gaze[0]), pupil[0])
+
+    # --- setup --------------------------------------------------------------
+
+    def _camera_image(self, frame, width, height):
+        """ Synthetic camera image (palette indices) with a dark pupil and bright corneal reflection """
+        y, x = np.mgrid[0:height, 0:width]
+        cx = width / 2.0 + width / 10.0 * np.cos(frame / 10.0)
+        cy = height / 2.0 + height / 12.0 * np.sin(frame / 7.0)
+        image = 120 + self.rng.randint(0, 40, (height, width))
+        image[(x - cx) ** 2 + (y - cy) ** 2 < (height / 10.0) ** 2] = 10
+        image[(x - cx - height / 25.0) ** 2 + (y - cy + height / 25.0) ** 2 < (height / 60.0) ** 2] = 250
+        return image.astype(np.uint8), (cx, cy)
+
+    def doTrackerSetup(self, width=None, height=None):
+        """ Show camera images (with crosshairs and search limits) and the calibration targets on the custom display """
+        self._link()
+        genv = _graphics
+        if genv is None:
+            return
+        genv.setup_cal_display()
+
+        # camera image
+        camWidth, camHeight = settings['cameraSize']
+        levels = list(range(256))
+        genv.setup_image_display(camWidth, camHeight)
+        genv.image_title('Emulated camera (%d Hz, %d ms link)' %(settings['sampleRate'], settings['latency'] * 1000))
+        genv.set_image_palette(levels, levels, levels)
+        framePeriod = 1.0 / settings['cameraRate']
+        for frame in range(settings['cameraFrames']):
+            frameStart = timeit.default_timer()
+            image, genv.emulatedPupil = self._camera_image(frame, camWidth, camHeight)
+            for line in range(camHeight):
+                genv.draw_image_line(camWidth, line + 1, camHeight, image[line])
+            if ESC_KEY in [key.key for key in genv.get_input_key()]:
+                break
+            time.sleep(max(0.0, framePeriod - (timeit.default_timer() - frameStart)))
+        genv.exit_image_display()
+
+        # calibration targets (HV5: centre, top, bottom, left, right)
+        w, h = self.screen
+        positions = [(w / 2, h / 2), (w / 2, h * 0.12), (w / 2, h * 0.88), (w * 0.12, h / 2), (w * 0.88, h / 2)]
+        for n in range(settings['targets']):
+            genv.draw_cal_target(*positions[n % len(positions)])
+            genv.play_beep(CAL_TARG_BEEP)
+            targetEnd = timeit.default_timer() + settings['targetDur']
+            while timeit.default_timer() < targetEnd:
+                genv.get_input_key()
+                time.sleep(0.005)
+            genv.erase_cal_target()
+        genv.play_beep(CAL_GOOD_BEEP)
+        genv.exit_cal_display()
+        self.sendMessage('!CAL CALIBRATION HV5 R RIGHT GOOD (emulated)')
+
+
+class EyeLinkCustomDisplay(object):
+    """ Base class of custom calibration displays; draws the crosshair and search limits of the emulated camera """
+
+    def __init__(self):
+        self.emulatedPupil = None  # pupil centre in the current camera image (set by doTrackerSetup)
+
+    def draw_cross_hair(self):
+        if getattr(self, 'emulatedPupil', None) is None:
+            return
+        width, height = self.size
+        x, y = self.emulatedPupil
+        self.draw_line(x - width / 20.0, y, x + width / 20.0, y, PUPIL_HAIR_COLOR)
+        self.draw_line(x, y - height / 20.0, x, y + height / 20.0, PUPIL_HAIR_COLOR)
+        self.draw_lozenge(width * 0.2, height * 0.15, width * 0.6, height * 0.7, SEARCH_LIMIT_BOX_COLOR)
+
+
+class KeyInput(object):
+    def __init__(self, key, state=0):
+        self.key = key
+        self.state = state
+
+
+def openGraphicsEx(genv):
+    """ Use genv as the calibration display of doTrackerSetup """
+    global _graphics
+    _graphics = genv
+
+
+def closeGraphics():
+    global _graphics
+    _graphics = None
+
+
+def pumpDelay(ms):
+    time.sleep(ms / 1000.0)
+
+
+msecDelay = pumpDelay
+
+# pylink constants used by the experiment and the calibration display (same values as the fake pylink of simulationFunctions)
+CR_HAIR_COLOR = 1
+PUPIL_HAIR_COLOR = 2
+PUPIL_BOX_COLOR = 3
+SEARCH_LIMIT_BOX_COLOR = 4
+MOUSE_CURSOR_COLOR = 5
+
+CAL_TARG_BEEP = 1
+CAL_GOOD_BEEP = 2
+CAL_ERR_BEEP = 3
+DC_TARG_BEEP = 4
+DC_GOOD_BEEP = 5
+DC_ERR_BEEP = 6
+
+F1_KEY = 0x3b00
+F2_KEY = 0x3c00
+F3_KEY = 0x3d00
+F4_KEY = 0x3e00
+F5_KEY = 0x3f00
+F6_KEY = 0x4000
+F7_KEY = 0x4100
+F8_KEY = 0x4200
+F9_KEY = 0x4300
+F10_KEY = 0x4400
+
+JUNK_KEY = 1
+TERMINATE_KEY = 0x7004
+ESC_KEY = 0x1b
+ENTER_KEY = 0x0d
+PAGE_UP = 0x4900
+PAGE_DOWN = 0x5100
+CURS_UP = 0x4800
+CURS_DOWN = 0x5000
+CURS_LEFT = 0x4b00
+CURS_RIGHT = 0x4d00
+
+# the emulator as a pylink module (see install)
+pylinkModule = types.ModuleType('pylink')
+pylinkModule.__version__ = '2.1 (emulated)'
+for _name in ['EyeLink', 'EyeLinkCustomDisplay', 'KeyInput', 'openGraphicsEx', 'closeGraphics', 'pumpDelay', 'msecDelay',
+              'CR_HAIR_COLOR', 'PUPIL_HAIR_COLOR', 'PUPIL_BOX_COLOR', 'SEARCH_LIMIT_BOX_COLOR', 'MOUSE_CURSOR_COLOR',
+              'CAL_TARG_BEEP', 'CAL_GOOD_BEEP', 'CAL_ERR_BEEP', 'DC_TARG_BEEP', 'DC_GOOD_BEEP', 'DC_ERR_BEEP',
+              'JUNK_KEY', 'TERMINATE_KEY', 'ESC_KEY', 'ENTER_KEY', 'PAGE_UP', 'PAGE_DOWN', 'CURS_UP', 'CURS_DOWN',
+              'CURS_LEFT', 'CURS_RIGHT'] + ['F%d_KEY' %(_i) for _i in range(1, 11)]:
+    setattr(pylinkModule, _name, globals()[_name])
+
+# experiment modules that import pylink (re-imported so they bind to the emulator)
+_pylinkModules = ['pylink', 'EyeLinkCoreGraphicsPsychoPy']
+
+
+def install():
+    """ Replace pylink with the emulator for modules imported from now on """
+    for name in _pylinkModules:
+        sys.modules.pop(name, None)
+    sys.modules['pylink'] = pylinkModule
+
+
+def uninstall():
+    """ Remove the emulator (pylink is imported normally again) """
+    for name in _pylinkModules:
+        sys.modules.pop(name, None)
+
+
+def run_script(script):
+    """ Run an experiment script with the emulated tracker
+
+        Args:
+            script (str): Path to the experiment script (e.g., 'anm1_scanner.py').
+    """
+    scriptPath = os.path.abspath(script)
+    scriptDir = os.path.dirname(scriptPath)
+    cwd = os.getcwd()
+    install()
+    sys.path.insert(0, scriptDir)
+    os.chdir(scriptDir)
+    try:
+        runpy.run_path(scriptPath, run_name='__main__')
+    except SystemExit:
+        pass
+    finally:
+        os.chdir(cwd)
+        sys.path.remove(scriptDir)
+        uninstall()
+
+
+def bench(recordDur=5.0, nMessages=500):
+    """ Time the tracker code paths of the experiment against the emulated tracker
+
+        Reports the send latency of MessageDispatcher, the drift recovered by ClockSync, the transfer and verification
+        of a recorded data file by EdfRotation, and the setup counters of EyeLinkCoreGraphicsPsychoPy.
+
+        Args:
+            recordDur (float): Time (s) to record (gaze samples in the data file and clock samples).
+            nMessages (int): Number of messages to send while recording.
+    """
+    import tempfile, shutil
+    install()
+    try:
+        from psychopy import visual, core
+        import eyeTrackerFunctions as ef
+        from EyeLinkCoreGraphicsPsychoPy import EyeLinkCoreGraphicsPsychoPy
+
+        print('emulated tracker: %s' %(', '.join('%s=%s' %(key, settings[key]) for key in sorted(settings))))
+        tk = EyeLink(None)
+        edfFolder = tempfile.mkdtemp()
+        edfFiles = ef.EdfRotation(tk, folder=edfFolder, fileName='BENCH.EDF', rotate=True, subject=0, fileNumber=1)
+        edfFiles.open()
+
+        # messages and clock samples while recording
+        tk.startRecording(1, 1, 1, 1)
+        messages = ef.MessageDispatcher(tk=tk)
+        clockSync = ef.ClockSync(tk=tk, interval=0.05, lock=messages.lock)
+        clockSync.start()
+        zero = core.getTime()
+        for n in range(nMessages):
+            messages.send('bench_message %d' %(n))
+            time.sleep(recordDur / nMessages)
+        messages.close()
+        clockSync.stop()
+        model = clockSync.fit(zero=zero)
+        tk.stopRecording()
+        print('messages:   %s' %(', '.join('%s=%.3g' %(col, value) for col, value in messages.stats().items())))
+        print('clock sync: rate %.6f (true %.6f), residual SD %.3f ms, %d samples'
+              %(model['rate'], 1000.0 * (1.0 + settings['drift_ppm'] * 1e-6), model['residualSD_ms'], model['samples']))
+
+        # data file transfer
+        edfFiles.end_run('run1')
+        edfFiles.wait()
+        transfer = edfFiles.transfers[-1]
+        print('transfer:   %d bytes in %.2f s, size match %s, verified %s'
+              %(transfer['bytes'], transfer['transfer_s'], transfer['sizeMatch'], transfer['verified']))
+        shutil.rmtree(edfFolder)
+
+        # setup screens
+        win = visual.Window(size=(800, 600), fullscr=False, units='pix', color=(-1, -1, -1), allowGUI=False)
+        genv = EyeLinkCoreGraphicsPsychoPy(tk, win)
+        openGraphicsEx(genv)
+        tk.doTrackerSetup()
+        print('setup:      %s' %(', '.join('%s=%s' %(col, value) for col, value in genv.setupStats.items())))
+        print('link:       %s' %(', '.join('%s=%.3g' %(col, value) for col, value in tk.link_stats().items())))
+        closeGraphics()
+        win.close()
+    finally:
+        uninstall()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run an experiment script or benchmark with an emulated EyeLink')
+    parser.add_argument('script', nargs='?', help='experiment script (e.g., anm1_scanner.py)')
+    parser.add_argument('--bench', action='store_true', help='time the tracker code paths instead of running a script')
+    parser.add_argument('--latency', type=float, default=settings['latency'], help='time (s) of each link call')
+    parser.add_argument('--sample-rate', type=int, default=settings['sampleRate'], help='gaze samples per second')
+    parser.add_argument('--transfer-rate', type=float, default=settings['transferRate'], help='data file transfer (bytes/s)')
+    parser.add_argument('--drift', type=float, default=settings['drift_ppm'], help='tracker clock drift (ppm)')
+    parser.add_argument('--camera-frames', type=int, default=settings['cameraFrames'], help='camera images in each setup')
+    args = parser.parse_args()
+
+    configure(latency=args.latency, sampleRate=args.sample_rate, transferRate=args.transfer_rate,
+              drift_ppm=args.drift, cameraFrames=args.camera_frames)
+    if args.bench:
+        bench()
+    elif args.script is not None:
+        run_script(args.script)
+    else:
+        parser.error('give a script to run or --bench')
@@ -0,0 +1,401 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Eye Tracker Functions for EyeLink Recording
+authors: Ian Roberts
+"""
+
+import os, threading, hashlib
+import numpy as np
+from collections import OrderedDict
+from psychopy import core
+
+try:
+    import queue
+except ImportError:  # Python 2
+    import Queue as queue
+
+
+class MessageDispatcher(object):
+    """ Send EyeLink messages from a worker thread, timestamped with the event they mark
+
+        Messages are queued from the trial loop and sent by a worker thread, so a slow link call never delays a flip.
+        Each message carries the time of its event (e.g., the flip on which a stimulus was first shown); when it is
+        sent, the time elapsed since the event is prepended in milliseconds (EyeLink offset-message syntax,
+        "<offset> <message>"), so the EDF timestamp is the event time rather than the time of the link call.
+
+        Args:
+            tk [pylink.EyeLink object]: Connected tracker.
+            win [visual.Window object]: Window used for flip-locked messages (see send_on_flip).
+            maxMessages (int): Number of messages to preallocate statistics for.
+    """
+
+    def __init__(self, tk, win=None, maxMessages=5000):
+        self.tk = tk
+        self.win = win
+        self.messages = queue.Queue()
+        self.eventTimes = np.full(maxMessages, np.nan)  # core.getTime of the event marked by each message
+        self.sendTimes = np.full(maxMessages, np.nan)  # core.getTime when the link call started
+        self.callDurs = np.full(maxMessages, np.nan)  # duration of each link call
+        self.queueDepths = np.zeros(maxMessages, dtype=int)  # messages waiting when each message was queued
+        self.nQueued = 0
+        self.nSent = 0
+        self.lock = threading.Lock()  # held during each link call (shared with other link threads, e.g., ClockSync)
+        self.worker = threading.Thread(target=self._send_loop)
+        self.worker.daemon = True
+        self.worker.start()
+
+    def _queue(self, msg, t):
+        n = self.nQueued
+        if n < len(self.eventTimes):
+            self.queueDepths[n] = self.messages.qsize()
+        self.nQueued += 1
+        self.messages.put((n, msg, t))
+
+    def _send_loop(self):
+        while True:
+            item = self.messages.get()
+            if item is None:
+                self.messages.task_done()
+                break
+            n, msg, t = item
+            sendTime = core.getTime()
+            offset = int(round((sendTime - t) * 1000.0))
+            with self.lock:
+                self.tk.sendMessage('%d %s' %(max(offset, 0), msg))
+            if n < len(self.eventTimes):
+                self.eventTimes[n] = t
+                self.sendTimes[n] = sendTime
+                self.callDurs[n] = core.getTime() - sendTime
+            self.nSent += 1
+            self.messages.task_done()
+
+    def send(self, msg, t=None):
+        """ Queue a message for an event that has already happened
+
+            Args:
+                msg (str): Message text.
+                t (float): Time of the event on core.getTime. If None, the time the message was queued.
+        """
+        if t is None:
+            t = core.getTime()
+        self._queue(msg, t)
+
+    def send_on_flip(self, msg):
+        """ Queue a message timestamped with the next flip of the window (e.g., the onset of a stimulus) """
+        self.win.callOnFlip(self._flipped, msg)
+
+    def _flipped(self, msg):
+        self._queue(msg, core.getTime())  # called by win.flip() right after the buffer swap
+
+    def flush(self):
+        """ Wait until every queued message has been sent """
+        self.messages.join()
+
+    def close(self):
+        """ Send the remaining messages and stop the worker thread """
+        if self.worker.is_alive():
+            self.messages.put(None)
+            self.worker.join()
+
+    def stats(self):
+        """ Queue depth and send-latency statistics of the messages sent so far
+
+            Send latency is the time from the event to the start of its link call (the offset written to the EDF);
+            link call is the duration of the tk.sendMessage call itself.
+        """
+        n = min(self.nSent, len(self.eventTimes))
+        latency = (self.sendTimes[:n] - self.eventTimes[:n]) * 1000.0
+        callDurs = self.callDurs[:n] * 1000.0
+        depths = self.queueDepths[:min(self.nQueued, len(self.queueDepths))]
+        stats = OrderedDict()
+        stats['elMessages'] = self.nSent
+        stats['elQueueDepthMean'] = depths.mean() if depths.size else np.nan
+        stats['elQueueDepthMax'] = int(depths.max()) if depths.size else 0
+        stats['elSendLatencyMedian_ms'] = np.median(latency) if n else np.nan
+        stats['elSendLatencyMax_ms'] = latency.max() if n else np.nan
+        stats['elLinkCallMedian_ms'] = np.median(callDurs) if n else np.nan
+        stats['elLinkCallMax_ms'] = callDurs.max() if n else np.nan
+        return stats
+
+
+class ClockSync(object):
+    """ Model of EyeLink tracker time as a function of local time (core.getTime), sampled during a run
+
+        A worker thread reads tk.trackerTime() at regular intervals, bracketed by two local clock reads, so no link
+        call is made between flips of the trial loop. The local time of each sample is the midpoint of the bracket.
+        Samples with a round trip above the median are dropped, and a line (offset and drift) is fitted to the rest:
+            trackerTime (ms) = trackerAtZero_ms + rate * (t - zero)
+        where rate is tracker milliseconds per local second (1000 without drift). Any local timestamp (e.g., onsets
+        relative to the scanner trigger) can then be converted to tracker time without the EDF messages.
+
+        Args:
+            tk [pylink.EyeLink object]: Connected tracker.
+            interval (float): Time (s) between samples.
+            lock [threading.Lock object]: Lock held during each link call (e.g., MessageDispatcher.lock).
+            maxSamples (int): Number of samples to preallocate.
+    """
+
+    def __init__(self, tk, interval=1.0, lock=None, maxSamples=2000):
+        self.tk = tk
+        self.interval = interval
+        self.lock = lock if lock is not None else threading.Lock()
+        self.localTimes = np.full(maxSamples, np.nan)  # core.getTime at the midpoint of each link call
+        self.trackerTimes = np.full(maxSamples, np.nan)  # tk.trackerTime (ms)
+        self.roundTrips = np.full(maxSamples, np.nan)  # duration of each link call
+        self.nSamples = 0
+        self.stopping = threading.Event()
+        self.worker = None
+
+    def sample(self):
+        """ Read the tracker clock once """
+        if self.nSamples >= len(self.localTimes):
+            return
+        with self.lock:
+            before = core.getTime()
+            trackerTime = self.tk.trackerTime()
+            after = core.getTime()
+        n = self.nSamples
+        self.localTimes[n] = (before + after) / 2.0
+        self.trackerTimes[n] = trackerTime
+        self.roundTrips[n] = after - before
+        self.nSamples += 1
+
+    def sample_age(self):
+        """ Time (s) since the last sample of the tracker clock (grows if the link stops responding) """
+        if self.nSamples == 0:
+            return np.nan
+        return core.getTime() - self.localTimes[self.nSamples - 1]
+
+    def _sample_loop(self):
+        while not self.stopping.is_set():
+            self.sample()
+            self.stopping.wait(self.interval)
+
+    def start(self):
+        """ Start sampling on the worker thread """
+        self.stopping.clear()
+        self.worker = threading.Thread(target=self._sample_loop)
+        self.worker.daemon = True
+        self.worker.start()
+
+    def stop(self):
+        """ Stop sampling (a final sample is taken so the model spans the whole run) """
+        if self.worker is not None:
+            self.stopping.set()
+            self.worker.join()
+            self.worker = None
+            self.sample()
+
+    def fit(self, zero=0.0):
+        """ Fit the offset and drift of the tracker clock
+
+            Args:
+                zero (float): Local time (core.getTime) that the offset refers to (e.g., the scanner trigger).
+
+            Returns an ordered dictionary with the tracker time at zero (ms), the rate (tracker ms per local second),
+            the residual SD (ms) and the number of samples used and their round trip.
+        """
+        n = self.nSamples
+        roundTrips = self.roundTrips[:n]
+        keep = roundTrips <= np.median(roundTrips) if n else np.zeros(0, dtype=bool)
+        localTimes = self.localTimes[:n][keep] - zero
+        trackerTimes = self.trackerTimes[:n][keep]
+        model = OrderedDict()
+        model['trackerAtZero_ms'] = np.nan
+        model['rate'] = np.nan
+        model['residualSD_ms'] = np.nan
+        model['samples'] = int(keep.sum())
+        model['roundTripMedian_ms'] = np.median(roundTrips) * 1000.0 if n else np.nan
+        if model['samples'] >= 2 and np.ptp(localTimes) > 0:
+            model['rate'], model['trackerAtZero_ms'] = np.polyfit(localTimes, trackerTimes, 1)
+            model['residualSD_ms'] = np.std(trackerTimes - (model['trackerAtZero_ms'] + model['rate'] * localTimes))
+        return model
+
+
+def tracker_time(t, trackerAtZero, rate):
+    """ Convert local times (s, relative to the zero of a ClockSync fit) to tracker time (ms) """
+    return trackerAtZero + rate * np.asarray(t, dtype=float)
+
+
+def base36(value, width):
+    """ value (a non-negative integer) in base 36 (0-9, A-Z), zero-padded to width characters """
+    value = int(value)
+    if value < 0 or value >= 36 ** width:
+        raise Exception('%d does not fit in %d base-36 characters' %(value, width))
+    digits = ''
+    for i in range(width):
+        value, digit = divmod(value, 36)
+        digits = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'[digit] + digits
+    return digits
+
+
+def file_sha1(fileName, blockSize=1 << 20):
+    """ SHA-1 checksum (hex) of a file """
+    sha1 = hashlib.sha1()
+    with open(fileName, 'rb') as f:
+        for block in iter(lambda: f.read(blockSize), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+class EdfRotation(object):
+    """ EDF data files that are optionally closed at each run boundary and received on a background thread
+
+        Without rotation, one data file is kept open for the session and received when the session ends (as before).
+        With rotation, the data file is closed at the end of each run and received into the local folder on a worker
+        thread while the participant rests, so a crash only loses the run in progress and the transfer does not block
+        the display. The next data file is opened once the transfer has finished (the link carries one transfer at a
+        time, so this has to happen before the next calibration). Each received file is checked against the size
+        reported by the tracker and its SHA-1 checksum is written next to it (<file>.sha1). If verify is True, the
+        host copy is received a second time and its checksum must match the first.
+
+        The tracker reports transfer progress through progressUpdate(size, received); store it as
+        tk.transferProgress = (size, received) in the EyeLink subclass so progress can be shown (see progress).
+
+        Args:
+            tk [pylink.EyeLink object]: Connected tracker.
+            folder (str): Local folder for the received data files (e.g., edfData).
+            fileName (str): Data file name (host file when not rotating, and prefix of the local files when rotating).
+            preamble (str): Text added to the preamble of every data file.
+            rotate (True/False): Whether to use one data file per run.
+            subject (int): Subject number (required when rotating; up to 46655).
+            fileNumber (int): File number of the session (required when rotating; up to 1295).
+            verify (True/False): Whether to receive each rotated file twice and compare checksums.
+
+        Host file names are limited to 8 characters. When rotating, each host file is named from the first letter of
+        fileName and the subject, file number and file counter in base 36 (3, 2 and 2 characters; e.g., subject 9001,
+        file 2 gives A6Y10200.EDF, A6Y10201.EDF, ...), so no other subject or session (e.g., a restart after a crash)
+        overwrites a file that may not have been received yet. An exception is raised if a value does not fit.
+    """
+
+    def __init__(self, tk, folder, fileName, preamble=None, rotate=False, subject=None, fileNumber=None, verify=True):
+        self.tk = tk
+        self.folder = folder
+        self.fileName = fileName
+        self.preamble = preamble
+        self.rotate = rotate
+        if rotate:
+            if subject is None or fileNumber is None:
+                raise Exception('EdfRotation needs the subject and file number to name the rotated host files')
+            self.hostPrefix = os.path.basename(fileName)[0].upper() + base36(subject, 3) + base36(fileNumber, 2)
+        self.verify = verify
+        self.headerMessages = []
+        self.hostFile = None  # data file open on the host
+        self.nFiles = 0
+        self.worker = None
+        self.transferPass = 0  # 0: receiving, 1: receiving again to verify
+        self.transfers = []  # result of each transfer (see _receive)
+
+    def open(self):
+        """ Open the next data file on the host (does nothing if a data file is open) """
+        if self.hostFile is not None:
+            return
+        self.wait()
+        if self.rotate:
+            self.hostFile = '%s%s.EDF' %(self.hostPrefix, base36(self.nFiles, 2))
+        else:
+            self.hostFile = self.fileName
+        self.nFiles += 1
+        self.tk.openDataFile(self.hostFile)
+        if self.preamble is not None:
+            self.tk.sendCommand("add_file_preamble_text '%s'" %(self.preamble))
+        for msg in self.headerMessages:
+            self.tk.sendMessage(msg)
+
+    def send_header(self, msg):
+        """ Send a message now and at the start of every later data file (e.g., DISPLAY_COORDS) """
+        self.headerMessages.append(msg)
+        self.tk.sendMessage(msg)
+
+    def local_file(self, label=None):
+        """ Local path of the data file received for a run """
+        if not self.rotate or label is None:
+            return os.path.join(self.folder, self.fileName)
+        name, ext = os.path.splitext(self.fileName)
+        return os.path.join(self.folder, '%s_%s%s' %(name, label, ext))
+
+    def end_run(self, label):
+        """ Close the data file of a finished run and receive it in the background (only when rotating)
+
+            Args:
+                label (str): Run label added to the local file name (e.g., run1).
+        """
+        if not self.rotate or self.hostFile is None:
+            return
+        self.tk.setOfflineMode()
+        self.tk.closeDataFile()
+        hostFile, self.hostFile = self.hostFile, None
+        self.worker = threading.Thread(target=self._receive, args=(hostFile, self.local_file(label)))
+        self.worker.daemon = True
+        self.worker.start()
+
+    def _receive(self, hostFile, localFile):
+        start = core.getTime()
+        nPasses = 2 if self.verify else 1
+        result = OrderedDict([('file', os.path.basename(localFile)), ('hostFile', hostFile)])
+        self.tk.transferProgress = None
+        self.transferPass = 0
+        size = self.tk.receiveDataFile(hostFile, localFile)
+        result['bytes'] = size
+        result['sizeMatch'] = os.path.isfile(localFile) and size > 0 and os.path.getsize(localFile) == size
+        result['sha1'] = file_sha1(localFile) if os.path.isfile(localFile) else ''
+        result['verified'] = np.nan
+        if self.verify and result['sizeMatch']:
+            verifyFile = localFile + '.verify'
+            self.tk.transferProgress = None
+            self.transferPass = 1
+            self.tk.receiveDataFile(hostFile, verifyFile)
+            result['verified'] = int(os.path.isfile(verifyFile) and file_sha1(verifyFile) == result['sha1'])
+            if os.path.isfile(verifyFile):
+                os.remove(verifyFile)
+        self.transferPass = nPasses
+        if result['sha1']:
+            with open(localFile + '.sha1', 'w') as f:
+                f.write('%s  %s\n' %(result['sha1'], os.path.basename(localFile)))
+        result['transfer_s'] = core.getTime() - start
+        self.transfers.append(result)
+
+    def transferring(self):
+        """ Whether a data file is being received """
+        return self.worker is not None and self.worker.is_alive()
+
+    def progress(self):
+        """ Fraction (0-1) of the current transfer received, including the verification pass """
+        if not self.transferring():
+            return 1.0
+        nPasses = 2 if self.verify else 1
+        fraction = 0.0
+        transferProgress = getattr(self.tk, 'transferProgress', None)
+        if transferProgress is not None and transferProgress[0] > 0:
+            fraction = min(float(transferProgress[1]) / transferProgress[0], 1.0)
+        return min((self.transferPass + fraction) / nPasses, 1.0)
+
+    def wait(self):
+        """ Wait for the current transfer to finish """
+        if self.worker is not None:
+            self.worker.join()
+            self.worker = None
+
+    def close(self, label=None):
+        """ Close the open data file and receive it (blocking), after any transfer in progress (e.g., at the end of the session)
+
+            Args:
+                label (str): Run label added to the local file name when rotating.
+        """
+        self.wait()
+        if self.hostFile is None:
+            return
+        self.tk.setOfflineMode()
+        self.tk.closeDataFile()
+        core.wait(0.05)  # let the tracker finish writing the file
+        hostFile, self.hostFile = self.hostFile, None
+        if self.rotate:
+            self._receive(hostFile, self.local_file(label))
+        else:
+            self.tk.receiveDataFile(hostFile, self.local_file())
+
+    def check(self):
+        """ Files whose transfer failed the size or checksum check """
+        return [result['file'] for result in self.transfers if not result['sizeMatch'] or result['verified'] == 0]
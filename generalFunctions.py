@@ -10,6 +10,7 @@ import random, os, time
 from psychopy import visual, core, event, data, gui, logging
 import pandas as pd
 import numpy as np
+from collections import OrderedDict
 # import smtplib
 #
 # def send_email(from_addr, to_addr_list, #cc_addr_list,
@@ -247,6 +248,187 @@ def generate_resp_scale(respKeys=None, primaryLabels=None, secondaryLabels=None,
     return respStim
 
 
+# closed sets of values shown on the choice screens (see NumericText)
+amountValues = [str(amount) for amount in range(41)]  # proposal amounts 0-40
+probValues = [str(prob) + '%' for prob in range(101)]  # need probabilities 0-100%
+
+
+class NumericText(object):
+    """ Text stimulus for a closed set of values (e.g., amounts and probabilities) rendered once at startup
+
+        A TextStim is built for every value when the stimulus is created, so setText only selects a prepared stimulus
+        and no text is laid out or uploaded as a texture during a run. Supports the parts of the TextStim interface
+        used by the tasks (setText, text, pos, setAutoDraw, draw). Values outside the set are built on first use.
+
+        Args:
+            win [visual.Window object]: Provide the window object to use.
+            values [list]: A list of all values (str) that will be displayed.
+            text [str]: Value to display initially.
+            **kwargs: Arguments passed on to visual.TextStim (e.g., pos, color, font, height, units).
+    """
+
+    def __init__(self, win, values, text=None, **kwargs):
+        self.win = win
+        self.stimArgs = kwargs
+        self.stims = {}
+        for value in values:
+            self._build(value)
+        self.autoDraw = False
+        self.text = None
+        self.stim = None
+        self.setText(values[0] if text is None else text)
+
+    def _build(self, value):
+        self.stims[value] = visual.TextStim(win=self.win, text=value, **self.stimArgs)
+        return self.stims[value]
+
+    def setText(self, text):
+        """ Display a value (converted with str) """
+        text = str(text)
+        if text == self.text:
+            return
+        stim = self.stims.get(text)
+        if stim is None:
+            stim = self._build(text)
+        if self.autoDraw:
+            self.stim.setAutoDraw(False)
+            stim.setAutoDraw(True)
+        self.text = text
+        self.stim = stim
+
+    @property
+    def pos(self):
+        return self.stimArgs.get('pos', (0, 0))
+
+    @pos.setter
+    def pos(self, pos):
+        self.stimArgs['pos'] = pos
+        for stim in self.stims.values():
+            stim.pos = pos
+
+    def setAutoDraw(self, autoDraw):
+        """ Draw the current value on every flip (True) or stop drawing it (False) """
+        self.autoDraw = autoDraw
+        self.stim.setAutoDraw(autoDraw)
+
+    def draw(self):
+        """ Draw the current value on the next flip """
+        self.stim.draw()
+
+
+class ScreenCompositor(object):
+    """ Draw a screen as one cached texture of its static layers plus its dynamic stimuli
+
+        The static stimuli of each screen (e.g., partner cue, shape and labels of a choice screen) are drawn once into
+        the back buffer and captured as a visual.BufferImageStim, so every frame draws a single quad before the
+        dynamic stimuli (e.g., amounts). The time spent drawing each frame is recorded for comparison with drawing
+        every stimulus separately (precomposite=False).
+
+        Args:
+            win [visual.Window object]: Provide the window object to use.
+            precomposite [True/False]: If True, draw static layers from the cached texture. If False, draw each static stimulus.
+    """
+
+    def __init__(self, win, precomposite=True):
+        self.win = win
+        self.precomposite = precomposite
+        self.screens = {}
+        self.static = []
+        self.reset_stats()
+
+    def compose(self, key, staticStims):
+        """ Select the screen for key, building its cached texture from staticStims on first use
+
+            Build screens before the run (e.g., for every partner block) so no texture is captured between flips.
+        """
+        if key not in self.screens:
+            if self.precomposite:
+                self.screens[key] = [visual.BufferImageStim(self.win, stim=list(staticStims))]
+                self.win.clearBuffer()  # the capture is not shown
+            else:
+                self.screens[key] = list(staticStims)
+        self.static = self.screens[key]
+
+    def draw(self, dynamicStims=()):
+        """ Draw the selected screen and then the dynamic stimuli on the next flip """
+        start = core.getTime()
+        for stim in self.static:
+            stim.draw()
+        for stim in dynamicStims:
+            stim.draw()
+        self.drawTimes.append(core.getTime() - start)
+
+    def reset_stats(self):
+        """ Start a new set of draw time measurements (e.g., for each run) """
+        self.drawTimes = []
+
+    def stats(self):
+        """ Number of frames drawn and draw time per frame in milliseconds """
+        drawTimes = np.asarray(self.drawTimes) * 1000.0
+        stats = OrderedDict()
+        stats['precomposited'] = int(self.precomposite)
+        stats['frames'] = drawTimes.size
+        stats['drawMedian_ms'] = np.median(drawTimes) if drawTimes.size else np.nan
+        stats['drawMax_ms'] = drawTimes.max() if drawTimes.size else np.nan
+        return stats
+
+
+class Prefetcher(object):
+    """ Run preparation work between the flips of a waiting screen (e.g., the rest screen before a run)
+
+        The work is given as a generator that yields after each step (e.g., yield 'choiceScreens'). Each call of step
+        runs steps until the frame budget is used, so the waiting screen keeps flipping while the next run is built.
+        Steps left when the waiting ends are run by finish. The time of each step is recorded.
+
+        Args:
+            steps [generator]: Preparation steps, yielding the name of each completed step.
+            budget [float]: Time (s) to spend on steps before each flip. At least one step is run per call.
+    """
+
+    def __init__(self, steps, budget=0.008):
+        self.steps = steps
+        self.budget = budget
+        self.done = False
+        self.stepTimes = OrderedDict()  # total time of each named step
+        self.nSteps = 0
+        self.lateSteps = 0  # steps run by finish (after the waiting screens)
+
+    def _next(self):
+        start = core.getTime()
+        try:
+            name = next(self.steps)
+        except StopIteration:
+            self.done = True
+            return
+        self.stepTimes[name] = self.stepTimes.get(name, 0.0) + core.getTime() - start
+        self.nSteps += 1
+
+    def step(self):
+        """ Run preparation steps until the frame budget is used (call once per flip) """
+        start = core.getTime()
+        while not self.done:
+            self._next()
+            if core.getTime() - start >= self.budget:
+                break
+
+    def finish(self):
+        """ Run the remaining preparation steps """
+        while not self.done:
+            self._next()
+            if not self.done:
+                self.lateSteps += 1
+
+    def stats(self):
+        """ Number of steps, total time and time of the longest named step in milliseconds, and steps left to finish """
+        stepTimes = np.array(list(self.stepTimes.values())) * 1000.0
+        stats = OrderedDict()
+        stats['steps'] = self.nSteps
+        stats['total_ms'] = stepTimes.sum()
+        stats['max_ms'] = stepTimes.max() if stepTimes.size else np.nan
+        stats['lateSteps'] = self.lateSteps
+        return stats
+
+
 def show_instructs(win, text, timeAutoAdvance=0, timeRequired=0, advanceKey=['space'], secretKey=None, textPos=None, textHeight=None, advanceHeight=None, advancePos=None, wrapWidth=None, image=None, imageDim=(500,500), scaleImage=1.0, imagePos=(0,-0.5), units="norm", saveFile=None):
     ''' Display task instructions
 
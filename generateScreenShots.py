@@ -173,9 +173,9 @@ initialScansText = visual.TextStim(win=win, text='Taking initial scans...', pos=
 fixation = visual.TextStim(win=win, text='+', pos=(0,0), color=(1,1,1), font=textFont, units="norm", height=0.5)
 selfLabel = visual.TextStim(win=win, text='You', pos=(-0.5,0.25), color=(1,1,1), font=textFont, units="norm", height=0.3)
 otherLabel = visual.TextStim(win=win, text='Partner', pos=(0.5,0.25), color=(1,1,1), font=textFont, units="norm")
-selfAmount = visual.TextStim(win=win, text='00', pos=(-0.5, -0.25), color=(1,1,1), font=textFont, height=0.5, units="norm")
-otherAmount = visual.TextStim(win=win, text='00', pos=(0.5, -0.25), color=(1,1,1), font=textFont, height=0.5, units="norm")
-probText = visual.TextStim(win=win, text='', pos=(0,0), color=(1,1,1), font=textFont, height=0.5, units="norm")
+selfAmount = gf.NumericText(win=win, values=gf.amountValues, pos=(-0.5, -0.25), color=(1,1,1), font=textFont, height=0.5, units="norm")
+otherAmount = gf.NumericText(win=win, values=gf.amountValues, pos=(0.5, -0.25), color=(1,1,1), font=textFont, height=0.5, units="norm")
+probText = gf.NumericText(win=win, values=gf.probValues, pos=(0,0), color=(1,1,1), font=textFont, height=0.5, units="norm")
 
 # create response keys
 respKeys = ['1', '2', '3', '4']  # list of response keys that subjects can use
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Monitor Functions for a Live Experimenter Dashboard
+authors: Ian Roberts
+
+The trial loop publishes one record per trial (responses and timing counters) into a ring buffer in a memory-mapped
+file (MonitorWriter). A separate process maps the same file and prints a dashboard of the run at a low rate
+(MonitorReader, run_dashboard), so rendering never competes with the participant display. The experiment starts the
+dashboard with launch_dashboard; it can also be started by hand:
+    python monitorFunctions.py data/0001_monitor.bin
+"""
+
+from __future__ import print_function
+import os, sys, mmap, time, timeit, subprocess, argparse, atexit
+import numpy as np
+from collections import OrderedDict
+
+_magic = b'ANMM'
+launchDashboards = True  # if False, launch_dashboard does not start a process (e.g., in headless simulations)
+
+# header of the monitor file (written between runs) followed by the ring of trial records (written on every trial)
+headerDtype = np.dtype([('magic', 'S4'), ('capacity', '<u4'), ('count', '<u8'), ('run', '<i4'), ('nTrials', '<i4'),
+                        ('status', 'S16'), ('updated', '<f8')])
+recordDtype = np.dtype([('seq', '<u8'),  # record number + 1 (0 while the record is being written)
+                        ('run', '<i4'), ('trial', '<i4'), ('partner', 'S8'), ('prob', '<f4'),
+                        ('respNum', '<i2'),  # 0 if no response
+                        ('accept', '<f4'), ('rt', '<f4'), ('lateResps', '<i2'),
+                        ('droppedFrames', '<i4'), ('maxFrameInterval_ms', '<f4'), ('propOnsetError_ms', '<f4'),
+                        ('trackerSampleAge_s', '<f4'), ('elQueueDepth', '<i4'), ('time', '<f8')])
+
+
+class MonitorWriter(object):
+    """ Publish trial records into a shared ring buffer (memory-mapped file) for the experimenter dashboard
+
+        There is one writer and the dashboard only reads, so no lock is taken: a record's sequence number is cleared,
+        its fields are written in one structured assignment, and the sequence number and record count are set last.
+        The reader drops any record whose sequence number does not match (overwritten or being written). The time of
+        every write is recorded so the cost paid by the trial loop can be reported (see stats).
+
+        Args:
+            fileName (str): File path for the monitor file (e.g., in the data folder).
+            capacity (int): Number of records in the ring (older records are overwritten).
+            enabled (True/False): If False, nothing is written and publish returns immediately.
+            maxWrites (int): Number of write times to preallocate.
+    """
+
+    def __init__(self, fileName, capacity=256, enabled=True, maxWrites=5000):
+        self.fileName = fileName
+        self.enabled = enabled
+        self.count = 0
+        self.writeTimes = np.full(maxWrites, np.nan)
+        self.nWrites = 0
+        if not enabled:
+            return
+        size = headerDtype.itemsize + capacity * recordDtype.itemsize
+        with open(fileName, 'wb') as f:
+            f.write(b'\0' * size)
+        self.file = open(fileName, 'r+b')
+        self.mm = mmap.mmap(self.file.fileno(), size)
+        self.header = np.ndarray((), dtype=headerDtype, buffer=self.mm)
+        self.records = np.ndarray(capacity, dtype=recordDtype, buffer=self.mm, offset=headerDtype.itemsize)
+        self.seqs = self.records['seq']
+        self.capacity = capacity
+        self.header['capacity'] = capacity
+        self.header['magic'] = _magic
+        atexit.register(self.close)  # the dashboard stops when the experiment quits
+
+    def set_status(self, status, run=None, nTrials=None):
+        """ Update the run shown by the dashboard (e.g., 'waiting', 'running', 'finished', 'aborted')
+
+            Args:
+                status (str): Status of the run (up to 16 characters).
+                run (int): Run number.
+                nTrials (int): Number of trials in the run.
+        """
+        if not self.enabled:
+            return
+        if run is not None:
+            self.header['run'] = run
+        if nTrials is not None:
+            self.header['nTrials'] = nTrials
+        self.header['status'] = status.encode('ascii')
+        self.header['updated'] = time.time()
+
+    def publish(self, record):
+        """ Write the record of a completed trial
+
+            Args:
+                record (tuple): Values of the fields of recordDtype after seq, in order.
+        """
+        if not self.enabled:
+            return
+        start = timeit.default_timer()
+        slot = self.count % self.capacity
+        self.seqs[slot] = 0
+        self.records[slot] = (0,) + record
+        self.count += 1
+        self.seqs[slot] = self.count
+        self.header['count'] = self.count
+        if self.nWrites < len(self.writeTimes):
+            self.writeTimes[self.nWrites] = timeit.default_timer() - start
+            self.nWrites += 1
+
+    def reset_stats(self):
+        """ Start a new set of write time measurements (e.g., for each run) """
+        self.writeTimes[:] = np.nan
+        self.nWrites = 0
+
+    def stats(self):
+        """ Number of records written and write time per record in microseconds """
+        writeTimes = self.writeTimes[:self.nWrites] * 1e6
+        stats = OrderedDict()
+        stats['writes'] = self.nWrites
+        stats['writeMedian_us'] = np.median(writeTimes) if writeTimes.size else np.nan
+        stats['writeMax_us'] = writeTimes.max() if writeTimes.size else np.nan
+        return stats
+
+    def close(self):
+        """ Unmap and close the monitor file """
+        if self.enabled:
+            self.set_status('closed')
+            del self.header, self.records, self.seqs
+            self.mm.close()
+            self.file.close()
+            self.enabled = False
+
+
+class MonitorReader(object):
+    """ Read the records published by a MonitorWriter (in another process)
+
+        Args:
+            fileName (str): File path for the monitor file.
+    """
+
+    def __init__(self, fileName):
+        self.file = open(fileName, 'rb')
+        self.mm = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.header = np.frombuffer(self.mm, dtype=headerDtype, count=1)
+        if self.header['magic'][0] != _magic:
+            raise Exception('%s is not a monitor file' %(fileName))
+        self.capacity = int(self.header['capacity'][0])
+        self.records = np.frombuffer(self.mm, dtype=recordDtype, count=self.capacity, offset=headerDtype.itemsize)
+        self.count = 0  # records read so far
+
+    def status(self):
+        """ Run, number of trials, status and time of the last status update """
+        header = self.header[0]
+        return int(header['run']), int(header['nTrials']), header['status'].decode('ascii'), float(header['updated'])
+
+    def read(self):
+        """ Records published since the last read (records overwritten before they were read are skipped) """
+        count = int(self.header['count'][0])
+        first = max(self.count, count - self.capacity)
+        seqs = np.arange(first, count) + 1
+        records = self.records[(seqs - 1) % self.capacity].copy()  # copy before checking the sequence numbers
+        self.count = count
+        return records[records['seq'] == seqs]
+
+    def close(self):
+        self.mm.close()
+        self.file.close()
+
+
+def _summary_line(run, nTrials, status, records, updated):
+    """ One line of the dashboard for the records of the current run """
+    records = records[records['run'] == run]
+    n = records.size
+    responded = records['respNum'] > 0
+    line = 'run %d %-8s trial %3d/%-3d' %(run, status, records['trial'].max() if n else 0, nTrials)
+    if n:
+        line += ' | resp %3.0f%% missed %2d RT %4.2fs accept %3.0f%%' %(100.0 * responded.mean(), n - responded.sum(),
+                                                                   np.nanmean(records['rt']) if responded.any() else np.nan,
+                                                                   100.0 * np.nanmean(records['accept']) if responded.any() else np.nan)
+        line += ' | dropped %3d max %5.1fms onset err %5.1fms' %(records['droppedFrames'].sum(),
+                                                               np.nanmax(records['maxFrameInterval_ms']),
+                                                               records['propOnsetError_ms'][-1])
+        line += ' | tracker %4.1fs el queue %d' %(records['trackerSampleAge_s'][-1], records['elQueueDepth'][-1])
+    if n or updated > 0:  # nothing has been written before the first status update
+        line += ' | %3.0fs ago' %(time.time() - updated if not n else time.time() - records['time'][-1])
+    return line
+
+
+def run_dashboard(fileName, interval=1.0, waitForFile=30.0):
+    """ Print a live summary of the current run every interval seconds until the writer closes the file
+
+        Args:
+            fileName (str): File path for the monitor file.
+            interval (float): Time (s) between updates.
+            waitForFile (float): Time (s) to wait for the experiment to create the file.
+    """
+    deadline = time.time() + waitForFile
+    while not os.path.isfile(fileName) and time.time() < deadline:
+        time.sleep(interval)
+    reader = MonitorReader(fileName)
+    runRecords = np.zeros(0, dtype=recordDtype)
+    lastRun = None
+    try:
+        while True:
+            run, nTrials, status, updated = reader.status()
+            if run != lastRun:
+                if lastRun is not None:
+                    print('')
+                runRecords = np.zeros(0, dtype=recordDtype)
+                lastRun = run
+            runRecords = np.concatenate([runRecords, reader.read()])
+            sys.stdout.write('\r' + _summary_line(run, nTrials, status, runRecords, updated))
+            sys.stdout.flush()
+            if status == 'closed':
+                print('')
+                break
+            time.sleep(interval)
+    finally:
+        reader.close()
+
+
+def launch_dashboard(fileName, interval=1.0):
+    """ Start the dashboard in a separate process (in its own console window on Windows) and return the process """
+    if not launchDashboards:
+        return None
+    return subprocess.Popen([sys.executable, os.path.abspath(__file__), fileName, '--interval', str(interval)],
+                            creationflags=getattr(subprocess, 'CREATE_NEW_CONSOLE', 0))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Live experimenter dashboard of a running experiment')
+    parser.add_argument('monitorFile', help='monitor file written by the experiment')
+    parser.add_argument('--interval', type=float, default=1.0, help='time (s) between updates')
+    args = parser.parse_args()
+
+    run_dashboard(args.monitorFile, interval=args.interval)
@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Replay Functions for Recorded Sessions
+authors: Ian Roberts
+
+Replays a recorded session headless (see simulationFunctions) and compares the regenerated data files with the
+originals. Key presses (including scanner triggers and button-box presses) and mouse clicks are read from the
+PsychoPy log of the session and re-injected at their logged times; the pain dial mouse track is read from the
+session's painDial file. The replay runs on the virtual clock, so it takes seconds rather than the session's length.
+
+Run from the experiment directory, e.g.:
+    python replayFunctions.py anm1_preScanner.py data/subject_1/0001_2019-05-01-10-00-00_anm1_preScanner.log
+"""
+
+from __future__ import print_function
+import os, re, shutil, tempfile, argparse
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+
+import simulationFunctions as sf
+
+_logLine = re.compile(r'^\s*(\d+\.\d+)\s+(\w+)\s+(.*?)\s*$')
+_keypress = re.compile(r'^Keypress: (\S+)$')
+_click = re.compile(r'^Mouse: Left button down, pos=\((-?\d+),(-?\d+)\)$')
+_startTime = re.compile(r'_\d{4}-\d{2}-\d{2}-\d{2}-\d{2}-\d{2}_')
+
+# columns that depend only on the schedule and the participant's responses; all other columns (dates, hardware and
+# timing diagnostics) are not compared
+scheduleColumns = ['subject', 'counterbalance', 'partner', 'color', 'shape', 'item', 'question', 'scaleName',
+                   'blockSet', 'blockType', 'runNumber', 'fileNumber', 'runLabel', 'resumed', 'overallTrialNumber',
+                   'blockTrialNum', 'partnerBlockNum', 'partnerBlockTrialNum', 'overallPartnerTrialNum', 'prob',
+                   'selfProp', 'otherProp', 'selfSide', 'respOrder', 'instructsDur', 'instructsJitterDur', 'needDur',
+                   'jitterDur', 'propDur', 'itiDur', 'instructs_onset', 'instructsJitter_onset', 'need_onset',
+                   'jitter_onset', 'prop_onset', 'iti_onset', 'resp_onset', 'instructsTTL', 'fixTTL', 'needTTL',
+                   'propTTL', 'respTTL']
+responseColumns = ['resp', 'respNum', 'rt', 'accept', 'lateResp', 'lateRespNum', 'lateRT', 'lateResp_onset',
+                   'nLateResps', 'partnerChoice', 'incorrectResps', 'mousePos', 'timeSec']
+compareColumns = scheduleColumns + responseColumns
+
+
+class ReplayEnded(SystemExit):
+    """ Raised when the recorded input is used up and the experiment keeps waiting for more """
+    pass
+
+
+def read_log(logFile, winSize=(1200, 700)):
+    """ Read the key presses and mouse clicks of a session from its PsychoPy log
+
+        Args:
+            logFile (str): File path for the log (written by logging.LogFile at EXP level or below).
+            winSize (tuple): Size of the window (pixels) during the session; clicks are logged in window coordinates.
+
+        Returns a list of key presses (time, key) and a list of mouse clicks (time, x, y) with x, y in pix from the
+        centre of the window.
+    """
+    keys = []
+    clicks = []
+    with open(logFile, 'r') as log:
+        for line in log:
+            match = _logLine.match(line)
+            if match is None or match.group(2) != 'DATA':
+                continue
+            t, msg = float(match.group(1)), match.group(3)
+            keyMatch = _keypress.match(msg)
+            clickMatch = _click.match(msg)
+            if keyMatch is not None:
+                keys.append((t, keyMatch.group(1)))
+            elif clickMatch is not None:
+                clicks.append((t, int(clickMatch.group(1)) - winSize[0] / 2.0, int(clickMatch.group(2)) - winSize[1] / 2.0))
+    return keys, clicks
+
+
+class ReplayParticipant(object):
+    """ Participant of a recorded session for the simulation (see sf.SimulatedParticipant)
+
+        Every key press is delivered at its logged time, whether or not the experiment polls for it, and every click
+        is delivered at its logged time and position. Between clicks the mouse moves in a straight line from where the
+        experiment last put it to the next click. The pain dial track (one position per second) is replayed from the
+        painDialReset-th call of mouse.setPos, which starts the pain dial recording.
+
+        Args:
+            keys (list): Key presses (time, key) on the session clock.
+            clicks (list): Mouse clicks (time, x, y) on the session clock.
+            painDial (data frame): Pain dial track with columns mousePos and timeSec. If None, no track is replayed.
+            painDialReset (int): Index of the mouse.setPos call that starts the pain dial recording.
+            endTimeout (float): Seconds the experiment may keep polling after the last recorded input before the
+                replay ends (ReplayEnded).
+    """
+
+    def __init__(self, keys, clicks, painDial=None, painDialReset=1, endTimeout=10.0):
+        self.keys = sorted(keys)
+        self.clicks = sorted(clicks)
+        self.nextKey = 0
+        self.nextClick = 0
+        self.painDial = painDial
+        self.painDialReset = painDialReset
+        self.painDialStart = None
+        self.nSetPos = 0
+        self.anchor = (0.0, np.zeros(2))  # time and position where the experiment last put the mouse
+        self.endTimeout = endTimeout
+        self.lastInput = max([t for t, key in self.keys[-1:]] + [click[0] for click in self.clicks[-1:]] + [0.0])
+        self.lags = []  # delay from each logged input to its delivery
+
+    def _check_end(self, now):
+        if self.nextKey >= len(self.keys) and self.nextClick >= len(self.clicks) and now > self.lastInput + self.endTimeout:
+            raise ReplayEnded('replay ended')
+
+    def poll_keys(self, keyList, now, excluded=()):
+        self._check_end(now)
+        return []  # logged presses are delivered by button_presses_until
+
+    def clear(self):
+        pass
+
+    def button_presses_until(self, now, scannerRunning):
+        presses = []
+        while self.nextKey < len(self.keys) and self.keys[self.nextKey][0] <= now:
+            t, key = self.keys[self.nextKey]
+            presses.append((key, t))
+            self.lags.append(now - t)
+            self.nextKey += 1
+        return presses
+
+    def reset_click(self, now, pos):
+        pass
+
+    def set_pos(self, now, pos):
+        if self.painDial is not None and self.nSetPos == self.painDialReset:
+            self.painDialStart = now
+        self.nSetPos += 1
+        self.anchor = (now, np.array(pos, dtype=float))
+
+    def mouse_pos(self, now, pos):
+        if self.painDialStart is not None:
+            timeSec = self.painDial['timeSec'].values
+            if now - self.painDialStart <= timeSec[-1] + 1.0:
+                x = np.interp(now - self.painDialStart, timeSec, self.painDial['mousePos'].values, left=self.anchor[1][0])
+                return np.array([x, pos[1]])
+            self.painDialStart = None
+        if self.nextClick < len(self.clicks):
+            t, x, y = self.clicks[self.nextClick]
+            t0, pos0 = self.anchor
+            progress = min(1.0, max(0.0, (now - t0) / max(t - t0, 1e-6)))
+            return pos0 + progress * (np.array([x, y]) - pos0)
+        return np.array(pos, dtype=float)
+
+    def press(self, now):
+        self._check_end(now)
+        if self.nextClick < len(self.clicks) and self.clicks[self.nextClick][0] <= now:
+            t, x, y = self.clicks[self.nextClick]
+            self.nextClick += 1
+            self.lags.append(now - t)
+            self.anchor = (t, np.array([x, y]))
+            return t, np.array([x, y])
+        return None
+
+    def chooses(self, shape, pos):
+        return shape.contains(pos)
+
+
+def _output_key(fileName):
+    """ Name of an output file without the session start time """
+    return _startTime.sub('_', os.path.basename(fileName), count=1)
+
+
+def diff_outputs(originalFiles, replayFiles, atol=0.034, compare=compareColumns):
+    """ Compare regenerated data files with the originals
+
+        Files are matched by name without the session start time. Only the schedule and response columns in compare
+        are compared, so columns added for timing diagnostics never need to be excluded. Numeric columns match if they
+        are within atol (default two frames at 60 Hz, the resolution of replayed input); other columns must be equal.
+
+        Args:
+            originalFiles (list): File paths for the data files of the recorded session.
+            replayFiles (list): File paths for the data files of the replay.
+            atol (float): Absolute tolerance for numeric columns.
+            compare (list): Names of the columns to compare (schedule and response columns by default).
+
+        Returns a data frame with one row per file.
+    """
+    replayByKey = dict((_output_key(f), f) for f in replayFiles)
+    rows = []
+    for originalFile in sorted(originalFiles):
+        key = _output_key(originalFile)
+        result = OrderedDict([('file', key), ('rowsOriginal', np.nan), ('rowsReplay', np.nan), ('missingColumns', ''),
+                              ('extraColumns', ''), ('mismatchedColumns', ''), ('maxAbsDiff', np.nan), ('match', False)])
+        original = pd.read_csv(originalFile)
+        result['rowsOriginal'] = original.shape[0]
+        if key not in replayByKey:
+            result['missingColumns'] = 'file not written'
+            rows.append(result)
+            continue
+        replay = pd.read_csv(replayByKey[key])
+        result['rowsReplay'] = replay.shape[0]
+        columns = [col for col in original.columns if col in compare]
+        result['missingColumns'] = ' '.join(col for col in columns if col not in replay.columns)
+        result['extraColumns'] = ' '.join(col for col in replay.columns if col not in original.columns and col in compare)
+        nRows = min(original.shape[0], replay.shape[0])
+        mismatched = []
+        maxAbsDiff = 0.0
+        for col in columns:
+            if col not in replay.columns:
+                continue
+            a, b = original[col].values[:nRows], replay[col].values[:nRows]
+            if original[col].dtype.kind in 'fiub' and replay[col].dtype.kind in 'fiub':
+                a, b = a.astype(float), b.astype(float)
+                same = np.isclose(a, b, atol=atol, rtol=0, equal_nan=True)
+                diffs = np.abs(a - b)[~(np.isnan(a) | np.isnan(b))]
+                if diffs.size:
+                    maxAbsDiff = max(maxAbsDiff, diffs.max())
+            else:
+                same = pd.Series(a).fillna('').astype(str).values == pd.Series(b).fillna('').astype(str).values
+            if not same.all():
+                mismatched.append('%s(%d)' % (col, (~same).sum()))
+        result['mismatchedColumns'] = ' '.join(mismatched)
+        result['maxAbsDiff'] = maxAbsDiff
+        result['match'] = (original.shape[0] == replay.shape[0] and not mismatched and not result['missingColumns'])
+        rows.append(result)
+    return pd.DataFrame(rows)
+
+
+def _session_files(logFile):
+    """ Data files written by the session of logFile (same subject, start time and experiment) """
+    dataDir = os.path.dirname(os.path.abspath(logFile))
+    stem = os.path.splitext(os.path.basename(logFile))[0]
+    return [os.path.join(dataDir, f) for f in sorted(os.listdir(dataDir)) if f.startswith(stem) and f.endswith('.csv')]
+
+
+def replay_session(script, logFile, info=None, winSize=(1200, 700), frameDur=1.0 / 60, workDir=None, atol=0.034):
+    """ Replay a recorded session headless and compare its outputs with the originals
+
+        The replay runs in a working directory with links to everything in the experiment directory except the data,
+        so the original data are never touched. Sessions that appended to the data file of an earlier session
+        (saveFile) are replayed into a new file.
+
+        Args:
+            script (str): Path to the experiment script of the session (e.g., 'anm1_preScanner.py').
+            logFile (str): File path for the log of the session.
+            info (dict): Dialogue box values of the session (e.g., {'runNumber': '2'}). The subject number is read
+                from the log file name if not given.
+            winSize (tuple): Size of the window (pixels) during the session (the screen size for full screen).
+            frameDur (float): Duration of a single frame in seconds during the session.
+            workDir (str): Working directory for the replay. If None, a temporary directory is used and removed.
+            atol (float): Absolute tolerance for numeric columns (see diff_outputs).
+
+        Returns a summary of the replay and the comparison of its outputs (see diff_outputs).
+    """
+    info = dict(info or {})
+    info['subject'] = str(int(info.get('subject', os.path.basename(logFile).split('_')[0])))
+    originalFiles = _session_files(logFile)
+    keys, clicks = read_log(logFile, winSize=winSize)
+    painDialFiles = [f for f in originalFiles if f.endswith('_painDial.csv')]
+    painDial = pd.read_csv(painDialFiles[0]) if painDialFiles else None
+    participant = ReplayParticipant(keys, clicks, painDial=painDial)
+
+    scriptDir = os.path.dirname(os.path.abspath(script))
+    removeWorkDir = workDir is None
+    if workDir is None:
+        workDir = tempfile.mkdtemp(prefix='replay_')
+    for entry in os.listdir(scriptDir):
+        if entry != 'data' and not os.path.exists(os.path.join(workDir, entry)):
+            os.symlink(os.path.join(scriptDir, entry), os.path.join(workDir, entry))
+
+    try:
+        sim, summary = sf.run_script(os.path.join(workDir, os.path.basename(script)), info=info, frameDur=frameDur,
+                                     TR=None, calibrationDur=0.0, participant=participant)
+        replayDir = os.path.join(workDir, 'data', 'subject_' + info['subject'])
+        replayFiles = [os.path.join(replayDir, f) for f in os.listdir(replayDir) if f.endswith('.csv')] if os.path.isdir(replayDir) else []
+        diff = diff_outputs(originalFiles, replayFiles, atol=atol)
+    finally:
+        if removeWorkDir:
+            shutil.rmtree(workDir, ignore_errors=True)
+
+    lags = np.asarray(participant.lags)
+    summary['keysReplayed'] = participant.nextKey
+    summary['keysLogged'] = len(keys)
+    summary['clicksReplayed'] = participant.nextClick
+    summary['clicksLogged'] = len(clicks)
+    summary['inputLagMedian_ms'] = np.median(lags) * 1000 if lags.size else np.nan
+    summary['inputLagMax_ms'] = lags.max() * 1000 if lags.size else np.nan
+    return summary, diff
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay a recorded session headless and compare its outputs')
+    parser.add_argument('script', help='experiment script of the session, e.g. anm1_preScanner.py')
+    parser.add_argument('logFile', help='PsychoPy log of the session')
+    parser.add_argument('--info', nargs='*', default=[], help='dialogue box values, e.g. runNumber=2')
+    parser.add_argument('--winSize', type=int, nargs=2, default=[1200, 700], help='window size during the session')
+    parser.add_argument('--refresh', type=float, default=60.0, help='refresh rate during the session (Hz)')
+    parser.add_argument('--atol', type=float, default=0.034, help='tolerance for numeric columns')
+    args = parser.parse_args()
+
+    summary, diff = replay_session(args.script, args.logFile, info=sf.parse_info(args.info), winSize=args.winSize,
+                                   frameDur=1.0 / args.refresh, atol=args.atol)
+    print('replayed %(script)s: %(sessionTime_s).1f s session in %(wallTime_s).1f s (%(speedup).0fx), '
+          '%(keysReplayed)d/%(keysLogged)d keys, %(clicksReplayed)d/%(clicksLogged)d clicks, '
+          'input lag median %(inputLagMedian_ms).1f ms, max %(inputLagMax_ms).1f ms, exit %(exitStatus)s' % summary)
+    print(diff.to_string(index=False))
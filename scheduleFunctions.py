@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Schedule Functions for Counterbalancing a Cohort
+authors: Ian Roberts
+
+Generates the counterbalancing of every subject in one pass and stores it in an indexed file that the pre-scanner,
+scanner and post-scanner scripts look subjects up in. The assignment is identical to the one the scripts compute:
+    - condition cell (respOrder x blockSets x selfSide) = subject % 24, in itertools.product order
+    - partner cue combo (colors x shapes) = subject % 36 of the combos shuffled with random.seed(1928)
+    - block order, instructions jitter and partner order of each run as drawn by generate_runs (random.seed(subject))
+Run with the same Python version as the experiment (random.shuffle differs between Python 2 and 3), e.g.:
+    python scheduleFunctions.py --subjects 1 5000
+"""
+
+from __future__ import print_function
+import os, random, itertools, argparse
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+
+# counterbalanced conditions (as in the experiment scripts)
+partnerColors = [(1,1,-1),  # yellow
+                 (-1,-1,1),  # blue
+                 (1,-1,-1)]  # red
+partnerColorNames = ['yellow', 'blue', 'red']
+partnerShapes = [3, 4, 32]  # number of edges
+respOrders = ['LtoR', 'RtoL']
+blockSetFiles = ['anm1_partner1_trials.csv', 'anm1_partner2_trials.csv', 'anm1_partner3_trials.csv']
+selfSides = ['left', 'right']
+partners = ['pos', 'neu', 'neg']
+instructsJitters = [1.5, 2.5, 3.5]
+nRuns = 5
+nBlocks = 5  # partnerBlockNum 1-5 in each block set
+
+permutations = np.array(list(itertools.permutations(range(3))))  # the 6 orders of three items (itertools order)
+cohortFile = os.path.join('stim', 'anm1_schedules.npz')
+
+
+def _partner_combo_order(seed=1928):
+    """ Order of the 36 color x shape combos after random.seed(seed); random.shuffle(partnerCombos) """
+    order = list(range(len(permutations) ** 2))
+    random.Random(seed).shuffle(order)
+    return np.array(order)
+
+
+def generate_cohort(subjects):
+    """ Counterbalancing and run schedule of every subject
+
+        Args:
+            subjects (list): Subject numbers.
+
+        Returns an ordered dictionary of arrays with one entry per subject (sorted by subject number): indices into
+        the condition lists above, block order [subject, partner, run], instructions jitter [subject, run, partner]
+        and partner order [subject, run, position].
+    """
+    subjects = np.unique(np.asarray(subjects, dtype=int))
+    nSubjects = subjects.size
+    cohort = OrderedDict()
+    cohort['subjects'] = subjects
+
+    # condition cell: itertools.product(respOrders, blockSets, selfSide)
+    cohort['counterbalance'] = subjects % (len(respOrders) * len(permutations) * len(selfSides))
+    cohort['respOrder'], cohort['blockSets'], cohort['selfSide'] = np.unravel_index(cohort['counterbalance'], (len(respOrders), len(permutations), len(selfSides)))
+
+    # partner cues: shuffled itertools.product(color permutations, shape permutations)
+    cohort['partnerCounterbalance'] = subjects % len(permutations) ** 2
+    combos = _partner_combo_order()[cohort['partnerCounterbalance']]
+    cohort['partnerColors'], cohort['partnerShapes'] = np.divmod(combos, len(permutations))
+
+    # run schedule (the draws of generate_runs, which seeds random with the subject number)
+    cohort['blockOrder'] = np.zeros((nSubjects, len(partners), nRuns), dtype=int)
+    cohort['instructsJitters'] = np.zeros((nSubjects, nRuns, len(partners)))
+    cohort['partnerOrder'] = np.zeros((nSubjects, nRuns, len(partners)), dtype=int)
+    for i, subject in enumerate(subjects):
+        rng = random.Random(int(subject))
+        for p in range(len(partners)):
+            blockOrder = list(range(1, nBlocks + 1))
+            rng.shuffle(blockOrder)
+            cohort['blockOrder'][i, p] = blockOrder
+        for run in range(nRuns):
+            jitters = list(instructsJitters)
+            rng.shuffle(jitters)
+            cohort['instructsJitters'][i, run] = jitters
+            partnerOrder = list(range(len(partners)))
+            rng.shuffle(partnerOrder)
+            cohort['partnerOrder'][i, run] = partnerOrder
+
+    return cohort
+
+
+def save_cohort(fileName, cohort):
+    """ Store a cohort (see generate_cohort) in a compressed NumPy file indexed by subject number """
+    np.savez_compressed(fileName, **cohort)
+
+
+def subject_schedule(fileName, subject):
+    """ Look up the counterbalancing and run schedule of a subject
+
+        Args:
+            fileName (str): File path for the cohort file (see save_cohort).
+            subject (int): Subject number.
+
+        Returns a dictionary of the subject's schedule, or None if there is no cohort file or the subject is not in it.
+    """
+    if not os.path.isfile(fileName):
+        return None
+    with np.load(fileName) as cohort:
+        subjects = cohort['subjects']
+        i = np.searchsorted(subjects, subject)
+        if i >= subjects.size or subjects[i] != subject:
+            return None
+        return dict((key, cohort[key][i]) for key in cohort.files if key != 'subjects')
+
+
+def cohort_table(cohort):
+    """ Readable table of a cohort with one row per subject (e.g., for checking or sharing the schedule) """
+    table = pd.DataFrame(OrderedDict([('subject', cohort['subjects']),
+                                      ('counterbalance', cohort['counterbalance']),
+                                      ('partnerCounterbalance', cohort['partnerCounterbalance']),
+                                      ('respOrder', np.array(respOrders)[cohort['respOrder']]),
+                                      ('selfSide', np.array(selfSides)[cohort['selfSide']])]))
+    colorPerms = permutations[cohort['partnerColors']]
+    shapePerms = permutations[cohort['partnerShapes']]
+    blockSetPerms = permutations[cohort['blockSets']]
+    for p, partner in enumerate(partners):
+        table[partner + 'Color'] = np.array(partnerColorNames)[colorPerms[:, p]]
+        table[partner + 'Shape'] = np.array(partnerShapes)[shapePerms[:, p]]
+        table[partner + 'BlockSet'] = np.array(blockSetFiles)[blockSetPerms[:, p]]
+    for run in range(nRuns):
+        table['run%d_partnerOrder' %(run + 1)] = ['-'.join(order) for order in np.array(partners)[cohort['partnerOrder'][:, run]]]
+        for p, partner in enumerate(partners):
+            table['run%d_%sBlock' %(run + 1, partner)] = cohort['blockOrder'][:, p, run]
+            table['run%d_%sInstructsJitter' %(run + 1, partner)] = cohort['instructsJitters'][:, run, p]
+    return table
+
+
+def balance_report(cohort):
+    """ Count of subjects at each level of each counterbalanced factor, with the count expected if perfectly balanced """
+    factors = OrderedDict([('counterbalance', (cohort['counterbalance'], len(respOrders) * len(permutations) * len(selfSides))),
+                           ('partnerCounterbalance', (cohort['partnerCounterbalance'], len(permutations) ** 2)),
+                           ('respOrder', (cohort['respOrder'], len(respOrders))),
+                           ('selfSide', (cohort['selfSide'], len(selfSides))),
+                           ('blockSets', (cohort['blockSets'], len(permutations))),
+                           ('partnerColors', (cohort['partnerColors'], len(permutations))),
+                           ('partnerShapes', (cohort['partnerShapes'], len(permutations)))])
+    firstPartner = cohort['partnerOrder'][:, :, 0]  # partner shown first in each run
+    for run in range(nRuns):
+        factors['run%d_firstPartner' %(run + 1)] = (firstPartner[:, run], len(partners))
+
+    rows = []
+    nSubjects = cohort['subjects'].size
+    for factor, (levels, nLevels) in factors.items():
+        counts = np.bincount(levels, minlength=nLevels)
+        for level in range(nLevels):
+            rows.append(OrderedDict([('factor', factor), ('level', level), ('count', counts[level]), ('expected', float(nSubjects) / nLevels)]))
+    report = pd.DataFrame(rows)
+    report['deviation'] = report['count'] - report['expected']
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate the counterbalancing and run schedules of a cohort')
+    parser.add_argument('--subjects', type=int, nargs=2, default=[1, 5000], metavar=('FIRST', 'LAST'), help='range of subject numbers')
+    parser.add_argument('--out', default=cohortFile, help='cohort file (.npz)')
+    parser.add_argument('--table', default=None, help='also write a readable table of the cohort (.csv)')
+    args = parser.parse_args()
+
+    cohort = generate_cohort(range(args.subjects[0], args.subjects[1] + 1))
+    save_cohort(args.out, cohort)
+    if args.table is not None:
+        cohort_table(cohort).to_csv(args.table, header = True, mode = 'w', index = False)
+
+    report = balance_report(cohort)
+    print('%d subjects written to %s' %(cohort['subjects'].size, args.out))
+    print(report.groupby('factor', sort=False)['deviation'].agg(['min', 'max']).to_string())
@@ -0,0 +1,935 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Simulation Functions for Headless Sessions
+authors: Ian Roberts
+
+Runs the experiment scripts without a display, dialogue box, eye tracker or scanner. PsychoPy, pylink and pyglet are
+replaced by simulated modules driven by a virtual clock: every flip advances the clock to the next vsync instead of
+waiting for it, so a whole session runs in seconds while all onsets, RTs and frame intervals are reported on the
+virtual clock as if the session had run on real hardware. Output files are written as in a real session.
+
+Run from the experiment directory, e.g.:
+    python simulationFunctions.py anm1_scanner.py --info subject=9001 runNumber=0
+"""
+
+from __future__ import print_function
+import sys, os, types, math, random, runpy, time, argparse
+import numpy as np
+
+import monitorFunctions as mf
+
+_sim = None  # simulation the simulated modules are driven by (see install)
+
+
+class VirtualClock(object):
+    """ Clock of a simulated session (seconds); advanced by flips, waits and tracker delays """
+
+    def __init__(self):
+        self.t = 0.0
+
+    def now(self):
+        return self.t
+
+    def advance(self, dt):
+        if dt > 0:
+            self.t += dt
+
+    def advance_to(self, t):
+        if t > self.t:
+            self.t = t
+
+
+class VirtualScanner(object):
+    """ Scanner sending a trigger key every TR once the experiment waits for it
+
+        The scanner is started when the experiment polls for the trigger key and stopped when the experiment next
+        polls the keyboard without the trigger key (e.g., the rest screen after a run).
+
+        Args:
+            TR (float): Repetition time in seconds. If None, the scanner never starts (e.g., triggers are replayed).
+            triggerKey (str): Key sent on every volume.
+            startDelay (float): Seconds from the first poll for the trigger to the first volume.
+    """
+
+    def __init__(self, TR=2.0, triggerKey='5', startDelay=1.0):
+        self.TR = TR
+        self.triggerKey = triggerKey
+        self.startDelay = startDelay
+        self.running = False
+        self.nextVolume = None
+        self.nVolumes = 0
+
+    def poll(self, keyList, now):
+        """ Start or stop the scanner depending on the keys the experiment is waiting for """
+        if self.TR is not None and keyList is not None and self.triggerKey in keyList:
+            if not self.running:
+                self.running = True
+                self.nextVolume = now + self.startDelay
+        elif self.running:
+            self.running = False
+
+    def presses_until(self, now):
+        """ Trigger presses (key, time) up to now """
+        presses = []
+        while self.running and self.nextVolume <= now:
+            presses.append((self.triggerKey, self.nextVolume))
+            self.nextVolume += self.TR
+            self.nVolumes += 1
+        return presses
+
+
+class SimulatedParticipant(object):
+    """ Scripted keyboard and mouse
+
+        Every keyboard poll is answered after a random response time with a key from the polled key list (quit keys
+        and the scanner trigger are never pressed); a poll for any key types letters and eventually presses return.
+        While the scanner is running, button-box presses arrive at random intervals whether or not anything is polled.
+        Mouse clicks follow each clickReset after a random response time, with the mouse moving towards a random
+        point on the way.
+
+        Args:
+            rtRange (tuple): Range (seconds) of response times for polled keys and mouse clicks.
+            buttonKeys (list): Keys of the button box.
+            buttonInterval (tuple): Range (seconds) between button-box presses while the scanner is running.
+            seed (int): Seed for the participant's responses.
+    """
+
+    quitKeys = ['escape', 'q']
+
+    def __init__(self, rtRange=(0.4, 1.5), buttonKeys=['1', '2', '3', '4'], buttonInterval=(1.0, 6.0), seed=None):
+        self.rng = random.Random(seed)
+        self.rtRange = rtRange
+        self.buttonKeys = buttonKeys
+        self.buttonInterval = buttonInterval
+        self.plans = {}  # polled key list: [press time, key, last poll]
+        self.nextButton = None
+        self.click = None
+
+    def _choose_key(self, keyList, excluded):
+        if keyList is None:
+            if self.rng.random() < 0.15:
+                return 'return'
+            return self.rng.choice('abcdefghijklmnopqrstuvwxyz') if self.rng.random() < 0.85 else 'space'
+        keys = [key for key in keyList if key not in self.quitKeys and key not in excluded]
+        if 'space' in keys:
+            return 'space'
+        return self.rng.choice(keys) if keys else None
+
+    def poll_keys(self, keyList, now, excluded=()):
+        """ Presses (key, time) answering a poll of keyList (None: any key) """
+        plan = self.plans.get(keyList)
+        if plan is None or now - plan[2] > 0.5:  # not polled recently: a new screen
+            key = self._choose_key(keyList, excluded)
+            if key is None:
+                return []
+            plan = [now + self.rng.uniform(*self.rtRange), key, now]
+            self.plans[keyList] = plan
+        plan[2] = now
+        if now >= plan[0]:
+            del self.plans[keyList]
+            return [(plan[1], plan[0])]
+        return []
+
+    def clear(self):
+        """ Forget planned presses (the screen was cleared of events) """
+        self.plans = {}
+
+    def button_presses_until(self, now, scannerRunning):
+        """ Button-box presses (key, time) up to now """
+        if not scannerRunning:
+            self.nextButton = None
+            return []
+        if self.nextButton is None:
+            self.nextButton = now + self.rng.uniform(*self.buttonInterval)
+        presses = []
+        while self.nextButton <= now:
+            presses.append((self.rng.choice(self.buttonKeys), self.nextButton))
+            self.nextButton += self.rng.uniform(*self.buttonInterval)
+        return presses
+
+    def reset_click(self, now, pos):
+        """ Plan the next mouse click (after a clickReset) """
+        self.click = {'time': now + self.rng.uniform(*self.rtRange),
+                      'start': now,
+                      'startPos': np.array(pos, dtype=float),
+                      'target': np.array([self.rng.uniform(-500, 500), pos[1]]),
+                      'skip': self.rng.randint(0, 10),  # which of the polled shapes is clicked
+                      'pressed': False}
+
+    def set_pos(self, now, pos):
+        """ The experiment moved the mouse """
+        if self.click is not None:
+            self.click['startPos'] = np.array(pos, dtype=float)
+            self.click['start'] = now
+
+    def mouse_pos(self, now, pos):
+        """ Position of the mouse moving towards the planned click """
+        if self.click is None:
+            self.reset_click(now, pos)
+        progress = min(1.0, (now - self.click['start']) / max(self.click['time'] - self.click['start'], 1e-6))
+        return self.click['startPos'] + progress * (self.click['target'] - self.click['startPos'])
+
+    def press(self, now):
+        """ Time and position of a click due by now (each click is returned once), or None """
+        if self.click is None or self.click['pressed'] or now < self.click['time']:
+            return None
+        self.click['pressed'] = True
+        return self.click['time'], self.click['target']
+
+    def chooses(self, shape, pos):
+        """ Whether the click at pos was in shape (the participant clicks one of the polled shapes at random) """
+        if self.click['skip'] <= 0:
+            return True
+        self.click['skip'] -= 1
+        return False
+
+
+class Simulation(object):
+    """ State of a simulated session shared by the simulated modules
+
+        Args:
+            info (dict): Values entered in the dialogue box (e.g., {'subject': '9001', 'runNumber': '0'}).
+            frameDur (float): Duration of a single frame in seconds (virtual refresh rate).
+            dropRate (float): Probability that a flip misses its vsync (simulated dropped frames).
+            TR (float): Repetition time of the virtual scanner in seconds. If None, no triggers are sent by the scanner.
+            calibrationDur (float): Seconds spent in each tracker setup (doTrackerSetup).
+            pollDur (float): Seconds taken by each keyboard or mouse poll (so loops that poll without flipping advance).
+            participant (SimulatedParticipant): Keyboard and mouse input. If None, a SimulatedParticipant is used.
+            seed (int): Seed for the participant and dropped frames.
+    """
+
+    def __init__(self, info=None, frameDur=1.0 / 60, dropRate=0.0, TR=2.0, calibrationDur=30.0, pollDur=0.001,
+                 participant=None, seed=None):
+        self.info = dict(info or {})
+        self.frameDur = frameDur
+        self.dropRate = dropRate
+        self.calibrationDur = calibrationDur
+        self.pollDur = pollDur
+        self.rng = random.Random(seed)
+        self.clock = VirtualClock()
+        self.scanner = VirtualScanner(TR=TR)
+        self.participant = participant if participant is not None else SimulatedParticipant(seed=seed)
+        self.windows = []
+        self.keyBuffer = []  # (key, time) waiting for event.getKeys
+        self.nFlips = 0
+        self.nDroppedFrames = 0
+        self.nKeyPresses = 0
+
+    def deliver_keys(self, now, keyList=None, polled=False):
+        """ Deliver due key presses to the window key handlers and the event buffer (the pyglet event pump) """
+        presses = self.scanner.presses_until(now)
+        presses += self.participant.button_presses_until(now, self.scanner.running)
+        if polled:
+            presses += self.participant.poll_keys(keyList, now, excluded=[self.scanner.triggerKey])
+        for key, t in sorted(presses, key=lambda press: press[1]):
+            self.nKeyPresses += 1
+            for win in self.windows:
+                win.winHandle.dispatch_event('on_key_press', key, 0)
+            self.keyBuffer.append((key, now))
+            _fake_logging.data('Keypress: %s' % key, t=now)
+
+
+# ============================================================================ #
+# SIMULATED PSYCHOPY MODULES
+
+# core
+_fake_core = types.ModuleType('psychopy.core')
+
+
+def _getTime():
+    return _sim.clock.now()
+
+
+class _Clock(object):
+    def __init__(self):
+        self._timeAtLastReset = _getTime()
+
+    def getTime(self, applyZero=True):
+        return _getTime() - self._timeAtLastReset
+
+    def reset(self, newT=0.0):
+        self._timeAtLastReset = _getTime() + newT
+
+    def add(self, t):
+        self._timeAtLastReset += t
+
+    def getLastResetTime(self):
+        return self._timeAtLastReset
+
+
+class _CountdownTimer(_Clock):
+    def __init__(self, start=0):
+        _Clock.__init__(self)
+        self._countdown = start
+
+    def getTime(self):
+        return self._countdown - _Clock.getTime(self)
+
+    def reset(self, t=None):
+        _Clock.reset(self)
+        if t is not None:
+            self._countdown = t
+
+    def add(self, t):
+        self._countdown += t
+
+
+def _wait(secs, hogCPUperiod=0.2):
+    _sim.clock.advance(secs)
+
+
+def _quit():
+    _fake_logging.flush()
+    raise SystemExit(0)
+
+
+def _rush(value=True, realtime=False):
+    return False  # no priority change in a simulated session
+
+
+_fake_core.getTime = _getTime
+_fake_core.Clock = _Clock
+_fake_core.MonotonicClock = _Clock
+_fake_core.CountdownTimer = _CountdownTimer
+_fake_core.wait = _wait
+_fake_core.quit = _quit
+_fake_core.rush = _rush
+
+
+# logging (same levels and line format as psychopy.logging)
+_fake_logging = types.ModuleType('psychopy.logging')
+_levels = [('CRITICAL', 50), ('ERROR', 40), ('WARNING', 30), ('DATA', 25), ('EXP', 22), ('INFO', 20), ('DEBUG', 10), ('NOTSET', 0)]
+_levelNames = dict((value, name) for name, value in _levels)
+_logQueue = []
+_logFiles = []
+
+
+class _LogFile(object):
+    def __init__(self, f=None, level=30, filemode='a', logger=None, encoding='utf8'):
+        self.stream = open(f, filemode) if f is not None else sys.stdout
+        self.level = level
+        _logFiles.append(self)
+
+    def setLevel(self, level):
+        self.level = level
+
+    def write(self, txt):
+        self.stream.write(txt)
+
+
+def _log(msg, level, t=None, obj=None):
+    _logQueue.append((_getTime() if t is None else t, level, msg))
+
+
+def _flush(logger=None):
+    for t, level, msg in _logQueue:
+        for logFile in _logFiles:
+            if level >= logFile.level:
+                logFile.write('%.4f \t%s \t%s\n' % (t, _levelNames[level], msg))
+    del _logQueue[:]
+    for logFile in _logFiles:
+        logFile.stream.flush()
+
+
+for _name, _value in _levels:
+    setattr(_fake_logging, _name, _value)
+    if _value:
+        setattr(_fake_logging, _name.lower(), (lambda level: lambda msg, t=None, obj=None: _log(msg, level, t, obj))(_value))
+_fake_logging.log = _log
+_fake_logging.flush = _flush
+_fake_logging.LogFile = _LogFile
+_fake_logging.console = _LogFile(level=30)  # warnings and errors to stdout
+_fake_logging.setDefaultClock = lambda clock: None
+
+
+# visual
+_fake_visual = types.ModuleType('psychopy.visual')
+
+
+class _WinHandle(object):
+    """ Stand-in for the pyglet window: keeps key handlers pushed by the experiment """
+
+    def __init__(self):
+        self.handlers = []
+
+    def push_handlers(self, **handlers):
+        self.handlers.append(handlers)
+
+    def remove_handlers(self, **handlers):
+        for i in range(len(self.handlers) - 1, -1, -1):
+            if self.handlers[i] == handlers:
+                del self.handlers[i]
+                break
+
+    def dispatch_event(self, eventType, *args):
+        for handlers in reversed(self.handlers):
+            if eventType in handlers:
+                handlers[eventType](*args)
+
+    def dispatch_events(self):
+        pass
+
+
+class _Window(object):
+    def __init__(self, size=(800, 600), pos=None, color=(0, 0, 0), colorSpace='rgb', fullscr=False, allowGUI=None, monitor=None,
+                 units=None, screen=0, winType='pyglet', **kwargs):
+        self.size = np.array(size)
+        self.color = color
+        self.colorSpace = colorSpace
+        self.units = units or 'norm'
+        if monitor is None or isinstance(monitor, str):
+            monitor = _Monitor(monitor)
+            monitor.setSizePix(size)
+        self.monitor = monitor
+        self.winHandle = _WinHandle()
+        self.mouseVisible = allowGUI is not False
+        self.recordFrameIntervals = False
+        self.frameIntervals = []
+        self.lastFrameT = _getTime()
+        self.movieFrames = []
+        self._toDraw = []
+        self._toCall = []
+        self.nDraws = 0
+        _sim.windows.append(self)
+
+    def flip(self, clearBuffer=True):
+        for stim in list(self._toDraw):
+            stim.draw()
+        frameDur = _sim.frameDur
+        now = _getTime()
+        vsync = (math.floor(now / frameDur + 1e-6) + 1) * frameDur
+        if _sim.dropRate and _sim.rng.random() < _sim.dropRate:
+            vsync += frameDur
+            _sim.nDroppedFrames += 1
+        _sim.clock.advance_to(vsync)
+        flipTime = _getTime()
+        if self.recordFrameIntervals:
+            self.frameIntervals.append(flipTime - self.lastFrameT)
+        self.lastFrameT = flipTime
+        _sim.nFlips += 1
+        toCall, self._toCall = self._toCall, []
+        for function, args, kwargs in toCall:
+            function(*args, **kwargs)
+        _sim.deliver_keys(flipTime)
+        sys.modules['psychopy.logging'].flush()
+        return flipTime
+
+    def callOnFlip(self, function, *args, **kwargs):
+        self._toCall.append((function, args, kwargs))
+
+    def clearBuffer(self, color=True, depth=False, stencil=False):
+        pass
+
+    def setUnits(self, units, log=True):
+        self.units = units
+
+    def setMouseVisible(self, visibility):
+        self.mouseVisible = visibility
+
+    def getMovieFrame(self, buffer='front'):
+        self.movieFrames.append(_getTime())
+
+    def saveMovieFrames(self, fileName, codec=None, fps=30, clearFrames=True):
+        if clearFrames:
+            self.movieFrames = []
+
+    def close(self):
+        if self in _sim.windows:
+            _sim.windows.remove(self)
+
+
+class _Stim(object):
+    """ Simulated stimulus: keeps its attributes and counts its draws """
+
+    _argNames = ['win']
+    _defaults = {}
+
+    def __init__(self, *args, **kwargs):
+        self.__dict__.update(self._defaults)
+        self.__dict__.update(zip(self._argNames, args))
+        self.__dict__.update(kwargs)
+        self._autoDraw = False
+
+    def __getattr__(self, name):
+        if name.startswith('set') and len(name) > 3:  # setText, setPos, setColor, ...
+            attr = name[3].lower() + name[4:]
+            return lambda value, *args, **kwargs: setattr(self, attr, value)
+        raise AttributeError(name)
+
+    @property
+    def autoDraw(self):
+        return self._autoDraw
+
+    @autoDraw.setter
+    def autoDraw(self, value):
+        self.setAutoDraw(value)
+
+    def setAutoDraw(self, value, log=None):
+        if value and self not in self.win._toDraw:
+            self.win._toDraw.append(self)
+        elif not value and self in self.win._toDraw:
+            self.win._toDraw.remove(self)
+        self._autoDraw = value
+
+    def draw(self, win=None):
+        (win or self.win).nDraws += 1
+
+    def contains(self, x, y=None, units=None):
+        """ Whether a point (in pix from the centre of the window) is inside the stim (circle or rectangle) """
+        if y is None:
+            x, y = x[0], x[1]
+        dx, dy = abs(x - self.pos[0]), abs(y - self.pos[1])
+        radius = getattr(self, 'radius', None)
+        if radius is not None:
+            return dx ** 2 + dy ** 2 <= radius ** 2
+        size = getattr(self, 'size', None)
+        width, height = size if size is not None else (getattr(self, 'width', 0), getattr(self, 'height', 0))
+        return dx <= width / 2.0 and dy <= height / 2.0
+
+    def overlaps(self, polygon):
+        return False
+
+
+def _stim_class(name, argNames, defaults):
+    return type(name, (_Stim,), {'_argNames': ['win'] + argNames, '_defaults': dict(defaults, pos=(0, 0))})
+
+
+_fake_visual.Window = _Window
+_fake_visual.TextStim = _stim_class('TextStim', ['text', 'font', 'pos'], {'text': '', 'color': (1, 1, 1), 'height': None})
+_fake_visual.Rect = _stim_class('Rect', ['width', 'height'], {'width': 0.5, 'height': 0.5})
+_fake_visual.Polygon = _stim_class('Polygon', ['edges', 'radius'], {'edges': 3, 'radius': 0.5})
+_fake_visual.Line = _stim_class('Line', ['start', 'end'], {'start': (-0.5, 0), 'end': (0.5, 0)})
+_fake_visual.ShapeStim = _stim_class('ShapeStim', ['units', 'lineWidth', 'lineColor'], {'vertices': ()})
+_fake_visual.ImageStim = _stim_class('ImageStim', ['image', 'mask', 'units', 'pos', 'size'], {'image': None, 'size': None})
+_fake_visual.GratingStim = _stim_class('GratingStim', ['tex', 'mask', 'units', 'pos', 'size'], {'tex': None, 'size': None})
+_fake_visual.BufferImageStim = _stim_class('BufferImageStim', ['buffer', 'rect', 'sqPower2', 'stim'], {'stim': ()})
+
+
+# event
+_fake_event = types.ModuleType('psychopy.event')
+
+
+def _key_list(keyList):
+    if keyList is None:
+        return None
+    if isinstance(keyList, str):
+        return (keyList,)
+    return tuple(keyList)
+
+
+def _getKeys(keyList=None, modifiers=False, timeStamped=False):
+    keyList = _key_list(keyList)
+    _sim.clock.advance(_sim.pollDur)
+    now = _getTime()
+    _sim.scanner.poll(keyList, now)
+    _sim.deliver_keys(now, keyList, polled=True)
+    keys = []
+    remaining = []
+    for key, t in _sim.keyBuffer:
+        if keyList is None or key in keyList:
+            keys.append((key, t))
+        else:
+            remaining.append((key, t))
+    _sim.keyBuffer = remaining
+    if timeStamped is True:
+        return [[key, t] for key, t in keys]
+    elif timeStamped:
+        return [[key, t - timeStamped.getLastResetTime()] for key, t in keys]
+    return [key for key, t in keys]
+
+
+def _clearEvents(eventType=None):
+    _sim.deliver_keys(_getTime())
+    _sim.keyBuffer = []
+    _sim.participant.clear()
+
+
+class _Mouse(object):
+    def __init__(self, visible=True, newPos=None, win=None):
+        self.visible = visible
+        self.win = win
+        self.pos = np.array(newPos if newPos is not None else (0.0, 0.0), dtype=float)
+        self.clickTime = None
+        self.clickedShape = None
+        self.lastReset = _getTime()
+
+    def _update(self):
+        _sim.clock.advance(_sim.pollDur)
+        now = _getTime()
+        self.pos = np.asarray(_sim.participant.mouse_pos(now, self.pos), dtype=float)
+        if self.clickTime is None:
+            press = _sim.participant.press(now)
+            if press is not None:
+                self.clickTime, pos = press
+                self.pos = np.array(pos, dtype=float)
+                win = self.win or (_sim.windows[0] if _sim.windows else None)
+                size = win.size if win is not None else (0, 0)
+                # logged in window coordinates (origin bottom left), as by PsychoPy
+                _fake_logging.data('Mouse: Left button down, pos=(%i,%i)' % (self.pos[0] + size[0] / 2, self.pos[1] + size[1] / 2),
+                                   t=self.clickTime)
+
+    def getPos(self):
+        self._update()
+        return self.pos.copy()
+
+    def setPos(self, newPos=(0, 0)):
+        self.pos = np.array(newPos, dtype=float)
+        _sim.participant.set_pos(_getTime(), self.pos)
+
+    def getPressed(self, getTime=False):
+        self._update()
+        pressed = [1 if self.clickTime is not None else 0, 0, 0]
+        if getTime:
+            times = [self.clickTime - self.lastReset if self.clickTime is not None else 0.0, 0.0, 0.0]
+            return pressed, times
+        return pressed
+
+    def isPressedIn(self, shape, buttons=(0, 1, 2)):
+        self._update()
+        if self.clickTime is None:
+            return False
+        if self.clickedShape is None and _sim.participant.chooses(shape, self.pos):
+            self.clickedShape = shape
+        return shape is self.clickedShape
+
+    def clickReset(self, buttons=(0, 1, 2)):
+        self.clickTime = None
+        self.clickedShape = None
+        self.lastReset = _getTime()
+        _sim.participant.reset_click(self.lastReset, self.pos)
+
+    def setVisible(self, visible):
+        self.visible = visible
+
+    def getVisible(self):
+        return self.visible
+
+
+_fake_event.getKeys = _getKeys
+_fake_event.clearEvents = _clearEvents
+_fake_event.Mouse = _Mouse
+
+
+# gui
+_fake_gui = types.ModuleType('psychopy.gui')
+
+
+class _DlgFromDict(object):
+    def __init__(self, dictionary, title='', fixed=(), order=(), tip=None, **kwargs):
+        for key in dictionary:
+            if key in _sim.info:
+                dictionary[key] = _sim.info[key]
+        self.dictionary = dictionary
+        self.data = [dictionary[key] for key in dictionary]
+        self.OK = True
+
+
+_fake_gui.DlgFromDict = _DlgFromDict
+
+
+# monitors, info, sound, data, preferences, hardware
+_fake_monitors = types.ModuleType('psychopy.monitors')
+
+
+class _Monitor(object):
+    def __init__(self, name=None, width=None, distance=None, gamma=None, **kwargs):
+        self.name = name
+        self.width = width
+        self.distance = distance
+        self.sizePix = [800, 600]
+
+    def setSizePix(self, pixels):
+        self.sizePix = list(pixels)
+
+    def getSizePix(self):
+        return self.sizePix
+
+    def setWidth(self, width):
+        self.width = width
+
+    def setDistance(self, distance):
+        self.distance = distance
+
+    def saveMon(self):
+        pass
+
+
+_fake_monitors.Monitor = _Monitor
+
+_fake_info = types.ModuleType('psychopy.info')
+
+
+def _RunTimeInfo(author=None, version=None, win=None, refreshTest='grating', userProcsDetailed=False, verbose=False):
+    return {'windowRefreshTimeAvg_ms': _sim.frameDur * 1000.0,
+            'windowRefreshTimeMedian_ms': _sim.frameDur * 1000.0,
+            'windowRefreshTimeSD_ms': 0.0,
+            'psychopyVersion': _fake_psychopy.__version__}
+
+
+_fake_info.RunTimeInfo = _RunTimeInfo
+
+_fake_sound = types.ModuleType('psychopy.sound')
+_fake_sound.Sound = _stim_class('Sound', ['value', 'secs', 'octave'], {})
+_fake_sound.Sound.play = lambda self, *args, **kwargs: None
+_fake_sound.Sound.stop = lambda self, *args, **kwargs: None
+
+_fake_data = types.ModuleType('psychopy.data')
+
+_fake_preferences = types.ModuleType('psychopy.preferences')
+_fake_preferences.prefs = types.ModuleType('prefs')
+for _section in ['general', 'hardware', 'app', 'coder', 'connections', 'keyboard']:
+    setattr(_fake_preferences.prefs, _section, {})
+
+_fake_hardware = types.ModuleType('psychopy.hardware')
+_fake_keyboard = types.ModuleType('psychopy.hardware.keyboard')
+_fake_keyboard.havePTB = False  # key presses reach the experiment through the window's key events
+_fake_hardware.keyboard = _fake_keyboard
+
+_fake_psychopy = types.ModuleType('psychopy')
+_fake_psychopy.__path__ = []
+_fake_psychopy.__version__ = '1.85.0 (simulated)'
+for _module in [_fake_core, _fake_logging, _fake_visual, _fake_event, _fake_gui, _fake_monitors, _fake_info, _fake_sound,
+                _fake_data, _fake_preferences, _fake_hardware]:
+    setattr(_fake_psychopy, _module.__name__.split('.')[-1], _module)
+
+
+# pyglet key symbols (keys are delivered by name)
+_fake_pyglet = types.ModuleType('pyglet')
+_fake_pyglet.__path__ = []
+_fake_pyglet_window = types.ModuleType('pyglet.window')
+_fake_pyglet_window.__path__ = []
+_fake_pyglet_key = types.ModuleType('pyglet.window.key')
+_fake_pyglet_key.symbol_string = lambda symbol: str(symbol)
+_fake_pyglet_window.key = _fake_pyglet_key
+_fake_pyglet.window = _fake_pyglet_window
+
+
+# ============================================================================ #
+# SIMULATED PYLINK
+
+_fake_pylink = types.ModuleType('pylink')
+_fake_pylink.__version__ = '2.0 (simulated)'
+
+
+class _EyeLink(object):
+    """ Simulated tracker: keeps commands and messages on the virtual clock and writes them as the data file """
+
+    def __init__(self, trackerAddress='100.1.1.1'):
+        self.trackerAddress = trackerAddress
+        self.commands = []
+        self.messages = []
+        self.dataFile = None
+        self.recording = False
+
+    def trackerTime(self):
+        return _getTime() * 1000.0
+
+    def sendCommand(self, command):
+        self.commands.append(command)
+        return 0
+
+    def sendMessage(self, message, *args):
+        t = self.trackerTime()
+        words = message.split(' ', 1)
+        try:  # offset message: "<offset> <message>"
+            offset = int(words[0])
+            t, message = t - offset, words[1]
+        except (ValueError, IndexError):
+            pass
+        self.messages.append((int(round(t)), message))
+        return 0
+
+    def openDataFile(self, fileName):
+        self.dataFile = fileName
+        self.messages = []
+        return 0
+
+    def closeDataFile(self):
+        return 0
+
+    def receiveDataFile(self, src, dest):
+        with open(dest, 'w') as edf:
+            for command in self.commands:
+                edf.write('** %s\n' % command)
+            for t, message in self.messages:
+                edf.write('MSG\t%d %s\n' % (t, message))
+        return os.path.getsize(dest)
+
+    def startRecording(self, fileSamples=1, fileEvents=1, linkSamples=1, linkEvents=1):
+        self.recording = True
+        return 0
+
+    def stopRecording(self):
+        self.recording = False
+
+    def setOfflineMode(self):
+        self.recording = False
+
+    def getTrackerVersion(self):
+        return 3
+
+    def getTrackerVersionString(self):
+        return 'EYELINK CL 5.12'
+
+    def doTrackerSetup(self, width=None, height=None):
+        _sim.clock.advance(_sim.calibrationDur)
+
+    def setCalibrationType(self, calType):
+        self.sendCommand('calibration_type = %s' % calType)
+
+    def isConnected(self):
+        return 1
+
+    def close(self):
+        pass
+
+
+class _EyeLinkCustomDisplay(object):
+    def __init__(self):
+        pass
+
+
+class _KeyInput(object):
+    def __init__(self, key, state=0):
+        self.key = key
+        self.state = state
+
+
+_fake_pylink.EyeLink = _EyeLink
+_fake_pylink.EyeLinkCustomDisplay = _EyeLinkCustomDisplay
+_fake_pylink.KeyInput = _KeyInput
+_fake_pylink.openGraphicsEx = lambda genv: None
+_fake_pylink.closeGraphics = lambda: None
+_fake_pylink.pumpDelay = lambda ms: _sim.clock.advance(ms / 1000.0)
+_fake_pylink.msecDelay = _fake_pylink.pumpDelay
+for _i, _name in enumerate(['CR_HAIR_COLOR', 'PUPIL_HAIR_COLOR', 'PUPIL_BOX_COLOR', 'SEARCH_LIMIT_BOX_COLOR', 'MOUSE_CURSOR_COLOR']):
+    setattr(_fake_pylink, _name, _i + 1)
+for _i, _name in enumerate(['CAL_TARG_BEEP', 'CAL_GOOD_BEEP', 'CAL_ERR_BEEP', 'DC_TARG_BEEP', 'DC_GOOD_BEEP', 'DC_ERR_BEEP']):
+    setattr(_fake_pylink, _name, _i + 1)
+for _i in range(1, 11):
+    setattr(_fake_pylink, 'F%d_KEY' % _i, 0x3b00 + (_i - 1) * 0x100)
+for _name, _value in [('JUNK_KEY', 1), ('TERMINATE_KEY', 0x7004), ('ESC_KEY', 0x1b), ('ENTER_KEY', 0x0d),
+                      ('PAGE_UP', 0x4900), ('PAGE_DOWN', 0x5100), ('CURS_UP', 0x4800), ('CURS_DOWN', 0x5000),
+                      ('CURS_LEFT', 0x4b00), ('CURS_RIGHT', 0x4d00)]:
+    setattr(_fake_pylink, _name, _value)
+
+
+# ============================================================================ #
+# RUNNING SIMULATED SESSIONS
+
+_fakeModules = {'psychopy': _fake_psychopy,
+                'psychopy.core': _fake_core,
+                'psychopy.logging': _fake_logging,
+                'psychopy.visual': _fake_visual,
+                'psychopy.event': _fake_event,
+                'psychopy.gui': _fake_gui,
+                'psychopy.monitors': _fake_monitors,
+                'psychopy.info': _fake_info,
+                'psychopy.sound': _fake_sound,
+                'psychopy.data': _fake_data,
+                'psychopy.preferences': _fake_preferences,
+                'psychopy.hardware': _fake_hardware,
+                'psychopy.hardware.keyboard': _fake_keyboard,
+                'pyglet': _fake_pyglet,
+                'pyglet.window': _fake_pyglet_window,
+                'pyglet.window.key': _fake_pyglet_key,
+                'pylink': _fake_pylink}
+
+# experiment modules imported by the scripts (re-imported so they bind to the simulated modules)
+_experimentModules = ['generalFunctions', 'questionnaires', 'timingFunctions', 'dataFunctions', 'eyeTrackerFunctions',
+                      'EyeLinkCoreGraphicsPsychoPy']
+
+
+def install(sim):
+    """ Replace PsychoPy, pyglet and pylink with the simulated modules driven by sim """
+    global _sim
+    _sim = sim
+    del _logQueue[:]
+    del _logFiles[:]
+    _logFiles.append(_fake_logging.console)
+    for name in list(_fakeModules.keys()) + _experimentModules:
+        sys.modules.pop(name, None)
+    sys.modules.update(_fakeModules)
+    mf.launchDashboards = False  # trials are still published to the monitor file
+
+
+def uninstall():
+    """ Remove the simulated modules """
+    for name in list(_fakeModules.keys()) + _experimentModules:
+        sys.modules.pop(name, None)
+    mf.launchDashboards = True
+    for logFile in _logFiles:
+        if logFile.stream is not sys.stdout:
+            logFile.stream.close()
+    del _logFiles[:]
+
+
+def run_script(script, sim=None, **kwargs):
+    """ Run an experiment script headless
+
+        Args:
+            script (str): Path to the experiment script (e.g., 'anm1_scanner.py').
+            sim (Simulation): Simulation to run the script in. If None, one is created from kwargs (see Simulation).
+
+        Returns the simulation and a summary of the session timing.
+    """
+    if sim is None:
+        sim = Simulation(**kwargs)
+    scriptPath = os.path.abspath(script)
+    scriptDir = os.path.dirname(scriptPath)
+    cwd = os.getcwd()
+    install(sim)
+    sys.path.insert(0, scriptDir)
+    os.chdir(scriptDir)
+    wallStart = time.time()
+    exitStatus = 0
+    try:
+        runpy.run_path(scriptPath, run_name='__main__')
+    except SystemExit as e:
+        exitStatus = e.code or 0
+    finally:
+        _flush()
+        wallTime = time.time() - wallStart
+        os.chdir(cwd)
+        sys.path.remove(scriptDir)
+        uninstall()
+
+    summary = {'script': os.path.basename(script),
+               'exitStatus': exitStatus,
+               'sessionTime_s': sim.clock.now(),
+               'wallTime_s': wallTime,
+               'speedup': sim.clock.now() / wallTime if wallTime > 0 else np.nan,
+               'flips': sim.nFlips,
+               'droppedFrames': sim.nDroppedFrames,
+               'keyPresses': sim.nKeyPresses,
+               'scannerVolumes': sim.scanner.nVolumes}
+    return sim, summary
+
+
+def parse_info(pairs):
+    info = {}
+    for pair in pairs or []:
+        key, value = pair.split('=', 1)
+        info[key] = value
+    return info
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run an experiment script headless on a virtual clock')
+    parser.add_argument('script', help='experiment script, e.g. anm1_scanner.py')
+    parser.add_argument('--info', nargs='*', default=[], help='dialogue box values, e.g. subject=9001 runNumber=0')
+    parser.add_argument('--refresh', type=float, default=60.0, help='virtual refresh rate (Hz)')
+    parser.add_argument('--dropRate', type=float, default=0.0, help='probability that a flip misses its vsync')
+    parser.add_argument('--TR', type=float, default=2.0, help='TR of the virtual scanner (s)')
+    parser.add_argument('--calibration', type=float, default=30.0, help='seconds spent in each tracker setup')
+    parser.add_argument('--seed', type=int, default=None, help='seed for the simulated participant')
+    args = parser.parse_args()
+
+    info = {'subject': '9999'}
+    info.update(parse_info(args.info))
+    sim, summary = run_script(args.script, info=info, frameDur=1.0 / args.refresh, dropRate=args.dropRate, TR=args.TR,
+                              calibrationDur=args.calibration, seed=args.seed)
+    print('simulated %(script)s: %(sessionTime_s).1f s session in %(wallTime_s).1f s (%(speedup).0fx), %(flips)d flips, '
+          '%(droppedFrames)d dropped frames, %(keyPresses)d key presses, %(scannerVolumes)d volumes, exit %(exitStatus)s' % summary)
@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Timing Benchmarks for Experiment Functions
+authors: Ian Roberts
+
+Microbenchmarks for code that runs between flips. Run from the experiment directory:
+    python timingBenchmarks.py
+"""
+
+from __future__ import print_function
+import os, sys, timeit, time, random, threading
+import pandas as pd
+import numpy as np
+from psychopy import core
+
+import dataFunctions as df
+import timingFunctions as tf
+import generalFunctions as gf
+
+_thisDir = os.path.dirname(os.path.abspath(__file__))
+
+
+def _scanner_trials(nRepeats=4):
+    """ Build a scanner-like run schedule from the partner stim file
+
+        Args:
+            nRepeats (int): Number of times to stack the stim file (more trials per run).
+    """
+    trialsDf = pd.read_csv(os.path.join(_thisDir, 'stim', 'anm1_partner1_trials.csv'))
+    trialsDf = pd.concat([trialsDf] * nRepeats, ignore_index=True)
+    trialsDf['partner'] = 'pos'
+    trialsDf['instructsJitterDur'] = 0.0
+    for col in ['instructs_onset', 'instructsJitter_onset', 'need_onset', 'jitter_onset', 'prop_onset', 'iti_onset',
+                'resp_onset', 'instructsTTL', 'fixTTL', 'needTTL', 'propTTL', 'respTTL', 'overallTrialNumber',
+                'blockTrialNum', 'globalTime', 'resp', 'respNum', 'rt', 'accept']:
+        trialsDf[col] = np.nan
+    return trialsDf
+
+
+# fields written on every trial of a run (as in anm1_scanner.py and anm1_preScanner.py)
+_benchFields = [('overallTrialNumber', 'i4'), ('blockTrialNum', 'i4'), ('globalTime', 'f8'),
+                ('resp', 'O'), ('respNum', 'O'), ('rt', 'f8'), ('accept', 'f8'),
+                ('instructs_onset', 'f8'), ('instructsJitter_onset', 'f8'), ('need_onset', 'f8'),
+                ('jitter_onset', 'f8'), ('prop_onset', 'f8'), ('iti_onset', 'f8'), ('resp_onset', 'f8'),
+                ('instructsTTL', 'f8'), ('fixTTL', 'f8'), ('needTTL', 'f8'), ('propTTL', 'f8'), ('respTTL', 'f8')]
+
+
+def bench_trial_records(nRuns=20):
+    """ Compare per-trial bookkeeping with trialsDf.loc writes against a preallocated TrialRecords buffer
+
+        Args:
+            nRuns (int): Number of runs to time for each method.
+    """
+    trialsDf = _scanner_trials()
+    nTrials = trialsDf.shape[0]
+    floatFields = [name for name, dtype in _benchFields if dtype != 'O']
+
+    def loc_writes():
+        runDf = trialsDf.copy()
+        for i, thisTrial in runDf.iterrows():
+            for name in floatFields:
+                runDf.loc[i, name] = 1.0
+            runDf.loc[i, 'resp'] = '1'
+            runDf.loc[i, 'respNum'] = 1
+            runDf.loc[i, 'partner']  # reads of trial values
+            runDf.loc[i, 'blockType']
+        return runDf
+
+    def buffer_writes():
+        runDf = trialsDf.copy()
+        trialData = df.TrialRecords(nTrials=nTrials, fields=_benchFields)
+        for i, thisTrial in runDf.iterrows():
+            for name in floatFields:
+                trialData[name][i] = 1.0
+            trialData['resp'][i] = '1'
+            trialData['respNum'][i] = 1
+            thisTrial['partner']
+            thisTrial['blockType']
+            trialData.row(i)  # journal entry
+        trialData.store(runDf)
+        return runDf
+
+    print('per-trial bookkeeping (%d trials, %d fields)' % (nTrials, len(_benchFields)))
+    for label, func in [('trialsDf.loc', loc_writes), ('TrialRecords', buffer_writes)]:
+        runTime = min(timeit.repeat(func, number=1, repeat=nRuns, timer=timeit.default_timer))
+        print('    %-14s %9.1f us/trial' % (label, runTime / nTrials * 1e6))
+
+
+def _print_latency(label, latency):
+    latency = np.asarray(latency) * 1000.0
+    print('    %-14s median %6.2f ms, 95th %6.2f ms, max %6.2f ms' % (label, np.median(latency), np.percentile(latency, 95), latency.max()))
+
+
+def bench_response_capture(nPresses=200, win=None):
+    """ Timestamp error and read delay of ResponseCapture for real key presses, for each backend
+
+        Presses of the response keys are injected into the Windows input queue (keybd_event) by a thread at random
+        times while the window flips, and are read once per frame with get(), as in the trial loop. The timestamp
+        error (press time in the buffer minus injection time) is the error added to RTs; the read delay is the time
+        until the trial loop sees the press. Windows only (presses cannot be injected elsewhere).
+
+        Args:
+            nPresses (int): Number of presses to inject for each backend.
+            win [visual.Window object]: Window to flip (a new one is opened if None). It must have keyboard focus.
+    """
+    if sys.platform != 'win32':
+        print('response capture: skipped (key presses are injected with keybd_event on Windows)')
+        return
+    import ctypes
+    from psychopy import event
+    keybdEvent = ctypes.windll.user32.keybd_event
+    closeWin = win is None
+    win = win or _make_window()
+    keyList = ['1', '2', '3', '4']
+
+    print('response capture (%d presses, read once per frame)' % nPresses)
+    for backend in ['win32', 'pyglet']:
+        capture = tf.ResponseCapture(win=win, keyList=keyList, backend=backend)
+        pressTimes = []
+
+        def producer():
+            for n in range(nPresses):
+                time.sleep(random.uniform(0.02, 0.06))
+                key = ord(random.choice(keyList))  # virtual-key code of a digit
+                pressTimes.append(core.getTime())
+                keybdEvent(key, 0, 0, 0)
+                time.sleep(0.01)
+                keybdEvent(key, 0, 2, 0)  # KEYEVENTF_KEYUP
+
+        capture.start()
+        thread = threading.Thread(target=producer)
+        thread.start()
+        stampTimes, readTimes = [], []
+        deadline = np.inf
+        while core.getTime() < deadline:
+            win.flip()
+            now = core.getTime()
+            for key, t in capture.get():
+                stampTimes.append(t)
+                readTimes.append(now)
+            if not thread.is_alive() and deadline == np.inf:
+                deadline = now + 0.2  # presses still in flight
+        capture.stop()
+        event.clearEvents()
+
+        n = min(len(stampTimes), len(pressTimes))
+        pressTimes = np.asarray(pressTimes[:n])
+        print('  %s (%d of %d presses captured)' % (backend, len(stampTimes), nPresses))
+        if not n:
+            continue
+        _print_latency('timestamp err', np.asarray(stampTimes[:n]) - pressTimes)
+        _print_latency('read delay', np.asarray(readTimes[:n]) - pressTimes)
+
+    if closeWin:
+        win.close()
+
+
+def _make_window():
+    from psychopy import visual
+    return visual.Window(size=(800, 600), fullscr=False, units='pix', color=(-1, -1, -1), allowGUI=False)
+
+
+def bench_numeric_text(nTrials=200, win=None):
+    """ Compare setText and draw of TextStim against NumericText for the choice screen values
+
+        Args:
+            nTrials (int): Number of trials (one amount, amount and probability update each) to time.
+            win [visual.Window object]: Window to draw in. If None, a small window is opened and closed.
+    """
+    from psychopy import visual
+    closeWin = win is None
+    if closeWin:
+        win = _make_window()
+    trialsDf = _scanner_trials()
+    trialsDf = pd.concat([trialsDf] * int(np.ceil(float(nTrials) / trialsDf.shape[0])), ignore_index=True)[:nTrials]
+    textArgs = dict(color=(1, 1, 1), font='Arial', height=120, units='pix')
+
+    stimSets = []
+    start = timeit.default_timer()
+    stimSets.append(('TextStim', [visual.TextStim(win=win, text='00', pos=(-300, -70), **textArgs),
+                                  visual.TextStim(win=win, text='00', pos=(300, -70), **textArgs),
+                                  visual.TextStim(win=win, text='', pos=(0, 0), **textArgs)], timeit.default_timer() - start))
+    start = timeit.default_timer()
+    stimSets.append(('NumericText', [gf.NumericText(win=win, values=gf.amountValues, pos=(-300, -70), **textArgs),
+                                     gf.NumericText(win=win, values=gf.amountValues, pos=(300, -70), **textArgs),
+                                     gf.NumericText(win=win, values=gf.probValues, pos=(0, 0), **textArgs)], timeit.default_timer() - start))
+
+    print('choice screen text (%d trials)' % nTrials)
+    for label, (selfAmount, otherAmount, probText), buildTime in stimSets:
+        setTimes = np.zeros(nTrials)
+        drawTimes = np.zeros(nTrials)
+        for i, thisTrial in trialsDf.iterrows():
+            start = timeit.default_timer()
+            selfAmount.setText(str(thisTrial['selfProp']))
+            otherAmount.setText(str(thisTrial['otherProp']))
+            probText.setText(str(thisTrial['prob']) + '%')
+            setTimes[i] = timeit.default_timer() - start
+            start = timeit.default_timer()
+            for stim in [selfAmount, otherAmount, probText]:
+                stim.draw()
+            win.flip()
+            drawTimes[i] = timeit.default_timer() - start
+        print('    %-14s setText median %7.3f ms, max %7.3f ms; draw+flip median %6.2f ms; build %6.0f ms'
+              % (label, np.median(setTimes) * 1000, setTimes.max() * 1000, np.median(drawTimes) * 1000, buildTime * 1000))
+
+    if closeWin:
+        win.close()
+
+
+def _camera_frames(nFrames, width=384, height=320, seed=1):
+    """ Synthetic camera images (palette indices) with a dark pupil that moves between frames """
+    rng = np.random.RandomState(seed)
+    y, x = np.mgrid[0:height, 0:width]
+    frames = []
+    for n in range(nFrames):
+        frame = rng.randint(100, 200, size=(height, width))
+        cx, cy = width / 2 + 40 * np.cos(n / 5.0), height / 2 + 30 * np.sin(n / 5.0)
+        frame[(x - cx) ** 2 + (y - cy) ** 2 < 30 ** 2] = 10
+        frames.append(frame.astype(np.uint8))
+    return frames
+
+
+def bench_camera_image(nFrames=60, win=None, resolutions=((192, 160), (384, 320))):
+    """ Camera-view frames per second of the EyeLink setup screen at each camera resolution
+
+        Compares the pixel-by-pixel image, the vectorized image enlarged on the CPU and the vectorized image enlarged
+        by the texture sampler. Each frame is delivered line by line through draw_image_line (as pylink does during
+        setup), with the tracker in dummy mode.
+
+        Args:
+            nFrames (int): Number of camera frames to draw with each method.
+            win [visual.Window object]: Window to draw in. If None, a small window is opened and closed.
+            resolutions (tuple): Camera image sizes (width, height) to time.
+    """
+    import pylink
+    from EyeLinkCoreGraphicsPsychoPy import EyeLinkCoreGraphicsPsychoPy
+    closeWin = win is None
+    if closeWin:
+        win = _make_window()
+    tk = pylink.EyeLink(None)  # dummy mode
+    palette = list(range(256))
+
+    for width, height in resolutions:
+        frames = _camera_frames(nFrames, width=width, height=height)
+        print('camera image (%d x %d, %d frames)' % (width, height, nFrames))
+        for label, vectorized, gpuScaling in [('pixel loop', False, False), ('CPU resize', True, False), ('GPU resize', True, True)]:
+            genv = EyeLinkCoreGraphicsPsychoPy(tk, win, vectorizedImage=vectorized, gpuScaling=gpuScaling)
+            genv.set_image_palette(palette, palette, palette)
+            genv.setup_image_display(width, height)
+            frameTimes = np.zeros(nFrames)
+            for n, frame in enumerate(frames):
+                start = timeit.default_timer()
+                for line in range(height):
+                    genv.draw_image_line(width, line + 1, height, frame[line])
+                frameTimes[n] = timeit.default_timer() - start
+            genv.exit_image_display()
+            print('    %-14s %6.1f frames/s (median frame %6.2f ms, max %6.2f ms)'
+                  % (label, 1.0 / np.median(frameTimes), np.median(frameTimes) * 1000, frameTimes.max() * 1000))
+
+    tk.close()
+    if closeWin:
+        win.close()
+
+
+if __name__ == '__main__':
+    bench_trial_records()
+    bench_response_capture()
+    bench_numeric_text()
+    bench_camera_image()
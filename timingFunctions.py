@@ -0,0 +1,627 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Timing Functions for Scanner Runs
+authors: Ian Roberts
+"""
+
+import threading, time, os, sys, gc
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+from psychopy import core, logging
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+# trial phases in presentation order and the trialsDf column holding each duration
+schedulePhases = ['instructs', 'instructsJitter', 'need', 'jitter', 'prop', 'iti']
+phaseDurCols = {'instructs': 'instructsDur',
+                'instructsJitter': 'instructsJitterDur',
+                'need': 'needDur',
+                'jitter': 'jitterDur',
+                'prop': 'propDur',
+                'iti': 'itiDur'}
+
+
+def compile_schedule(trialsDf, frameDur, endFixDur=0.0, firstTrial=0):
+    """ Compile the phase durations of a run into absolute onsets relative to the scanner trigger
+
+        Args:
+            trialsDf (data frame): pandas data frame of trials with a duration column for each phase (see phaseDurCols).
+            frameDur (float): Duration of a single frame in seconds (measured refresh rate).
+            endFixDur (float): Duration of the fixation added after the last trial.
+            firstTrial (int): Row of the first trial to present (e.g., when resuming a run). Earlier trials are skipped.
+
+        Returns a dictionary with the onsets and offsets in seconds and the matching frame indices, each of shape (nTrials, nPhases).
+    """
+    durs = np.zeros((trialsDf.shape[0], len(schedulePhases)))
+    for p, phase in enumerate(schedulePhases):
+        if phaseDurCols[phase] in trialsDf.columns:
+            durs[:, p] = trialsDf[phaseDurCols[phase]].values.astype(float)
+    durs = np.nan_to_num(durs)  # missing durations are skipped phases
+    durs[:firstTrial] = 0
+
+    ends = np.cumsum(durs.ravel()).reshape(durs.shape)  # offsets relative to trigger
+    onsets = ends - durs
+
+    schedule = {}
+    schedule['durs'] = durs
+    schedule['onsets'] = onsets
+    schedule['offsets'] = ends
+    schedule['onsetFrames'] = np.round(onsets / frameDur).astype(int)
+    schedule['offsetFrames'] = np.round(ends / frameDur).astype(int)
+    schedule['runEnd'] = ends[-1, -1] + endFixDur
+    schedule['runEndFrame'] = int(round(schedule['runEnd'] / frameDur))
+
+    return schedule
+
+
+def timing_column_names():
+    """ Names of the per-phase timing columns written by RunScheduler, in order """
+    columns = []
+    for phase in schedulePhases:
+        columns += [phase + '_onset', phase + '_droppedFrames', phase + '_maxFrameInterval_ms', phase + '_target']
+    return columns
+
+
+def frame_stats(frameIntervals, frameDur):
+    """ Summarise a set of frame intervals
+
+        Args:
+            frameIntervals (list/array): Intervals between successive flips in seconds (e.g., from win.frameIntervals).
+            frameDur (float): Duration of a single frame in seconds (measured refresh rate).
+
+        Returns the number of dropped frames and the longest frame interval in milliseconds.
+    """
+    intervals = np.asarray(frameIntervals, dtype=float)
+    if intervals.size == 0:
+        return 0, np.nan
+    # an interval spanning n refreshes means n - 1 frames were dropped
+    dropped = np.maximum(np.round(intervals / frameDur) - 1, 0).sum()
+    return int(dropped), intervals.max() * 1000.0
+
+
+class RunScheduler(object):
+    """ Present trial phases on absolute, frame-counted onsets
+
+        Every phase ends on the frame of its scheduled offset relative to the scanner trigger, rather than after a
+        fresh countdown. An overrun in one phase is absorbed by the following phase, so the error against the
+        scanner never accumulates beyond one frame.
+
+        Args:
+            win [visual.Window object]: Provide the window object to use.
+            trialsDf (data frame): pandas data frame of trials (see compile_schedule).
+            frameDur (float): Duration of a single frame in seconds (measured refresh rate).
+            clock [core.Clock object]: Clock reset at the scanner trigger (e.g., blockClock).
+            endFixDur (float): Duration of the fixation added after the last trial.
+            firstTrial (int): Row of the first trial to present (e.g., when resuming a run).
+    """
+
+    def __init__(self, win, trialsDf, frameDur, clock, endFixDur=0.0, firstTrial=0):
+        self.win = win
+        self.frameDur = float(frameDur)
+        self.clock = clock
+        self.firstTrial = firstTrial
+        self.schedule = compile_schedule(trialsDf, self.frameDur, endFixDur=endFixDur, firstTrial=firstTrial)
+        self.phaseIndex = dict((phase, p) for p, phase in enumerate(schedulePhases))
+        self.lastFlip = 0.0  # time of the most recent flip on clock
+        self.targetFrame = 0  # frame on which the current phase should end
+        self.phaseFlips = 0  # number of flips in the current phase
+
+        # per-trial, per-phase timing (NaN for phases that were not shown)
+        nTrials, nPhases = self.schedule['durs'].shape
+        self.flipOnsets = np.full((nTrials, nPhases), np.nan)
+        self.droppedFrames = np.full((nTrials, nPhases), np.nan)
+        self.maxFrameIntervals = np.full((nTrials, nPhases), np.nan)
+        self.currentPhase = None  # (trial, phase index) being presented
+        self.phaseStartInterval = 0  # index into win.frameIntervals at the start of the current phase
+
+        # record the interval between every flip for dropped frame accounting
+        self.win.frameIntervals = []
+        self.win.recordFrameIntervals = True
+
+    def onset(self, trial, phase):
+        """ Scheduled onset (in seconds) of a phase """
+        return self.schedule['onsets'][trial, self.phaseIndex[phase]]
+
+    def frame_index(self, t=None):
+        """ Convert a time on the run clock to the nearest frame index """
+        if t is None:
+            t = self.lastFlip
+        return int(round(t / self.frameDur))
+
+    def start_phase(self, trial, phase):
+        """ Begin presenting a phase; the phase will end on its scheduled offset frame """
+        self.end_phase()
+        self.currentPhase = (trial, self.phaseIndex[phase])
+        self.targetFrame = self.schedule['offsetFrames'][self.currentPhase]
+        self.phaseFlips = 0
+        self.phaseStartInterval = len(self.win.frameIntervals)
+        self.win.callOnFlip(self._mark_onset, self.currentPhase)  # onset is the time the phase is first shown
+
+    def start_end_fixation(self):
+        """ Begin presenting the fixation after the last trial """
+        self.end_phase()
+        self.targetFrame = self.schedule['runEndFrame']
+        self.phaseFlips = 0
+
+    def end_phase(self):
+        """ Store dropped frames and the longest frame interval for the phase being presented """
+        if self.currentPhase is None:
+            return
+        dropped, maxInterval = frame_stats(self.win.frameIntervals[self.phaseStartInterval:], self.frameDur)
+        self.droppedFrames[self.currentPhase] = dropped
+        self.maxFrameIntervals[self.currentPhase] = maxInterval
+        self.currentPhase = None
+
+    def finish(self):
+        """ Close the last phase and stop recording frame intervals """
+        self.end_phase()
+        self.win.recordFrameIntervals = False
+
+    def _mark_onset(self, phase):
+        self.flipOnsets[phase] = self.clock.getTime()
+
+    def phase_onset(self, trial, phase):
+        """ Recorded onset (time of the first flip) of a phase """
+        return self.flipOnsets[trial, self.phaseIndex[phase]]
+
+    def timing_columns(self):
+        """ Recorded onsets, dropped frames, longest frame intervals and scheduled onsets as an ordered dictionary of trialsDf columns """
+        columns = OrderedDict()
+        for phase in schedulePhases:
+            p = self.phaseIndex[phase]
+            columns[phase + '_onset'] = self.flipOnsets[:, p]
+            columns[phase + '_droppedFrames'] = self.droppedFrames[:, p]
+            columns[phase + '_maxFrameInterval_ms'] = self.maxFrameIntervals[:, p]
+            columns[phase + '_target'] = np.where(self.schedule['durs'][:, p] > 0, self.schedule['onsets'][:, p], np.nan)
+        return columns
+
+    def trial_timing(self, trial):
+        """ Timing columns (see timing_columns) of a single trial as an ordered dictionary """
+        return OrderedDict((col, values[trial]) for col, values in self.timing_columns().items())
+
+    def store_timing(self, trialsDf):
+        """ Write the timing columns of the presented trials (from firstTrial on) to trialsDf """
+        rows = trialsDf.index[self.firstTrial:]
+        for col, values in self.timing_columns().items():
+            trialsDf.loc[rows, col] = values[self.firstTrial:]
+
+    def flip(self):
+        """ Flip the window and record the flip time on the run clock """
+        self.win.flip()
+        self.lastFlip = self.clock.getTime()
+        self.phaseFlips += 1
+        return self.lastFlip
+
+    def phase_done(self):
+        """ Whether the next flip belongs to the following phase. Each phase is shown for at least one frame. """
+        if self.phaseFlips == 0:
+            return False
+        return self.frame_index() + 1 >= self.targetFrame
+
+
+class TriggerListener(object):
+    """ Timestamp every scanner trigger (TR pulse) of a run
+
+        Trigger key presses are picked up by a handler pushed onto the window's key events next to PsychoPy's own
+        handler, so the keys are still available to event.getKeys and no responses are taken from the trial loop.
+        Timestamps are stored in a preallocated array on core.getTime and reported relative to the run start.
+
+        Args:
+            win [visual.Window object]: Provide the window object to use. If None, triggers are only added with record().
+            triggerKey (str): Key sent by the scanner on every volume.
+            maxTriggers (int): Number of triggers to preallocate space for.
+            TR (float): Repetition time in seconds. If None, TR is estimated from the median trigger interval.
+    """
+
+    def __init__(self, win=None, triggerKey='5', maxTriggers=2000, TR=None):
+        self.win = win
+        self.keyNames = [triggerKey, 'num_' + triggerKey]
+        self.TR = TR
+        self.times = np.full(maxTriggers, np.nan)
+        self.nTriggers = 0
+        self.nOverflow = 0  # triggers that did not fit in the preallocated array
+        self.zero = 0.0  # core.getTime at the start of the run clock
+        self.listening = False
+
+    def start(self):
+        """ Start listening for triggers """
+        if self.win is not None and hasattr(self.win, 'winHandle') and not self.listening:
+            from pyglet.window import key
+            self._symbolString = key.symbol_string
+            self.win.winHandle.push_handlers(on_key_press=self._on_key_press)
+        self.listening = True
+
+    def stop(self):
+        """ Stop listening for triggers """
+        if self.win is not None and hasattr(self.win, 'winHandle') and self.listening:
+            self.win.winHandle.remove_handlers(on_key_press=self._on_key_press)
+        self.listening = False
+
+    def _on_key_press(self, symbol, modifiers):
+        if self._symbolString(symbol).lower().lstrip('_') in self.keyNames:
+            self.record(core.getTime())
+        # returning None passes the key on to PsychoPy's handler
+
+    def record(self, t):
+        """ Store the time (on core.getTime) of a trigger """
+        if self.nTriggers < len(self.times):
+            self.times[self.nTriggers] = t
+            self.nTriggers += 1
+        else:
+            self.nOverflow += 1
+
+    def set_zero(self, t):
+        """ Set the core.getTime value at which the run clock was reset """
+        self.zero = t
+
+    def trigger_times(self):
+        """ Trigger times relative to the start of the run clock """
+        return self.times[:self.nTriggers] - self.zero
+
+    def estimate_tr(self):
+        """ TR in seconds, either as given or as the median interval between triggers """
+        if self.TR is not None:
+            return float(self.TR)
+        intervals = np.diff(self.trigger_times())
+        intervals = intervals[intervals > 0]
+        if intervals.size == 0:
+            return np.nan
+        return float(np.median(intervals))
+
+    def tr_table(self):
+        """ Table of all triggers with their volume number and flags for missed or extra pulses """
+        times = self.trigger_times()
+        TR = self.estimate_tr()
+
+        intervals = np.concatenate(([np.nan], np.diff(times)))
+        with np.errstate(invalid='ignore'):
+            extra = intervals < 0.5 * TR  # pulse arrived well before the next volume was due
+            steps = np.round(intervals / TR)
+        steps[0] = 0
+        steps[extra] = 0
+        steps = np.nan_to_num(steps)
+
+        table = pd.DataFrame({'trigger': np.arange(1, times.size + 1),
+                              'triggerTime': times,
+                              'interval': intervals,
+                              'volume': np.cumsum(steps).astype(int),
+                              'missedBefore': np.maximum(steps - 1, 0).astype(int),
+                              'extra': extra.astype(int)})
+        table['TR'] = TR
+        table = table[['trigger', 'volume', 'triggerTime', 'interval', 'TR', 'missedBefore', 'extra']]
+        return table
+
+    def summary(self):
+        """ Number of triggers received, missed and extra over the run """
+        table = self.tr_table()
+        return {'nTriggers': int(table.shape[0]) + self.nOverflow,
+                'missedTriggers': int(table['missedBefore'].sum()),
+                'extraTriggers': int(table['extra'].sum()),
+                'TR': self.estimate_tr()}
+
+    def volume_index(self, onsets):
+        """ Volume acquired at each onset (relative to the run start); NaN before the first trigger """
+        onsets = np.asarray(onsets, dtype=float)
+        volumes = np.full(onsets.shape, np.nan)
+
+        table = self.tr_table()
+        table = table[table['extra'] == 0]
+        if table.shape[0] == 0:
+            return volumes
+
+        TR = self.estimate_tr()
+        trigTimes = table['triggerTime'].values
+        trigVolumes = table['volume'].values
+        k = np.searchsorted(trigTimes, onsets, side='right') - 1  # last trigger at or before each onset
+        valid = (k >= 0) & ~np.isnan(onsets)
+        # onsets past the last trigger are counted on from it at the TR
+        volumes[valid] = trigVolumes[k[valid]] + np.floor((onsets[valid] - trigTimes[k[valid]]) / TR)
+        return volumes
+
+
+def _virtual_key(key):
+    """ Windows virtual-key code of a PsychoPy key name (digits, letters, 'num_<digit>', space, return, escape) """
+    named = {'space': 0x20, 'return': 0x0D, 'escape': 0x1B}
+    if key in named:
+        return named[key]
+    if len(key) == 1 and key.isalnum():
+        return ord(key.upper())
+    if key.startswith('num_') and key[4:].isdigit():
+        return 0x60 + int(key[4:])
+    raise Exception('No virtual-key code for key %s' %(key))
+
+
+class ResponseCapture(object):
+    """ Timestamp every button-box press on core.getTime into a ring buffer read by the trial loop
+
+        Presses are read by a background thread, independent of the frame-paced event pump. The thread polls
+        PsychoPy's psychtoolbox keyboard (kernel-level timestamps) where it is available. On PsychoPy 1.x, which has no
+        psychopy.hardware.keyboard, the thread polls the state of each key with GetAsyncKeyState on Windows
+        (timestamps at the poll, within about a millisecond, as the timer resolution is raised to 1 ms while
+        capturing; a press shorter than a poll is caught by the pressed-since-last-call bit, but that bit is shared
+        with any other program polling the keyboard, which can then hide such a press). Otherwise a handler pushed
+        onto the window's key events is used (no thread: timestamps at event dispatch, i.e. once per flip). Trigger presses are passed to a TriggerListener rather than the buffer.
+
+        The ring buffer has a single writer (the capture) and a single reader (the trial loop); each side only
+        moves its own index, so no lock is needed. Presses that arrive while the buffer is full are counted in
+        nOverflow rather than overwriting unread presses.
+
+        Args:
+            win [visual.Window object]: Provide the window object to use (for the fallback key handler).
+            keyList (list): Keys to capture (e.g., the response keys and the quit key).
+            triggerListener (TriggerListener): Listener that receives trigger presses. If None, triggers are not captured.
+            bufferSize (int): Number of presses the ring buffer holds.
+            pollInterval (float): Seconds between polls of the keyboard by the capture thread (at least 1 ms for 'win32').
+            backend (str): 'ptb' (psychtoolbox keyboard), 'win32' (key state polling), 'pyglet' (window key events), or
+                           None to pick the first available.
+    """
+
+    def __init__(self, win=None, keyList=None, triggerListener=None, bufferSize=1024, pollInterval=0.0005, backend=None):
+        self.win = win
+        self.keyList = list(keyList or [])
+        self.triggerListener = triggerListener
+        self.triggerKeys = list(triggerListener.keyNames) if triggerListener is not None else []
+        self.pollInterval = pollInterval
+        self.keys = np.zeros(bufferSize, dtype=int)  # index into keyList
+        self.times = np.zeros(bufferSize)  # core.getTime of each press
+        self.head = 0  # number of presses written (capture side)
+        self.tail = 0  # number of presses read (trial loop side)
+        self.nOverflow = 0
+        self.running = False
+        self.thread = None
+        self.backend = backend
+        if self.backend is None:
+            try:
+                from psychopy.hardware import keyboard
+                self.backend = 'ptb' if keyboard.havePTB else 'pyglet'
+            except (ImportError, AttributeError):
+                self.backend = 'win32' if sys.platform == 'win32' else 'pyglet'
+
+    def push(self, key, t):
+        """ Store a press (called by the capture; also used to inject presses in benchmarks) """
+        if key in self.triggerKeys:
+            self.triggerListener.record(t)
+            return
+        if key not in self.keyList:
+            return
+        if self.head - self.tail >= len(self.keys):
+            self.nOverflow += 1
+            return
+        slot = self.head % len(self.keys)
+        self.keys[slot] = self.keyList.index(key)
+        self.times[slot] = t
+        self.head += 1  # publish the press only after the slot is written
+
+    def get(self):
+        """ Unread presses as a list of (key, time on core.getTime) tuples, oldest first """
+        presses = []
+        head = self.head
+        while self.tail < head:
+            slot = self.tail % len(self.keys)
+            presses.append((self.keyList[self.keys[slot]], self.times[slot]))
+            self.tail += 1
+        return presses
+
+    def clear(self):
+        """ Discard unread presses """
+        self.tail = self.head
+
+    def start(self):
+        """ Start capturing presses """
+        if self.running:
+            return
+        self.running = True
+        if self.backend == 'ptb':
+            from psychopy.hardware import keyboard
+            self.kbClock = core.Clock()
+            self.kb = keyboard.Keyboard(clock=self.kbClock)
+            self.kbZero = core.getTime() - self.kbClock.getTime()  # core.getTime at the kbClock reset
+            self.thread = threading.Thread(target=self._poll_loop)
+            self.thread.daemon = True
+            self.thread.start()
+        elif self.backend == 'win32':
+            import ctypes
+            self.winmm = ctypes.windll.winmm
+            self.winmm.timeBeginPeriod(1)  # 1 ms sleep resolution for the poll loop
+            self.getKeyState = ctypes.windll.user32.GetAsyncKeyState
+            self.thread = threading.Thread(target=self._poll_loop_win32)
+            self.thread.daemon = True
+            self.thread.start()
+        elif self.win is not None and hasattr(self.win, 'winHandle'):
+            from pyglet.window import key
+            self._symbolString = key.symbol_string
+            self.win.winHandle.push_handlers(on_key_press=self._on_key_press)
+
+    def stop(self):
+        """ Stop capturing presses """
+        if not self.running:
+            return
+        self.running = False
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+            if self.backend == 'win32':
+                self.winmm.timeEndPeriod(1)
+        elif self.win is not None and hasattr(self.win, 'winHandle'):
+            self.win.winHandle.remove_handlers(on_key_press=self._on_key_press)
+
+    def _poll_loop(self):
+        keyList = self.keyList + self.triggerKeys
+        while self.running:
+            for key in self.kb.getKeys(keyList=keyList, waitRelease=False, clear=True):
+                self.push(key.name, self.kbZero + key.rt)
+            time.sleep(self.pollInterval)
+
+    def _poll_loop_win32(self):
+        keyList = self.keyList + self.triggerKeys
+        codes = [_virtual_key(key) for key in keyList]
+        for code in codes:
+            self.getKeyState(code)  # clear the pressed-since-last-call bit of presses before the capture
+        down = [False] * len(codes)
+        pollInterval = max(self.pollInterval, 0.001)
+        while self.running:
+            t = core.getTime()
+            for n, code in enumerate(codes):
+                state = self.getKeyState(code)
+                isDown = bool(state & 0x8000)
+                # press: the key went down since the last poll, or was pressed and released between polls
+                if (isDown and not down[n]) or state & 0x0001:
+                    self.push(keyList[n], t)
+                down[n] = isDown
+            time.sleep(pollInterval)
+
+    def _on_key_press(self, symbol, modifiers):
+        self.push(self._symbolString(symbol).lower().lstrip('_').replace('num_', ''), core.getTime())
+        # returning None passes the key on to PsychoPy's handler
+
+
+class RealTimeMode(object):
+    """ Protect a scanner run from garbage collection pauses, OS scheduling and log flushes
+
+        While active, the garbage collector is disabled (after a full collection; objects are also frozen where
+        gc.freeze is available), the process priority is raised with core.rush, every thread of the process (including
+        threads started before enter()) is pinned to dedicated cores, and PsychoPy log messages are queued rather than
+        written to the log file on every flip. Everything is restored by exit(), which also writes the queued log
+        messages. Use around the time-critical part of a run and write data files after exit().
+
+        Args:
+            enabled (True/False): If False, enter() and exit() do nothing (status reports no protections).
+            cpus (list): Cores to pin the process to. If None, every core except the first (left to the OS and
+                interrupts) is used on machines with more than one core.
+    """
+
+    def __init__(self, enabled=True, cpus=None):
+        self.enabled = enabled
+        self.cpus = cpus
+        self.active = False
+        self.reset_status()
+
+    def reset_status(self):
+        """ Clear which protections were active (e.g., before each run) """
+        self.gcDisabled = False
+        self.gcFrozen = False
+        self.priority = False
+        self.pinnedCPUs = []
+        self.deferredLogs = False
+
+    def enter(self):
+        """ Switch on every available protection """
+        if not self.enabled or self.active:
+            return
+        self.active = True
+        self.reset_status()
+
+        # garbage collection
+        self.gcWasEnabled = gc.isenabled()
+        gc.collect()
+        if hasattr(gc, 'freeze'):  # move existing objects out of future collections
+            gc.freeze()
+            self.gcFrozen = True
+        gc.disable()
+        self.gcDisabled = True
+
+        # process priority
+        niceBefore = self._nice()
+        rushed = core.rush(True)
+        self.priority = bool(rushed) or (niceBefore is not None and self._nice() != niceBefore)
+
+        # CPU pinning
+        self.oldAffinity = self._get_affinity()
+        if self.oldAffinity:
+            cpus = self.cpus
+            if cpus is None and len(self.oldAffinity) > 1:
+                cpus = sorted(self.oldAffinity)[1:]
+            if cpus and self._set_affinity(cpus):
+                self.pinnedCPUs = sorted(self._get_affinity())
+
+        # log flushes (PsychoPy flushes the log on every flip)
+        self.logFlush = logging.flush
+        logging.flush = self._defer_flush
+        self.deferredLogs = True
+
+    def exit(self):
+        """ Restore normal operation and write the queued log messages """
+        if not self.active:
+            return
+        self.active = False
+
+        logging.flush = self.logFlush
+        logging.flush()
+
+        if self.pinnedCPUs:
+            self._set_affinity(self.oldAffinity)
+
+        if self.priority:
+            core.rush(False)
+
+        if hasattr(gc, 'unfreeze') and self.gcFrozen:
+            gc.unfreeze()
+        if self.gcWasEnabled:
+            gc.enable()
+
+    def __enter__(self):
+        self.enter()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.exit()
+
+    def _defer_flush(self, *args, **kwargs):
+        pass  # messages stay queued until exit()
+
+    def _nice(self):
+        if psutil is None:
+            return None
+        try:
+            return psutil.Process().nice()
+        except Exception:
+            return None
+
+    def _get_affinity(self):
+        if hasattr(os, 'sched_getaffinity'):
+            return sorted(os.sched_getaffinity(0))
+        if psutil is not None and hasattr(psutil.Process, 'cpu_affinity'):
+            return sorted(psutil.Process().cpu_affinity())
+        return []
+
+    def _thread_ids(self):
+        # on Linux affinity is set per thread, so threads started before enter() (response capture, EyeLink
+        # messages, clock sync) are pinned one by one; elsewhere the process ID covers every thread
+        try:
+            return sorted(int(tid) for tid in os.listdir('/proc/self/task'))
+        except OSError:
+            return [os.getpid()]
+
+    def _set_affinity(self, cpus):
+        if hasattr(os, 'sched_setaffinity'):
+            set_affinity = lambda tid: os.sched_setaffinity(tid, cpus)
+        elif psutil is not None and hasattr(psutil.Process, 'cpu_affinity'):
+            set_affinity = lambda tid: psutil.Process(tid).cpu_affinity(list(cpus))
+        else:
+            return False
+        errors = (OSError, ValueError) if psutil is None else (OSError, ValueError, psutil.Error)
+        for tid in self._thread_ids():
+            try:
+                set_affinity(tid)
+            except errors:
+                if tid == os.getpid():
+                    return False
+                # other threads may have ended since they were listed
+        return True
+
+    def status(self):
+        """ Which protections were active, as an ordered dictionary of trialsDf columns """
+        status = OrderedDict()
+        status['realTime_gcDisabled'] = int(self.gcDisabled)
+        status['realTime_gcFrozen'] = int(self.gcFrozen)
+        status['realTime_priority'] = int(self.priority)
+        status['realTime_cpus'] = ' '.join(str(cpu) for cpu in self.pinnedCPUs)
+        status['realTime_deferredLogs'] = int(self.deferredLogs)
+        return status
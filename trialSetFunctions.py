@@ -0,0 +1,337 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Trial Set Functions for Generating Trial Files
+authors: Ian Roberts
+
+Builds the partner trial files (anm1_partner{1,2,3}_trials.csv: the 100 proposals of anm1_proposals.csv in five
+blocks of 20) and the practice trial files from the proposal grid. Each partner file gets its own jittered copy of
+the grid (amounts -2 to +1, probabilities -4 to +3, as in the current files). Candidate block assignments are drawn
+in batches and scored with NumPy, and the best candidates (valid or not) are then repaired by a local search that
+swaps proposals of the same stratum between blocks:
+    - high/low probability balanced in every block (blocks are dealt from the four prob x advantage strata)
+    - self/other advantage (selfProp - otherProp) matched across partners (mean and mean magnitude) for every pair of
+      blocks from different files, as the scanner combines the blocks of the three files in independently shuffled
+      orders (any block of one partner can share a run with any block of another)
+    - fixed block (and run) duration (each block has the same jitter and ITI values)
+    - no more than maxRepeats trials in a row with the same probability level, advantage sign, jitter or ITI
+
+Run from the experiment directory, e.g.:
+    python trialSetFunctions.py --out stim_generated --seed 1
+"""
+
+from __future__ import print_function
+import os, time, argparse
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+
+trialColumns = ['otherProp', 'prob', 'selfProp', 'needDur', 'propDur', 'jitterDur', 'itiDur', 'partnerBlockNum',
+                'overallPartnerTrialNum', 'partnerBlockTrialNum', 'blockType']
+partnerFiles = ['anm1_partner1_trials.csv', 'anm1_partner2_trials.csv', 'anm1_partner3_trials.csv']
+practiceFiles = ['anm1_practice1_trials.csv', 'anm1_practice2_trials.csv']
+
+defaultConstraints = {'maxAdvantageDiff': 1.0,  # max difference in mean advantage between blocks of different partners
+                      'maxAbsAdvantageDiff': 1.0,  # max difference in mean |advantage| between blocks of different partners
+                      'maxRepeats': 3,  # max trials in a row with the same prob level, advantage sign, jitter or ITI
+                      'needDur': 2.0,
+                      'propDur': 4.0,
+                      'jitterValues': [0.5, 1.5, 2.5, 3.5],  # each used equally often in every block
+                      'itiValues': [0.5, 1.5, 2.5, 3.5]}
+
+
+def load_proposals(fileName=os.path.join('stim', 'anm1_proposals.csv')):
+    """ Proposal grid (selfProp, otherProp, prob) """
+    return pd.read_csv(fileName)
+
+
+def jitter_proposals(proposals, rng, amountJitter=(-2, 1), probJitter=(-4, 3), maxAmount=40):
+    """ Copy of the proposal grid with integer jitter added to the amounts and probabilities
+
+        The amount jitter is smaller than the 5-point spacing of the grid, so no proposal changes advantage sign.
+    """
+    jittered = proposals.copy()
+    for col in ['selfProp', 'otherProp']:
+        jittered[col] = np.clip(proposals[col].values + rng.randint(amountJitter[0], amountJitter[1] + 1, proposals.shape[0]), 0, maxAmount)
+    jittered['prob'] = proposals['prob'].values + rng.randint(probJitter[0], probJitter[1] + 1, proposals.shape[0])
+    return jittered
+
+
+def _strata(proposals):
+    """ Proposal indices of each probability level x advantage sign stratum """
+    high = proposals['prob'].values > 50
+    selfAdv = proposals['selfProp'].values > proposals['otherProp'].values
+    return [np.where((high == h) & (selfAdv == s))[0] for h in [False, True] for s in [False, True]]
+
+
+def max_repeats(labels):
+    """ Longest run of identical consecutive values in each row of labels (n, trials) """
+    labels = np.asarray(labels)
+    current = np.ones(labels.shape[0], dtype=int)
+    longest = current.copy()
+    for t in range(1, labels.shape[1]):
+        current = np.where(labels[:, t] == labels[:, t - 1], current + 1, 1)
+        longest = np.maximum(longest, current)
+    return longest
+
+
+def deal_blocks(strata, rng, nCandidates, nFiles, nBlocks):
+    """ Random stratified assignments of proposals to blocks, shape (candidates, files, blocks, trials per block)
+
+        Every stratum is shuffled and dealt evenly over the blocks, so each block gets the same number of proposals
+        from each stratum.
+    """
+    dealt = []
+    for stratum in strata:
+        perms = np.argsort(rng.rand(nCandidates, nFiles, stratum.size), axis=2)
+        dealt.append(stratum[perms].reshape(nCandidates, nFiles, nBlocks, stratum.size // nBlocks))
+    return np.concatenate(dealt, axis=3)
+
+
+def cross_file_diffs(means):
+    """ Absolute difference of block means (..., files, blocks) for every pair of blocks from different files """
+    nFiles = means.shape[-2]
+    diffs = [np.abs(means[..., f1, :, None] - means[..., f2, None, :]) for f1 in range(nFiles) for f2 in range(f1 + 1, nFiles)]
+    return np.concatenate([diff.reshape(diff.shape[:-2] + (-1,)) for diff in diffs], axis=-1)
+
+
+def _advantage_diffs(advSums, absSums, nTrials):
+    """ Difference in mean advantage and mean |advantage| of every pair of blocks from different files """
+    return cross_file_diffs(advSums / float(nTrials)), cross_file_diffs(absSums / float(nTrials))
+
+
+def _objective(advDiff, absDiff, constraints):
+    """ Constraint violation (total excess over the limits; 0 if valid) and score (mean difference; lower is better) """
+    violation = (np.maximum(advDiff - constraints['maxAdvantageDiff'], 0).sum(axis=-1) +
+                 np.maximum(absDiff - constraints['maxAbsAdvantageDiff'], 0).sum(axis=-1))
+    return violation, advDiff.mean(axis=-1) + absDiff.mean(axis=-1)
+
+
+def repair_blocks(blocks, advantage, strataSizes, rng, constraints=defaultConstraints, nSwaps=200, maxSteps=500):
+    """ Local search that swaps proposals of the same stratum between blocks until no swap improves the set
+
+        Swaps stay within a stratum (probability level x advantage sign), so the probability balance of every block is
+        kept. At each step, nSwaps random swaps are scored at once and the best is applied if it lowers the constraint
+        violation, or the score when there is no violation.
+
+        Args:
+            blocks (array): Assignment (files, blocks, trials per block) of proposal indices (see deal_blocks).
+            advantage (array): Advantage (selfProp - otherProp) of every proposal of every file (files, proposals).
+            strataSizes (list): Number of trials per block from each stratum (in the column order of blocks).
+            rng [np.random.RandomState object]: Random number generator.
+            constraints (dict): Constraints (see defaultConstraints).
+            nSwaps (int): Number of random swaps scored at each step.
+            maxSteps (int): Maximum number of swaps applied.
+
+        Returns the repaired assignment, its constraint violation and its score.
+    """
+    blocks = blocks.copy()
+    nFiles, nBlocks, nTrials = blocks.shape
+    adv = advantage[np.arange(nFiles)[:, None, None], blocks]
+    advSums, absSums = adv.sum(axis=2), np.abs(adv).sum(axis=2)
+    violation, score = _objective(*_advantage_diffs(advSums, absSums, nTrials), constraints=constraints)
+    strataStart = np.concatenate([[0], np.cumsum(strataSizes)[:-1]])
+    for step in range(maxSteps):
+        # random swaps of two trials of one stratum between two blocks of one file
+        f = rng.randint(nFiles, size=nSwaps)
+        s = rng.randint(len(strataSizes), size=nSwaps)
+        b1 = rng.randint(nBlocks, size=nSwaps)
+        b2 = (b1 + rng.randint(1, nBlocks, size=nSwaps)) % nBlocks
+        c1 = strataStart[s] + (rng.rand(nSwaps) * np.asarray(strataSizes)[s]).astype(int)
+        c2 = strataStart[s] + (rng.rand(nSwaps) * np.asarray(strataSizes)[s]).astype(int)
+        dAdv = adv[f, b2, c2] - adv[f, b1, c1]
+        dAbs = np.abs(adv[f, b2, c2]) - np.abs(adv[f, b1, c1])
+        swapIdx = np.arange(nSwaps)
+        newAdvSums, newAbsSums = np.repeat(advSums[None], nSwaps, axis=0), np.repeat(absSums[None], nSwaps, axis=0)
+        newAdvSums[swapIdx, f, b1] += dAdv
+        newAdvSums[swapIdx, f, b2] -= dAdv
+        newAbsSums[swapIdx, f, b1] += dAbs
+        newAbsSums[swapIdx, f, b2] -= dAbs
+        newViolation, newScore = _objective(*_advantage_diffs(newAdvSums, newAbsSums, nTrials), constraints=constraints)
+        i = np.lexsort((newScore, newViolation))[0]
+        if (newViolation[i], newScore[i]) >= (violation, score):
+            break
+        blocks[f[i], b1[i], c1[i]], blocks[f[i], b2[i], c2[i]] = blocks[f[i], b2[i], c2[i]], blocks[f[i], b1[i], c1[i]]
+        adv[f[i], b1[i], c1[i]], adv[f[i], b2[i], c2[i]] = adv[f[i], b2[i], c2[i]], adv[f[i], b1[i], c1[i]]
+        advSums, absSums = newAdvSums[i], newAbsSums[i]
+        violation, score = newViolation[i], newScore[i]
+    return blocks, violation, score
+
+
+def search_partner_sets(fileProposals, constraints=defaultConstraints, nBlocks=5, batchSize=2000, maxBatches=200,
+                        nRepair=20, rng=None):
+    """ Randomized constraint search for the block assignment of every partner file, with local repair
+
+        Candidates are drawn and scored in batches; the nRepair best (by constraint violation, then score) are kept
+        and repaired with repair_blocks, and the best repaired candidate is returned. If no candidate satisfies the
+        constraints, the closest one is returned and its violation is reported in the statistics.
+
+        Args:
+            fileProposals (list): Jittered proposal grid of each partner file (see jitter_proposals).
+            constraints (dict): Constraints (see defaultConstraints).
+            nBlocks (int): Number of blocks per file.
+            batchSize (int): Number of candidate sets drawn and scored at once.
+            maxBatches (int): Number of batches to search.
+            nRepair (int): Number of best candidates to repair.
+            rng [np.random.RandomState object]: Random number generator.
+
+        Returns the best assignment (files, blocks, trials per block) of proposal indices and search statistics.
+    """
+    rng = rng or np.random.RandomState()
+    strata = _strata(fileProposals[0])
+    strataSizes = [stratum.size // nBlocks for stratum in strata]
+    nFiles = len(fileProposals)
+    fileIdx = np.arange(nFiles)[None, :, None, None]
+    advantage = np.array([(p['selfProp'] - p['otherProp']).values for p in fileProposals], dtype=float)
+
+    pool = np.zeros((0, nFiles, nBlocks, sum(strataSizes)), dtype=int)
+    poolViolation, poolScore = np.zeros(0), np.zeros(0)
+    nScored, nValid = 0, 0
+    start = time.time()
+    for batch in range(maxBatches):
+        blocks = deal_blocks(strata, rng, batchSize, nFiles, nBlocks)
+        nScored += batchSize
+
+        # matched mean advantage and mean advantage magnitude across partners, for every pairing of blocks
+        adv = advantage[fileIdx, blocks]
+        violation, score = _objective(*_advantage_diffs(adv.sum(axis=3), np.abs(adv).sum(axis=3), adv.shape[3]),
+                                      constraints=constraints)
+        nValid += (violation == 0).sum()
+
+        # keep the best candidates, valid or not, for repair
+        pool = np.concatenate([pool, blocks])
+        poolViolation, poolScore = np.concatenate([poolViolation, violation]), np.concatenate([poolScore, score])
+        keep = np.lexsort((poolScore, poolViolation))[:nRepair]
+        pool, poolViolation, poolScore = pool[keep], poolViolation[keep], poolScore[keep]
+    searchViolation = poolViolation.min()
+
+    repaired = [repair_blocks(blocks, advantage, strataSizes, rng, constraints) for blocks in pool]
+    best, bestViolation, bestScore = min(repaired, key=lambda r: (r[1], r[2]))
+    bestAdv = advantage[np.arange(nFiles)[:, None, None], best]
+    advDiff, absDiff = _advantage_diffs(bestAdv.sum(axis=2), np.abs(bestAdv).sum(axis=2), bestAdv.shape[2])
+    elapsed = time.time() - start
+    stats = OrderedDict([('candidates', nScored), ('valid', nValid), ('candidatesPerSec', nScored / elapsed if elapsed > 0 else np.nan),
+                         ('repairedValid', sum(r[1] == 0 for r in repaired)), ('searchViolation', searchViolation),
+                         ('violation', bestViolation), ('score', bestScore),
+                         ('maxAdvantageDiff', advDiff.max()), ('maxAbsAdvantageDiff', absDiff.max())])
+    return best, stats
+
+
+def order_block(labels, rng, maxRepeats=3, nPerms=2000):
+    """ Random order of a block's trials with no more than maxRepeats equal labels in a row
+
+        Args:
+            labels (list): Label arrays (one value per trial) that must not repeat more than maxRepeats times in a row.
+            rng [np.random.RandomState object]: Random number generator.
+
+        Returns the trial order.
+    """
+    nTrials = len(labels[0])
+    perms = np.argsort(rng.rand(nPerms, nTrials), axis=1)
+    keep = np.ones(nPerms, dtype=bool)
+    for label in labels:
+        keep &= max_repeats(np.asarray(label)[perms]) <= maxRepeats
+    if not keep.any():
+        raise Exception('No trial order with at most %d repeats in a row was found in %d permutations.' %(maxRepeats, nPerms))
+    return perms[np.argmax(keep)]
+
+
+def build_block(proposals, idx, rng, constraints=defaultConstraints):
+    """ Trials of one block: ordered proposals with jitters and ITIs that do not repeat more than maxRepeats in a row """
+    block = proposals.iloc[idx].reset_index(drop=True)
+    order = order_block([block['prob'].values > 50, block['selfProp'].values > block['otherProp'].values], rng, constraints['maxRepeats'])
+    block = block.iloc[order].reset_index(drop=True)
+    nTrials = block.shape[0]
+    for col, values in [('jitterDur', constraints['jitterValues']), ('itiDur', constraints['itiValues'])]:
+        durs = np.tile(values, nTrials // len(values))
+        block[col] = durs[order_block([durs], rng, constraints['maxRepeats'])]
+    block['needDur'] = constraints['needDur']
+    block['propDur'] = constraints['propDur']
+    return block
+
+
+def generate_trial_sets(proposals, constraints=defaultConstraints, nBlocks=5, seed=None, batchSize=2000, maxBatches=200):
+    """ Generate the partner and practice trial files from the proposal grid
+
+        Args:
+            proposals (data frame): Proposal grid (see load_proposals).
+            constraints (dict): Constraints (see defaultConstraints).
+            nBlocks (int): Number of blocks per partner file.
+            seed (int): Seed for the jitter, search and trial orders.
+            batchSize (int): Number of candidate sets drawn and scored at once.
+            maxBatches (int): Number of batches to search.
+
+        Returns an ordered dictionary of trial files (file name: data frame) and the search statistics.
+    """
+    rng = np.random.RandomState(seed)
+    fileProposals = [jitter_proposals(proposals, rng) for f in partnerFiles]
+    assignment, stats = search_partner_sets(fileProposals, constraints, nBlocks=nBlocks, batchSize=batchSize, maxBatches=maxBatches, rng=rng)
+
+    trialFiles = OrderedDict()
+    for f, fileName in enumerate(partnerFiles):
+        blocks = []
+        for b in range(nBlocks):
+            block = build_block(fileProposals[f], assignment[f, b], rng, constraints)
+            block['partnerBlockNum'] = b + 1
+            block['partnerBlockTrialNum'] = np.arange(1, block.shape[0] + 1)
+            blocks.append(block)
+        trials = pd.concat(blocks, ignore_index=True)
+        trials['overallPartnerTrialNum'] = np.arange(1, trials.shape[0] + 1)
+        trials['blockType'] = 'task'
+        trialFiles[fileName] = trials[trialColumns]
+
+    # practice: one stratified block per file from a separately jittered grid
+    practiceProposals = jitter_proposals(proposals, rng)
+    practiceBlocks = deal_blocks(_strata(practiceProposals), rng, 1, 1, proposals.shape[0] // 20)[0, 0]
+    for p, fileName in enumerate(practiceFiles):
+        block = build_block(practiceProposals, practiceBlocks[p], rng, constraints)
+        block['partnerBlockNum'] = p + 1
+        block['partnerBlockTrialNum'] = np.arange(1, block.shape[0] + 1)
+        block['overallPartnerTrialNum'] = np.arange(1, block.shape[0] + 1) + p * block.shape[0]
+        block['blockType'] = 'practice'
+        trialFiles[fileName] = block[trialColumns]
+
+    return trialFiles, stats
+
+
+def block_summary(trialFiles):
+    """ Constraint values of every block of every trial file (probability balance, advantage, duration, repeats) """
+    rows = []
+    for fileName, trials in trialFiles.items():
+        for blockNum, block in trials.groupby('partnerBlockNum'):
+            advantage = block['selfProp'] - block['otherProp']
+            labels = [block['prob'].values > 50, advantage.values > 0, block['jitterDur'].values, block['itiDur'].values]
+            rows.append(OrderedDict([('file', fileName), ('partnerBlockNum', blockNum),
+                                     ('highProb', (block['prob'] > 50).sum()), ('lowProb', (block['prob'] <= 50).sum()),
+                                     ('meanAdvantage', advantage.mean()), ('meanAbsAdvantage', advantage.abs().mean()),
+                                     ('blockDur', block[['needDur', 'propDur', 'jitterDur', 'itiDur']].values.sum()),
+                                     ('maxRepeats', max(max_repeats(np.asarray(label)[None])[0] for label in labels))]))
+    return pd.DataFrame(rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate the partner and practice trial files from the proposal grid')
+    parser.add_argument('--proposals', default=os.path.join('stim', 'anm1_proposals.csv'), help='proposal grid')
+    parser.add_argument('--out', default='stim_generated', help='directory for the trial files')
+    parser.add_argument('--seed', type=int, default=None, help='seed')
+    parser.add_argument('--maxRepeats', type=int, default=defaultConstraints['maxRepeats'], help='max repeats in a row')
+    parser.add_argument('--maxAdvantageDiff', type=float, default=defaultConstraints['maxAdvantageDiff'], help='max difference in mean advantage across partners')
+    parser.add_argument('--batches', type=int, default=200, help='batches of candidate sets to search')
+    args = parser.parse_args()
+
+    constraints = dict(defaultConstraints, maxRepeats=args.maxRepeats, maxAdvantageDiff=args.maxAdvantageDiff)
+    trialFiles, stats = generate_trial_sets(load_proposals(args.proposals), constraints, seed=args.seed, maxBatches=args.batches)
+    if not os.path.exists(args.out):
+        os.makedirs(args.out)
+    for fileName, trials in trialFiles.items():
+        trials.to_csv(os.path.join(args.out, fileName), header = True, mode = 'w', index = False)
+
+    print('%(candidates)d candidate sets scored (%(candidatesPerSec).0f/s), %(valid)d valid, %(repairedValid)d valid after repair, '
+          'best score %(score).2f' % stats)
+    print('largest difference between blocks of different partners: mean advantage %(maxAdvantageDiff).2f, '
+          'mean |advantage| %(maxAbsAdvantageDiff).2f' % stats)
+    if stats['violation'] > 0:
+        print('WARNING: no trial set satisfied the constraints; the best set exceeds them by %.2f in total '
+              '(%.2f before repair). Relax the constraints or search longer.' %(stats['violation'], stats['searchViolation']))
+    print(block_summary(trialFiles).to_string(index=False))